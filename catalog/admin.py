@@ -1,9 +1,11 @@
 from django.contrib import admin
 
-from .models import Author, Book, BookCopy, Loan, Review
+from .models import Author, Book, BookCopy, Hold, Loan, OverdueNotice, Review
 
 admin.site.register(Author)
 admin.site.register(Book)
 admin.site.register(BookCopy)
+admin.site.register(Hold)
 admin.site.register(Loan)
+admin.site.register(OverdueNotice)
 admin.site.register(Review)
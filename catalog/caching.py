@@ -0,0 +1,62 @@
+"""Helpers for caching catalog data.
+
+Cached values are stored under versioned keys. Bumping a version, which the
+signal handlers in catalog/signals.py do whenever the underlying rows change,
+makes every key built from the old version unreachable, so stale entries are
+never read and simply expire.
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+
+def version_key(name):
+    return f'catalog:version:{name}'
+
+
+def is_process_local(alias):
+    """Returns True if a Django cache is only seen by the process using it."""
+    return isinstance(caches[alias], LocMemCache)
+
+
+def get_version(name, alias='default'):
+    """Returns the current version of a named group of cached values."""
+    return caches[alias].get_or_set(version_key(name), time.time_ns, timeout=None)
+
+
+def get_versions(names, alias='default'):
+    """Returns the current versions of some named groups of cached values, 
+    reading them from the cache at once."""
+    cache = caches[alias]
+    keys = {version_key(name): name for name in names}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    missing = {version_key(name): time.time_ns() for name in names if name not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update({keys[key]: version for key, version in missing.items()})
+    return versions
+
+
+def bump_version(name, alias='default'):
+    """Invalidates every cached value built from the current version once the
+    current transaction commits, so that nothing is cached from rows that are
+    about to change."""
+    transaction.on_commit(lambda: increment_version(name, alias))
+
+
+def increment_version(name, alias='default'):
+    cache = caches[alias]
+    try:
+        cache.incr(version_key(name))
+    except ValueError:
+        cache.set(version_key(name), time.time_ns(), timeout=None)
+
+
+def make_key(prefix, *parts):
+    """Builds a cache key that is safe for every cache backend."""
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'catalog:{prefix}:{digest}'
+
@@ -0,0 +1,276 @@
+"""Creating and closing loans, and setting returned copies aside for holds.
+
+Everything that changes which copies are on loan in bulk lives here, so that
+the derived data kept on books (such as the available copy count) is updated
+in the same transaction as the loans themselves.
+
+A copy that becomes free while its book has waiting holds is set aside for the
+oldest of them, in the transaction that freed it, so that it never shows as
+available to anyone else. Allocation reads the head of the queue through the
+hold queue index, so it costs the same however long the queue is.
+"""
+import datetime
+import random
+import time
+from dataclasses import dataclass, field
+
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Book, BookCopy, Hold, Loan
+
+
+# Number of times a checkout or return is attempted before giving up on a conflict
+CHECKOUT_ATTEMPTS = 10
+
+
+@dataclass
+class CheckoutResult:
+    """The loans created by a checkout, the books they are for, and the books
+    that could not be loaned."""
+    loans: list = field(default_factory=list)
+    books: list = field(default_factory=list)
+    unavailable: list = field(default_factory=list)
+
+
+@dataclass
+class ReturnResult:
+    """The loans closed by a return, the ids of the loans that were not open,
+    the ids of the loans not closed because the return date is before they were
+    made or in the future, and the holds the returned copies were set aside for."""
+    loans: list = field(default_factory=list)
+    not_open: list = field(default_factory=list)
+    invalid_date: list = field(default_factory=list)
+    holds: list = field(default_factory=list)
+
+
+@dataclass
+class RenewResult:
+    """The loans extended by a renewal, the ids of the loans that were not
+    open, the ids of the loans not renewed because the new due date is not after
+    today or is before their current one, and the ids of the loans not renewed
+    because their book has waiting holds."""
+    loans: list = field(default_factory=list)
+    not_open: list = field(default_factory=list)
+    invalid_date: list = field(default_factory=list)
+    held: list = field(default_factory=list)
+
+
+def lock_for_update(queryset, using='default', skip_locked=False):
+    """Locks the rows of a queryset where the database supports it."""
+    features = connections[using].features
+    if skip_locked and features.has_select_for_update_skip_locked:
+        return queryset.select_for_update(skip_locked=True)
+    if features.has_select_for_update:
+        return queryset.select_for_update()
+    return queryset
+
+
+def free_copies(book_ids, using='default'):
+    """Returns the available copies of some books, in book and copy order."""
+    open_loans = Loan.objects.filter(bookcopy=OuterRef('pk'), return_date=None)
+    holds = Hold.objects.filter(bookcopy=OuterRef('pk'))
+    return BookCopy.objects.using(using).filter(
+        book_id__in=book_ids, on_maintenance=False
+    ).filter(~Exists(open_loans), ~Exists(holds)).order_by('book_id', 'pk')
+
+
+def lock_first(queryset, using='default'):
+    """Returns the first row of an ordered queryset that no other transaction
+    has locked, locking it where the database supports it, or None."""
+    return lock_for_update(queryset, using, skip_locked=True).first()
+
+
+def lock_free_copies(book_ids, using='default'):
+    """Returns the id of one available copy of each of some books, by book id,
+    locking them where the database supports it.
+
+    Where locked rows can be skipped, each book's copy is found with its own
+    LIMIT 1 query, so that only the copy claimed is locked and a copy locked
+    by another checkout is passed over for the book's next free one. Locking
+    every free copy instead would make a concurrent checkout of the same book
+    skip them all and find it unavailable. Elsewhere (SQLite, whose writers
+    take turns anyway) one query finds the copies of all the books."""
+    claimed = {}
+    if connections[using].features.has_select_for_update_skip_locked:
+        for book_id in book_ids:
+            copy_id = lock_first(free_copies([book_id], using).values_list('pk', flat=True), using)
+            if copy_id is not None:
+                claimed[book_id] = copy_id
+        return claimed
+    copies = lock_for_update(free_copies(book_ids, using), using)
+    for copy_id, book_id in copies.values_list('pk', 'book_id'):
+        claimed.setdefault(book_id, copy_id)
+    return claimed
+
+
+def allocate_copies(book_ids, using='default'):
+    """Sets the free copies of some books aside for the holds at the head of
+    their queues, returning the holds that were given a copy.
+
+    Copies and holds are locked one at a time, as they are paired, so that
+    concurrent allocations pass over each other's rows rather than skipping
+    all of them. Must run in the transaction that freed the copies, before
+    the books' available copy counts are updated."""
+    waiting_book_ids = sorted(set(
+        Hold.objects.using(using).waiting().filter(book_id__in=book_ids)
+        .order_by().values_list('book_id', flat=True).distinct()
+    ))
+    now = timezone.now()
+    allocated = []
+    for book_id in waiting_book_ids:
+        holds = []
+        while True:
+            copy_id = lock_first(free_copies([book_id], using).exclude(
+                pk__in=[hold.bookcopy_id for hold in holds]).values_list('pk', flat=True), using)
+            if copy_id is None:
+                break
+            hold = lock_first(Hold.objects.using(using).waiting().filter(book_id=book_id).exclude(
+                pk__in=[hold.pk for hold in holds]).order_by('created', 'pk'), using)
+            if hold is None:
+                break
+            hold.bookcopy_id, hold.allocated = copy_id, now
+            holds.append(hold)
+        # A copy can only be set aside once, so a concurrent allocation fails here
+        Hold.objects.using(using).bulk_update(holds, ['bookcopy', 'allocated'])
+        allocated += holds
+    return allocated
+
+
+def is_retryable(error, using='default'):
+    """Returns True if a checkout or return failed only because another one ran
+    at the same time."""
+    if isinstance(error, IntegrityError):
+        # Another transaction loaned or set aside one of the claimed copies first
+        return True
+    # SQLite reports concurrent writers as a locked database
+    return connections[using].vendor == 'sqlite' and 'locked' in str(error)
+
+
+def checkout_books(borrower, books, loan_date, due_back_date, using='default'):
+    """Loans one free copy of each book to a borrower in a single transaction.
+
+    Books without a free copy are reported as unavailable instead of failing
+    the whole checkout. A copy is never loaned twice: copies are locked while
+    being claimed, and the database refuses a second open loan for a copy,
+    in which case the checkout is retried."""
+    return run_with_retries(_checkout_books, borrower, list(books), loan_date, due_back_date, using=using)
+
+
+def return_loans(loan_ids, return_date, using='default'):
+    """Closes some open loans in a single transaction, with one UPDATE for all
+    of them, and sets the copies they free aside for waiting holds.
+
+    Loans that are not open, and loans made after return_date or returned
+    in the future, are reported rather than failing the return."""
+    return run_with_retries(_return_loans, list(loan_ids), return_date, using=using)
+
+
+def renew_loans(loan_ids, due_back_date, using='default'):
+    """Moves the due date of some open loans to due_back_date in a single
+    transaction, with one UPDATE for all of them.
+
+    Loans of books that other users are waiting for are not renewed, nor are
+    loans whose due date would not be after today or would be brought forward.
+    They are reported along with the loans that are not open."""
+    return run_with_retries(_renew_loans, list(loan_ids), due_back_date, using=using)
+
+
+def open_loans_of_copies(copy_ids, using='default'):
+    """Returns the ids of the open loans of some copies, by copy id, with one
+    query through the open loan constraint's index."""
+    return dict(Loan.objects.using(using).open().filter(bookcopy_id__in=copy_ids).values_list('bookcopy_id', 'pk'))
+
+
+def run_with_retries(function, *args, using='default'):
+    """Runs a function in a transaction, retrying it if it conflicted with
+    another one running at the same time."""
+    for attempt in range(CHECKOUT_ATTEMPTS):
+        try:
+            with transaction.atomic(using=using):
+                return function(*args, using)
+        except (IntegrityError, OperationalError) as error:
+            if attempt == CHECKOUT_ATTEMPTS - 1 or not is_retryable(error, using):
+                raise
+            # Back off a little so that competing transactions do not collide again
+            time.sleep(random.uniform(0, min(0.01 * 2 ** attempt, 1)))
+
+
+def _checkout_books(borrower, books, loan_date, due_back_date, using):
+    # Copies set aside for the borrower's holds are theirs, so take those first,
+    # unless one was loaned to someone else in the meantime
+    open_loans = Loan.objects.filter(bookcopy=OuterRef('bookcopy'), return_date=None)
+    holds = list(Hold.objects.using(using).ready().filter(
+        user=borrower, book_id__in=[book.pk for book in books]).annotate(on_loan=Exists(open_loans)))
+    claimed = {hold.book_id: hold.bookcopy_id for hold in holds if not hold.on_loan}
+    claimed.update(lock_free_copies([book.pk for book in books if book.pk not in claimed], using))
+
+    result = CheckoutResult()
+    result.loans = Loan.objects.using(using).bulk_create([
+        Loan(
+            bookcopy_id=claimed[book.pk],
+            borrower=borrower,
+            loan_date=loan_date,
+            due_back_date=due_back_date,
+        )
+        for book in books if book.pk in claimed
+    ])
+    result.books = [book for book in books if book.pk in claimed]
+    result.unavailable = [book for book in books if book.pk not in claimed]
+    # The borrower's holds on the books they got are fulfilled
+    fulfilled = [hold.pk for hold in holds if hold.book_id in claimed]
+    if fulfilled:
+        Hold.objects.using(using).filter(pk__in=fulfilled).delete()
+
+    # bulk_create() sends no signals, so update the counts here
+    Book.objects.using(using).filter(pk__in=claimed).update_available_copies()
+    return result
+
+
+def _return_loans(loan_ids, return_date, using):
+    loans = Loan.objects.using(using).filter(pk__in=loan_ids, return_date=None)
+    loans = list(lock_for_update(loans, using).order_by('pk'))
+    found = {loan.pk for loan in loans}
+    # A loan cannot be returned before it was made, nor on a day still to come
+    today = datetime.date.today()
+    result = ReturnResult(loans=[loan for loan in loans if loan.loan_date <= return_date <= today])
+    returned = {loan.pk for loan in result.loans}
+    result.not_open = [loan_id for loan_id in loan_ids if loan_id not in found]
+    result.invalid_date = [loan.pk for loan in loans if loan.pk not in returned]
+    if not result.loans:
+        return result
+
+    Loan.objects.using(using).filter(pk__in=returned).update(return_date=return_date, updated_at=timezone.now())
+    for loan in result.loans:
+        loan.return_date = return_date
+    book_ids = set(BookCopy.objects.using(using).filter(
+        pk__in=[loan.bookcopy_id for loan in result.loans]).values_list('book_id', flat=True))
+    # update() sends no signals, so set the copies aside and update the counts here
+    result.holds = allocate_copies(book_ids, using)
+    Book.objects.using(using).filter(pk__in=book_ids).update_available_copies()
+    return result
+
+
+def _renew_loans(loan_ids, due_back_date, using):
+    waiting = Hold.objects.waiting().filter(book_id=OuterRef('bookcopy__book_id'))
+    loans = Loan.objects.using(using).filter(pk__in=loan_ids, return_date=None).annotate(held=Exists(waiting))
+    loans = list(lock_for_update(loans, using).order_by('pk'))
+    # Renewing moves a due date later, to a day still to come
+    today = datetime.date.today()
+    valid = [loan for loan in loans if today < due_back_date and loan.due_back_date <= due_back_date]
+    result = RenewResult(loans=[loan for loan in valid if not loan.held])
+    result.held = [loan.pk for loan in valid if loan.held]
+    renewable = {loan.pk for loan in valid}
+    result.invalid_date = [loan.pk for loan in loans if loan.pk not in renewable]
+    found = {loan.pk for loan in loans}
+    result.not_open = [loan_id for loan_id in loan_ids if loan_id not in found]
+    if not result.loans:
+        return result
+
+    # A renewed loan is no longer overdue, so a later notice may mention it again
+    Loan.objects.using(using).filter(pk__in=[loan.pk for loan in result.loans]).update(
+        due_back_date=due_back_date, overdue_notice=None, updated_at=timezone.now())
+    for loan in result.loans:
+        loan.due_back_date, loan.overdue_notice = due_back_date, None
+    return result
@@ -0,0 +1,104 @@
+"""Conditional GET support.
+
+Pages and API responses carry an ETag and a Last-Modified date derived from
+the updated_at timestamps of what they show, which a single cheap query can
+look up. A client sending them back gets 304 Not Modified when nothing has
+changed, without the view querying or rendering anything else.
+
+Books are marked as updated whenever their copies, loans, reviews or authors
+change (see BookQuerySet.touch() and the signal handlers in catalog/signals.py),
+so a book's updated_at dates everything shown about it.
+"""
+import asyncio
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import SESSION_KEY
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .cart import CART_COOKIE
+
+
+def make_etag(request, last_modified, extra):
+    """Returns the ETag of a response showing something last modified at some
+    time, to the user making a request.
+
+    Pages also show who is logged in and what is in their cart, which are read
+    from the session and the cart cookie rather than from the database."""
+    parts = [
+        last_modified.isoformat() if last_modified else '',
+        extra,
+        request.session.get(SESSION_KEY, ''),
+        request.COOKIES.get(CART_COOKIE, ''),
+        request.get_full_path(),
+    ]
+    return f'"{hashlib.md5(repr(parts).encode()).hexdigest()}"'
+
+
+def get_validators(request, lookup, args, kwargs):
+    """Returns the ETag and last modification time of the response to a GET
+    request, or None and None if there are none."""
+    if request.method not in ('GET', 'HEAD'):
+        return None, None
+    state = lookup(request, *args, **kwargs)
+    if state is None:
+        return None, None
+    last_modified, extra = state
+    return make_etag(request, last_modified, extra), last_modified
+
+
+def conditional_response(request, etag, last_modified):
+    """Returns a 304 Not Modified response if the client's copy is current, or None."""
+    if etag is None:
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def add_validators(response, etag, last_modified):
+    if etag is None or response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Responses differ by user, and must be revalidated before being reused
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional(lookup):
+    """Decorates a view to answer conditional GET requests.
+
+    lookup(request, *args, **kwargs) is called with the view's arguments and
+    returns when what the view shows was last modified along with anything else
+    it depends on, such as a row count, so that deleted rows are noticed. It
+    returns None if it cannot tell, in which case the view always runs.
+
+    Async views are supported, with the lookup run in a thread."""
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_view(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(get_validators)(request, lookup, args, kwargs)
+                response = conditional_response(request, etag, last_modified)
+                if response is None:
+                    response = await view_func(request, *args, **kwargs)
+                return add_validators(response, etag, last_modified)
+            return async_view
+
+        @wraps(view_func)
+        def view(request, *args, **kwargs):
+            etag, last_modified = get_validators(request, lookup, args, kwargs)
+            response = conditional_response(request, etag, last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            return add_validators(response, etag, last_modified)
+        return view
+    return decorator
+
+
+def latest(*timestamps):
+    """Returns the latest of some timestamps, ignoring missing ones."""
+    return max((timestamp for timestamp in timestamps if timestamp), default=None)
@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart
+
+
+def cart(request):
+    """Adds the user's cart to the context, loading it only if a template uses it."""
+    return {'cart': SimpleLazyObject(lambda: get_cart(request))}
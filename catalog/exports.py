@@ -0,0 +1,140 @@
+"""Streaming exports of circulation data.
+
+Rows are read from the database in chunks and encoded one at a time, so memory
+use stays flat however large the exported table is. The same exports back the
+staff export views and the export_catalog management command.
+"""
+import csv
+import json
+import zlib
+from dataclasses import dataclass
+from typing import Callable
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Book, Loan, Review
+
+
+# Number of rows fetched from the database at a time
+CHUNK_SIZE = 2000
+# Number of bytes collected before a chunk of output is yielded
+BUFFER_SIZE = 64 * 1024
+
+
+@dataclass
+class Export:
+    """A kind of export: the columns it has, the permission it needs and how
+    its rows are read."""
+    name: str
+    permission: str
+    columns: list
+    rows: Callable
+
+
+def loan_rows(filters):
+    loans = Loan.objects.order_by('pk')
+    if filters.get('date_from'):
+        loans = loans.filter(loan_date__gte=filters['date_from'])
+    if filters.get('date_to'):
+        loans = loans.filter(loan_date__lte=filters['date_to'])
+    if filters.get('status') == 'active':
+        loans = loans.filter(return_date=None)
+    elif filters.get('status') == 'returned':
+        loans = loans.exclude(return_date=None)
+    if filters.get('borrower'):
+        loans = loans.filter(borrower__username=filters['borrower'])
+    return loans.values_list(
+        'pk', 'bookcopy_id', 'bookcopy__book_id', 'bookcopy__book__title', 'borrower__username',
+        'loan_date', 'due_back_date', 'return_date',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def review_rows(filters):
+    reviews = Review.objects.order_by('pk')
+    if filters.get('date_from'):
+        reviews = reviews.filter(timestamp__date__gte=filters['date_from'])
+    if filters.get('date_to'):
+        reviews = reviews.filter(timestamp__date__lte=filters['date_to'])
+    if filters.get('borrower'):
+        reviews = reviews.filter(user__username=filters['borrower'])
+    return reviews.values_list(
+        'pk', 'book_id', 'book__title', 'user__username', 'rating', 'comment', 'timestamp',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def book_rows(filters):
+    # Books are read in primary key ranges so that each range's authors can be
+    # fetched with a single query.
+    last_pk = 0
+    while True:
+        books = list(
+            Book.objects.filter(pk__gt=last_pk).order_by('pk')
+            .prefetch_related('authors')[:CHUNK_SIZE]
+        )
+        if not books:
+            return
+        for book in books:
+            yield (
+                book.pk, book.title, book.author_list(), book.summary, book.cover,
+                book.available_copies_count, book.rating_count, book.average_rating(),
+            )
+        last_pk = books[-1].pk
+
+
+EXPORTS = {
+    export.name: export for export in [
+        Export(
+            'loans', 'catalog.view_loan',
+            ['id', 'bookcopy', 'book', 'title', 'borrower', 'loan_date', 'due_back_date', 'return_date'],
+            loan_rows,
+        ),
+        Export(
+            'books', 'catalog.view_book',
+            ['id', 'title', 'authors', 'summary', 'cover', 'available_copies', 'rating_count', 'average_rating'],
+            book_rows,
+        ),
+        Export(
+            'reviews', 'catalog.view_review',
+            ['id', 'book', 'title', 'user', 'rating', 'comment', 'timestamp'],
+            review_rows,
+        ),
+    ]
+}
+
+
+class Echo:
+    """A file-like object that returns what is written to it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def encode_rows(export, rows, file_format):
+    """Yields each row of an export as CSV or JSON Lines text, after a header row for CSV."""
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(export.columns)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(export.columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream_export(export, filters, file_format='csv', compress=False):
+    """Yields an export as chunks of bytes, gzipped if compress is True."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    buffer = []
+    size = 0
+    for text in encode_rows(export, export.rows(filters), file_format):
+        data = text.encode()
+        if compressor:
+            data = compressor.compress(data)
+        buffer.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if compressor:
+        buffer.append(compressor.flush())
+    yield b''.join(buffer)
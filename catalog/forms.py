@@ -1,4 +1,5 @@
 from django import forms
+from django.db.models import Q
 
 from .models import BookCopy, Loan, Review, Book, Author
 
@@ -49,7 +50,52 @@ class CheckoutForm(forms.Form):
     pass
 
 
+class ExportForm(forms.Form):
+    """Form for choosing the format and filters of a data export."""
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('jsonl', 'JSON Lines')], required=False)
+    gzip = forms.BooleanField(required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    status = forms.ChoiceField(
+        choices=[('', 'All'), ('active', 'Active'), ('returned', 'Returned')], required=False)
+    borrower = forms.CharField(max_length=150, required=False)
+
+    def clean_format(self):
+        return self.cleaned_data['format'] or 'csv'
+
+
+class LoanBatchForm(forms.Form):
+    """Form for returning or renewing a batch of loans at the circulation desk.
+
+    The ids are sent as JSON lists of copy or loan ids, see loan_batch_api."""
+    action = forms.ChoiceField(
+        choices=[('return', 'Return'), ('renew', 'Renew')],
+        widget=forms.Select(attrs={'class': 'form-select'}))
+    kind = forms.ChoiceField(
+        choices=[('copies', 'Copy ids'), ('loans', 'Loan ids')], required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}))
+    ids = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={
+            'class': 'form-control',
+            'rows': 8,
+            'placeholder': 'Scan or type one id per line',
+            }))
+    date = forms.DateField(
+        required=False,
+        help_text="Return date, or new due date for renewals. Today, or in 3 weeks for renewals, if empty.",
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+
+
 class LoanForm(forms.ModelForm):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Each copy is labelled with its book's title. Copies set aside for a
+        # hold are left out, as they are kept for the user waiting for them
+        self.fields['bookcopy'].queryset = BookCopy.objects.select_related('book').filter(
+            Q(holds=None) | Q(pk=self.instance.bookcopy_id))
+
     class Meta:
         model = Loan
         fields = ("bookcopy", "borrower", "loan_date", "due_back_date", "return_date")
@@ -136,6 +182,11 @@ class AuthorForm(StyledValidation, forms.ModelForm):
 class BookCopyForm(StyledValidation, forms.ModelForm):
     """Model form for creating or updating a book copy."""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Each book is labelled with its authors
+        self.fields['book'].queryset = Book.objects.prefetch_related('authors')
+
     class Meta:
         model = BookCopy
         fields = ('book', 'on_maintenance')
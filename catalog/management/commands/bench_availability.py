@@ -0,0 +1,73 @@
+import datetime
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Book, BookCopy, Loan
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares reading availability through the available_copies() subquery "
+        "with reading the stored available_copies_count. "
+        "All generated data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--copies', type=int, default=100000, help="Number of book copies to generate.")
+        parser.add_argument('--books', type=int, default=10000, help="Number of books to generate.")
+        parser.add_argument('--lookups', type=int, default=1000, help="Number of books to look up per method.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            book_ids = self.generate(rng, options['books'], options['copies'])
+            sample = [rng.choice(book_ids) for _ in range(options['lookups'])]
+
+            subquery_time = self.time_lookups(
+                sample, lambda book: book.available_copies().count())
+            counter_time = self.time_lookups(
+                sample, lambda book: book.available_copies_count)
+
+            transaction.set_rollback(True)
+
+        lookups = len(sample)
+        self.stdout.write(f"available_copies().count(): {subquery_time / lookups * 1000:.3f} ms per book")
+        self.stdout.write(f"available_copies_count:     {counter_time / lookups * 1000:.3f} ms per book")
+        if counter_time:
+            self.stdout.write(self.style.SUCCESS(f"Speedup: {subquery_time / counter_time:.1f}x"))
+
+    def generate(self, rng, book_count, copy_count):
+        """Creates books, copies, and loans for about a third of the copies."""
+        user = User.objects.create_user(username='bench-availability')
+        books = Book.objects.bulk_create(
+            [Book(title=f"Book {i}", summary="") for i in range(book_count)],
+            batch_size=1000)
+        book_ids = [book.pk for book in books]
+        copies = BookCopy.objects.bulk_create(
+            [BookCopy(book_id=rng.choice(book_ids), on_maintenance=rng.random() < 0.05)
+             for _ in range(copy_count)],
+            batch_size=1000)
+        copy_ids = [copy.pk for copy in copies]
+        today = datetime.date.today()
+        Loan.objects.bulk_create(
+            [Loan(bookcopy_id=copy_id, borrower=user, loan_date=today,
+                  due_back_date=today + datetime.timedelta(weeks=3))
+             for copy_id in rng.sample(copy_ids, len(copy_ids) // 3)],
+            batch_size=1000)
+        Book.objects.filter(pk__in=book_ids).update_available_copies()
+        return book_ids
+
+    def time_lookups(self, book_ids, read_availability):
+        """Loads each book and reads its availability, returning the total time."""
+        start = time.perf_counter()
+        for book_id in book_ids:
+            read_availability(Book.objects.get(pk=book_id))
+        return time.perf_counter() - start
@@ -0,0 +1,227 @@
+import datetime
+import html
+import json
+import random
+import re
+import statistics
+import subprocess
+import time
+import urllib.parse
+import urllib.request
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from catalog.cart import CART_COOKIE, sign_cart
+from catalog.models import Book
+
+
+User = get_user_model()
+
+ROUTES = ['book list', 'book detail', 'book search', 'book search api', 'author search api',
+          'checkout', 'borrowed', 'active loans']
+# Routes that are paged through by following their Next links, and how many
+# pages are read before starting again from the first
+PAGED_ROUTES = ['book list', 'active loans']
+PAGES = 5
+
+NEXT_LINK = re.compile(r'<a class="page-link" href="\?([^"#]*)">Next</a>')
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests the main catalog routes as a librarian and reports latency percentiles, "
+        "queries per request and throughput for each, saved as JSON. Requests go through "
+        "the test client, inside a transaction that is rolled back, or to a running server "
+        "with --url, which keeps the loans created by checkouts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Number of requests per route.")
+        parser.add_argument('--warmup', type=int, default=10, help="Number of untimed requests per route.")
+        parser.add_argument('--username', default='bench-librarian', help="User the requests are made as.")
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000.")
+        parser.add_argument('--routes', nargs='+', choices=ROUTES, default=ROUTES)
+        parser.add_argument('--output', default='bench_routes.json', help="File the results are saved to.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            self.user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"There is no user named {options['username']}. Run seed_bench first.")
+        self.rng = random.Random(options['seed'])
+        # Query parameters of the next page of each paged route, and its number
+        self.next_pages = {}
+        self.book_ids = list(Book.objects.values_list('pk', flat=True))
+        self.words = [word for title in Book.objects.values_list('title', flat=True)[:200]
+                      for word in title.split()] or ['book']
+        if not self.book_ids:
+            raise CommandError("There are no books. Run seed_bench first.")
+
+        client = Client()
+        client.force_login(self.user)
+        if options['url']:
+            self.send = self.server_sender(options['url'], client.cookies)
+            results = self.run(options)
+        else:
+            self.send = self.client_sender(client)
+            with transaction.atomic():
+                results = self.run(options)
+                transaction.set_rollback(True)
+
+        report = {
+            'commit': self.current_commit(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'mode': 'server' if options['url'] else 'client',
+            'database': connection.vendor,
+            'books': len(self.book_ids),
+            'requests_per_route': options['requests'],
+            'routes': results,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+
+        for name, result in results.items():
+            queries = result['queries_mean']
+            self.stdout.write(
+                f"{name:18} p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+                f"p99 {result['p99_ms']:7.1f} ms  {result['throughput']:7.1f} req/s  "
+                f"{'-' if queries is None else f'{queries:.1f}'} queries"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Saved results to {options['output']}."))
+
+    def run(self, options):
+        results = {}
+        for name in options['routes']:
+            for _ in range(options['warmup']):
+                self.request(name)
+            latencies, queries = [], []
+            start = time.perf_counter()
+            for _ in range(options['requests']):
+                latency, count = self.request(name)
+                latencies.append(latency)
+                queries.append(count)
+            elapsed = time.perf_counter() - start
+            results[name] = summarize(latencies, queries, elapsed)
+        return results
+
+    def request(self, name):
+        """Sends one request to a route, returning its latency and number of queries."""
+        latency, count, content = self.send(*getattr(self, 'request_' + name.replace(' ', '_'))())
+        if name in PAGED_ROUTES:
+            self.follow_next_link(name, content)
+        return latency, count
+
+    def follow_next_link(self, name, content):
+        """Moves a paged route on to the page its Next link points to, which
+        carries a cursor for keyset paginated lists, or back to the first page
+        at the end of the list or after PAGES pages."""
+        params, number = self.next_pages.get(name, ({}, 1))
+        match = NEXT_LINK.search(content)
+        if match is None or number >= PAGES:
+            self.next_pages[name] = ({}, 1)
+        else:
+            self.next_pages[name] = (dict(urllib.parse.parse_qsl(html.unescape(match.group(1)))), number + 1)
+
+    def page_params(self, name):
+        return self.next_pages.get(name, ({}, 1))[0]
+
+    # Each request_* method returns the method, path, data and cookies of one request
+
+    def request_book_list(self):
+        return 'get', reverse('catalog:all-books'), self.page_params('book list'), {}
+
+    def request_book_detail(self):
+        return 'get', reverse('catalog:book-detail', args=(self.rng.choice(self.book_ids),)), {}, {}
+
+    def request_book_search(self):
+        return 'get', reverse('catalog:book-search'), {'query': self.rng.choice(self.words)}, {}
+
+    def request_book_search_api(self):
+        return 'get', reverse('catalog:api-book-search'), {'query': self.rng.choice(self.words), 'cursor': ''}, {}
+
+    def request_author_search_api(self):
+        return 'get', reverse('catalog:api-author-search'), {'query': self.rng.choice(self.words)[:3], 'cursor': ''}, {}
+
+    def request_checkout(self):
+        cart = sign_cart(self.user.pk, self.rng.sample(self.book_ids, min(3, len(self.book_ids))))
+        return 'post', reverse('catalog:checkout'), {}, {CART_COOKIE: cart}
+
+    def request_borrowed(self):
+        return 'get', reverse('catalog:borrowed'), {}, {}
+
+    def request_active_loans(self):
+        return 'get', reverse('catalog:active-loans'), self.page_params('active loans'), {}
+
+    def client_sender(self, client):
+        """Returns a function sending a request through the test client, which
+        returns its latency, number of queries and content."""
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+
+        def send(method, path, data, cookies):
+            for name, value in cookies.items():
+                client.cookies[name] = value
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = getattr(client, method)(path, data, HTTP_HOST=host)
+                latency = time.perf_counter() - start
+            if response.status_code >= 400:
+                raise CommandError(f"{method.upper()} {path} returned {response.status_code}.")
+            return latency, len(queries), response.content.decode()
+        return send
+
+    def server_sender(self, base_url, client_cookies):
+        """Returns a function sending a request to a running server with the
+        session of a logged in client, which returns its latency and content
+        (the number of queries cannot be measured)."""
+        session = f"{settings.SESSION_COOKIE_NAME}={client_cookies[settings.SESSION_COOKIE_NAME].value}"
+        # Any CSRF cookie passes the check if the header matches it
+        csrf_token = get_random_string(32)
+
+        def send(method, path, data, cookies):
+            cookie_header = '; '.join([session] + [f'{name}={value}' for name, value in cookies.items()])
+            url = base_url.rstrip('/') + path
+            body = None
+            headers = {'Cookie': cookie_header}
+            if method == 'get':
+                url += '?' + urllib.parse.urlencode(data)
+            else:
+                headers['Cookie'] += f'; {settings.CSRF_COOKIE_NAME}={csrf_token}'
+                headers['X-CSRFToken'] = csrf_token
+                body = urllib.parse.urlencode(data).encode()
+            request = urllib.request.Request(url, data=body, headers=headers, method=method.upper())
+            start = time.perf_counter()
+            with urllib.request.urlopen(request) as response:
+                content = response.read()
+            return time.perf_counter() - start, None, content.decode()
+        return send
+
+    def current_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                cwd=settings.BASE_DIR).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def summarize(latencies, queries, elapsed):
+    """Returns the latency percentiles, queries per request and throughput of a route."""
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    counted = [count for count in queries if count is not None]
+    return {
+        'requests': len(latencies),
+        'p50_ms': percentiles[49] * 1000,
+        'p95_ms': percentiles[94] * 1000,
+        'p99_ms': percentiles[98] * 1000,
+        'throughput': len(latencies) / elapsed if elapsed else None,
+        'queries_mean': statistics.mean(counted) if counted else None,
+        'queries_max': max(counted) if counted else None,
+    }
@@ -0,0 +1,89 @@
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Commands that serve the site through sync WSGI workers and through ASGI workers
+SERVERS = {
+    'wsgi': ['-m', 'gunicorn', 'locallibrary.wsgi'],
+    'asgi': ['-m', 'gunicorn', 'locallibrary.asgi', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the throughput of concurrent requests to one URL when the site "
+        "is served by sync gunicorn workers (WSGI) and by uvicorn workers (ASGI)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/catalog/api/search/book?query=the', help="Path requested.")
+        parser.add_argument('--requests', type=int, default=1000, help="Number of requests sent to each server.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Number of requests in flight at a time.")
+        parser.add_argument('--workers', type=int, default=2, help="Number of worker processes per server.")
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        url = f"http://127.0.0.1:{options['port']}{options['path']}"
+        results = {}
+        for mode, command in SERVERS.items():
+            server = subprocess.Popen(
+                [sys.executable, *command, '--workers', str(options['workers']),
+                 '--bind', f"127.0.0.1:{options['port']}"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                self.wait_until_listening(options['port'], server)
+                results[mode] = self.load(url, options['requests'], options['concurrency'])
+            finally:
+                server.terminate()
+                server.wait()
+
+            throughput, latencies, errors = results[mode]
+            self.stdout.write(
+                f"{mode}: {throughput:.0f} requests/s, "
+                f"median {statistics.median(latencies) * 1000:.1f} ms, "
+                f"slowest {max(latencies) * 1000:.1f} ms, {errors} errors"
+            )
+        if results['wsgi'][0]:
+            self.stdout.write(self.style.SUCCESS(
+                f"ASGI/WSGI throughput: {results['asgi'][0] / results['wsgi'][0]:.2f}x"))
+
+    def wait_until_listening(self, port, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("The server exited before it started listening.")
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f"The server was not listening after {timeout} seconds.")
+
+    def load(self, url, count, concurrency):
+        """Sends requests with a pool of threads, returning the throughput, 
+        each request's latency and the number of failed requests."""
+        def fetch(_):
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+                ok = True
+            except OSError:
+                ok = False
+            return time.perf_counter() - start, ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            responses = list(executor.map(fetch, range(count)))
+        elapsed = time.perf_counter() - start
+        latencies = [latency for latency, _ in responses]
+        errors = sum(not ok for _, ok in responses)
+        return count / elapsed, latencies, errors
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from catalog.models import JobCheckpoint, Loan
+from catalog.recommendations import DEFAULT_NEIGHBOURS, build_all, build_since, save_neighbours
+
+
+CHECKPOINT_NAME = 'build_recommendations'
+
+
+class Command(BaseCommand):
+    help = (
+        "Computes the books most often borrowed by the borrowers of each book, "
+        "shown as recommendations on book pages. After the first run, only the "
+        "books affected by loans made since the last run are recomputed, unless "
+        "--full is given. Run it regularly, e.g. nightly, with --full now and then "
+        "to account for deleted loans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild every book's recommendations.")
+        parser.add_argument('--neighbours', type=int, default=DEFAULT_NEIGHBOURS,
+                            help="Number of recommendations kept for each book.")
+
+    def handle(self, *args, **options):
+        k = options['neighbours']
+        if k < 1:
+            raise CommandError("At least one neighbour must be kept.")
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            checkpoint, _ = JobCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT_NAME)
+            since = checkpoint.position.get('loan_id')
+            last_loan_id = Loan.objects.aggregate(Max('pk'))['pk__max'] or 0
+            # Changing the number of neighbours needs every book's to be recomputed
+            full = options['full'] or since is None or checkpoint.position.get('neighbours') != k
+            if full:
+                neighbours = build_all(last_loan_id, k)
+            elif last_loan_id > since:
+                neighbours = build_since(since + 1, last_loan_id, k)
+            else:
+                neighbours = {}
+            changed = save_neighbours(neighbours)
+            # Saved in the same transaction, so that the next run starts after these loans
+            checkpoint.position = {'loan_id': last_loan_id, 'neighbours': k}
+            checkpoint.save()
+
+        kind = "Rebuilt" if full else "Refreshed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{kind} the recommendations of {len(neighbours)} books up to loan {last_loan_id} "
+            f"({len(changed)} changed) in {time.perf_counter() - start:.1f} s."
+        ))
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.exports import EXPORTS, stream_export
+from catalog.forms import ExportForm
+
+
+class Command(BaseCommand):
+    help = "Streams an export of loans, books or reviews as CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS), help="What to export.")
+        parser.add_argument('--output', help="File to write to. Defaults to standard output.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip.")
+        parser.add_argument('--date-from', help="Only include rows on or after this date (YYYY-MM-DD).")
+        parser.add_argument('--date-to', help="Only include rows on or before this date (YYYY-MM-DD).")
+        parser.add_argument('--status', choices=['active', 'returned'], help="Only include active or returned loans.")
+        parser.add_argument('--borrower', help="Only include rows for this username.")
+
+    def handle(self, *args, **options):
+        form = ExportForm({
+            'format': options['format'],
+            'gzip': options['gzip'],
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'status': options['status'] or '',
+            'borrower': options['borrower'] or '',
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        chunks = stream_export(
+            EXPORTS[options['name']], form.cleaned_data,
+            form.cleaned_data['format'], form.cleaned_data['gzip'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,148 @@
+import csv
+import itertools
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from catalog.models import Author, Book, BookCopy, JobCheckpoint
+from catalog.search import get_search_backend
+
+
+# Most authors remembered between batches before the lookup table is cleared
+AUTHOR_CACHE_SIZE = 100000
+
+
+def parse_author(author):
+    """Returns the (first_name, last_name) of an author given as a dictionary
+    or as a "Last, First" string."""
+    if isinstance(author, dict):
+        return (author.get('first_name', '').strip(), author.get('last_name', '').strip())
+    last_name, _, first_name = author.partition(',')
+    return (first_name.strip(), last_name.strip())
+
+
+def parse_row(row):
+    """Returns the book fields, authors and number of copies of an imported row."""
+    authors = row.get('authors') or []
+    if isinstance(authors, str):
+        authors = [author for author in authors.split(';') if author.strip()]
+    return (
+        {
+            'title': row['title'].strip(),
+            'summary': (row.get('summary') or '').strip(),
+            'cover': row.get('cover') or None,
+        },
+        [parse_author(author) for author in authors],
+        int(row.get('copies') or 0),
+    )
+
+
+def read_rows(path, file_format):
+    """Yields the rows of a CSV or JSON Lines file one at a time."""
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports books, authors and copies from a CSV or JSON Lines file. "
+        "Each row has a title, summary, cover, authors and copies. In CSV files "
+        "authors are written as \"Last, First; Last, First\"."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="File format, guessed from the extension by default.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of rows imported per transaction.")
+        parser.add_argument('--resume', action='store_true', help="Skip the rows imported by an earlier run of the same file.")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist.")
+
+        checkpoint, _ = JobCheckpoint.objects.get_or_create(name=f'import_catalog:{path}')
+        skip = checkpoint.position.get('rows', 0) if options['resume'] else 0
+        if skip:
+            self.stdout.write(f"Resuming after {skip} rows.")
+
+        self.author_ids = {}
+        self.search = get_search_backend()
+        rows = itertools.islice(read_rows(path, file_format), skip, None)
+        imported = skip
+        start = time.perf_counter()
+        while True:
+            batch = list(itertools.islice(rows, options['batch_size']))
+            if not batch:
+                break
+            try:
+                parsed = [parse_row(row) for row in batch]
+            except (KeyError, ValueError) as error:
+                raise CommandError(f"Invalid row after row {imported}: {error!r}")
+            with transaction.atomic():
+                self.import_batch(parsed)
+                imported += len(batch)
+                # Saved in the same transaction so that a resumed run starts at the right row
+                checkpoint.position = {'rows': imported}
+                checkpoint.save()
+            rate = (imported - skip) / (time.perf_counter() - start)
+            self.stdout.write(f"Imported {imported} rows ({rate:.0f} rows/s)")
+
+        self.stdout.write(self.style.SUCCESS(f"Finished importing {imported - skip} rows."))
+
+    def import_batch(self, parsed):
+        """Creates the books, author links and copies of a batch of parsed rows."""
+        names = {name for _, authors, _ in parsed for name in authors}
+        new_author_ids = self.resolve_authors(names)
+
+        books = Book.objects.bulk_create([Book(**fields) for fields, _, _ in parsed])
+        Book.authors.through.objects.bulk_create([
+            Book.authors.through(book_id=book.pk, author_id=self.author_ids[name])
+            for book, (_, authors, _) in zip(books, parsed)
+            for name in dict.fromkeys(authors)
+        ])
+        BookCopy.objects.bulk_create([
+            BookCopy(book_id=book.pk)
+            for book, (_, _, copies) in zip(books, parsed)
+            for _ in range(copies)
+        ])
+
+        # bulk_create() sends no signals, so update derived data here
+        book_ids = [book.pk for book in books]
+        Book.objects.filter(pk__in=book_ids).update_available_copies()
+        self.search.index_books(book_ids)
+        self.search.index_authors(new_author_ids)
+
+    def resolve_authors(self, names):
+        """Looks up or creates the authors with some names, returning the ids of
+        the authors that were created."""
+        if len(self.author_ids) > AUTHOR_CACHE_SIZE:
+            self.author_ids.clear()
+        missing = [name for name in names if name not in self.author_ids]
+        if not missing:
+            return []
+
+        # Look for authors created before this run, through the name index
+        last_names = {last_name for _, last_name in missing}
+        existing = Author.objects.filter(last_name__in=last_names).order_by('pk').values_list(
+            'pk', 'first_name', 'last_name')
+        for pk, first_name, last_name in existing:
+            if (first_name, last_name) in names:
+                self.author_ids.setdefault((first_name, last_name), pk)
+
+        created = Author.objects.bulk_create([
+            Author(first_name=first_name, last_name=last_name)
+            for first_name, last_name in missing if (first_name, last_name) not in self.author_ids
+        ])
+        for author in created:
+            self.author_ids[(author.first_name, author.last_name)] = author.pk
+        return [author.pk for author in created]
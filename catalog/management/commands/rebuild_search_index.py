@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the book and author search index from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help="Database to rebuild the index of.")
+
+    def handle(self, *args, **options):
+        backend = get_search_backend(options['database'])
+        with transaction.atomic(using=options['database']):
+            backend.create_index()
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the search index with {type(backend).__name__}."))
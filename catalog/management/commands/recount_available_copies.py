@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = "Recounts the stored number of available copies of every book."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of books to recount per transaction.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        recounted = 0
+        while True:
+            pks = list(
+                Book.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                # Also moves updated_at forward, which the books' ETags and
+                # cached page fragments are derived from
+                recounted += Book.objects.filter(pk__in=pks).update_available_copies()
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f"Recounted available copies for {recounted} books."))
@@ -0,0 +1,64 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min
+
+from catalog.models import JobCheckpoint, Loan
+from catalog.rollups import CHECKPOINT_NAME, on_loan_at_end, roll_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds up the loans made and returned on each day, in total and by book, "
+        "author and borrower, for the circulation dashboard. Only the days since "
+        "the last run are rolled up, up to yesterday. Run it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help="Roll up the days from this date (YYYY-MM-DD) again, e.g. after loans were backdated.")
+        parser.add_argument('--chunk-days', type=int, default=31, help="Number of days rolled up per transaction.")
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1:
+            raise CommandError("--chunk-days must be at least 1.")
+        checkpoint, _ = JobCheckpoint.objects.get_or_create(name=CHECKPOINT_NAME)
+        if checkpoint.position.get('day'):
+            start = datetime.date.fromisoformat(checkpoint.position['day']) + datetime.timedelta(days=1)
+        else:
+            start = Loan.objects.aggregate(Min('loan_date'))['loan_date__min']
+            if start is None:
+                self.stdout.write("There are no loans to roll up.")
+                return
+        if options['since']:
+            # Never skip the days that have not been rolled up yet
+            start = min(start, options['since'])
+        end = datetime.date.today() - datetime.timedelta(days=1)
+        if start > end:
+            self.stdout.write(f"Already rolled up until {end}.")
+            return
+
+        # Brought forward from day to day, so it is only counted from the loans once
+        on_loan = on_loan_at_end(start - datetime.timedelta(days=1))
+        position = checkpoint.position
+        rolled_up = 0
+        while start <= end:
+            chunk_end = min(end, start + datetime.timedelta(days=options['chunk_days'] - 1))
+            with transaction.atomic():
+                # Locked while the chunk is rolled up, and checked against where this
+                # run left it, so that a concurrent run stops instead of bringing
+                # its own copy of on_loan forward over the same days
+                checkpoint = JobCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+                if checkpoint.position != position:
+                    raise CommandError(
+                        f"Another run moved the checkpoint to {checkpoint.position.get('day')}, stopping.")
+                rolled_up += roll_up(start, chunk_end, on_loan)
+                # Saved in the same transaction, so that the next run starts after these days
+                position = {'day': chunk_end.isoformat()}
+                checkpoint.position = position
+                checkpoint.save()
+            self.stdout.write(f"Rolled up {start} to {chunk_end}")
+            start = chunk_end + datetime.timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {rolled_up} days, until {end}."))
@@ -0,0 +1,79 @@
+from smtplib import SMTPException
+
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from catalog.models import Loan, OverdueNotice
+from catalog.pagination import CursorPaginator
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends each borrower one notice about their overdue loans. Loans are "
+        "recorded against the notice that mentioned them, so running the scan "
+        "again only notifies borrowers about loans that have since become overdue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of loans read at a time.")
+        parser.add_argument('--dry-run', action='store_true', help="List the notices without sending or recording them.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        loans = Loan.objects.to_notify().select_related('borrower', 'bookcopy__book')
+        paginator = CursorPaginator(loans, options['batch_size'])
+
+        # A borrower's loans can span batches, so their notice is only sent
+        # once a loan for the next borrower (or the end) is reached.
+        notices = 0
+        self.failures = 0
+        pending = []
+        cursor = None
+        while True:
+            page = paginator.page(cursor)
+            for loan in page:
+                if pending and loan.borrower_id != pending[0].borrower_id:
+                    notices += self.notify(pending)
+                    pending = []
+                pending.append(loan)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        if pending:
+            notices += self.notify(pending)
+
+        verb = "Would send" if self.dry_run else "Sent"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {notices} overdue notices."))
+        if self.failures:
+            raise CommandError(f"Could not send {self.failures} overdue notices; their loans are left to the next scan.")
+
+    def notify(self, loans):
+        """Records and sends a notice about some overdue loans of one borrower,
+        returning the number of notices sent."""
+        borrower = loans[0].borrower
+        if self.dry_run:
+            self.stdout.write(f"{borrower.username}: {len(loans)} overdue loans")
+            return 1
+
+        try:
+            with transaction.atomic():
+                notice = OverdueNotice.objects.create(borrower=borrower, email=borrower.email)
+                # Only claim loans that another scan has not already notified about
+                claimed = Loan.objects.filter(
+                    pk__in=[loan.pk for loan in loans], overdue_notice=None
+                ).update(overdue_notice=notice)
+                if not claimed:
+                    transaction.set_rollback(True)
+                    return 0
+                if borrower.email:
+                    # Sent inside the transaction, so a failure leaves the loans to the next scan
+                    message = render_to_string('catalog/overdue_notice.txt', {'borrower': borrower, 'loans': loans})
+                    send_mail("Overdue library books", message, None, [borrower.email])
+        except (SMTPException, OSError) as error:
+            # Reported rather than raised, so that the other borrowers still get their notices
+            self.stderr.write(f"Could not send a notice to {borrower.username}: {error}")
+            self.failures += 1
+            return 0
+        return 1
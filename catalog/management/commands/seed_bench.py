@@ -0,0 +1,162 @@
+import datetime
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from catalog.models import Author, Book, BookCopy, Loan, Review
+from catalog.search import get_search_backend
+
+
+User = get_user_model()
+
+# Number of rows written per query
+BATCH_SIZE = 1000
+
+FIRST_NAMES = [
+    'Ada', 'Ben', 'Chloe', 'Daniel', 'Elif', 'Femi', 'Grace', 'Hiro', 'Ines', 'Jonas',
+    'Kemi', 'Liam', 'Maya', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tara',
+]
+LAST_NAMES = [
+    'Adeyemi', 'Becker', 'Costa', 'Dubois', 'Eriksen', 'Fischer', 'Garcia', 'Hughes', 'Ivanova', 'Jensen',
+    'Kowalski', 'Larsen', 'Moreau', 'Nakamura', 'Okafor', 'Petrov', 'Quispe', 'Rossi', 'Silva', 'Tanaka',
+]
+WORDS = [
+    'river', 'shadow', 'garden', 'winter', 'empire', 'silent', 'golden', 'journey', 'house', 'storm',
+    'forgotten', 'city', 'light', 'night', 'ocean', 'secret', 'last', 'wild', 'glass', 'mountain',
+    'letters', 'road', 'fire', 'summer', 'stranger', 'island', 'broken', 'crown', 'song', 'memory',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates authors, books, copies, users, loans and reviews for benchmarking. "
+        "The same seed always generates the same data. Also creates a '<prefix>-librarian' "
+        "user with every catalog permission, for bench_routes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--copies', type=int, default=30000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--loans', type=int, default=50000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='bench', help="Prefix of the generated usernames.")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f"Users named {prefix}-* already exist. Choose another --prefix.")
+        if options['books'] < 1 or options['copies'] < 1 or options['users'] < 1:
+            raise CommandError("At least one book, copy and user is needed.")
+
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            user_ids = self.create_users(prefix, options['users'])
+            author_ids = self.create_authors(rng, options['authors'])
+            book_ids = self.create_books(rng, options['books'], author_ids)
+            copy_ids = self.create_copies(rng, options['copies'], book_ids)
+            loaned = self.create_loans(rng, options['loans'], copy_ids, user_ids)
+            reviews = self.create_reviews(rng, options['reviews'], loaned)
+
+            # bulk_create() sends no signals, so update derived data here
+            search = get_search_backend()
+            for start in range(0, len(book_ids), BATCH_SIZE):
+                batch = book_ids[start:start + BATCH_SIZE]
+                books = Book.objects.filter(pk__in=batch)
+                books.update_available_copies()
+                books.update_rating_stats()
+                search.index_books(batch)
+            for start in range(0, len(author_ids), BATCH_SIZE):
+                search.index_authors(author_ids[start:start + BATCH_SIZE])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(author_ids)} authors, {len(book_ids)} books, {len(copy_ids)} copies, "
+            f"{len(user_ids)} users, {sum(len(loans) for loans in loaned.values())} loans "
+            f"and {reviews} reviews."
+        ))
+
+    def create_users(self, prefix, count):
+        # Hashing is slow, so every user shares one hashed password
+        password = make_password(prefix)
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}-{i}', password=password) for i in range(count)],
+            batch_size=BATCH_SIZE)
+        librarian = User.objects.create(username=f'{prefix}-librarian', password=password)
+        librarian.user_permissions.set(Permission.objects.filter(content_type__app_label='catalog'))
+        return [user.pk for user in users]
+
+    def create_authors(self, rng, count):
+        authors = Author.objects.bulk_create(
+            [Author(first_name=rng.choice(FIRST_NAMES), last_name=f'{rng.choice(LAST_NAMES)}{i}')
+             for i in range(count)],
+            batch_size=BATCH_SIZE)
+        return [author.pk for author in authors]
+
+    def create_books(self, rng, count, author_ids):
+        books = Book.objects.bulk_create(
+            [Book(
+                title=' '.join(rng.choices(WORDS, k=rng.randint(1, 4))).capitalize(),
+                summary=' '.join(rng.choices(WORDS, k=rng.randint(20, 60))).capitalize() + '.',
+            ) for _ in range(count)],
+            batch_size=BATCH_SIZE)
+        book_ids = [book.pk for book in books]
+        if author_ids:
+            Book.authors.through.objects.bulk_create(
+                [Book.authors.through(book_id=book_id, author_id=author_id)
+                 for book_id in book_ids
+                 for author_id in rng.sample(author_ids, min(len(author_ids), rng.randint(1, 3)))],
+                batch_size=BATCH_SIZE)
+        return book_ids
+
+    def create_copies(self, rng, count, book_ids):
+        copies = BookCopy.objects.bulk_create(
+            [BookCopy(book_id=rng.choice(book_ids), on_maintenance=rng.random() < 0.03)
+             for _ in range(count)],
+            batch_size=BATCH_SIZE)
+        return [copy.pk for copy in copies]
+
+    def create_loans(self, rng, count, copy_ids, user_ids):
+        """Creates returned loans and, on a third of the copies at most, open
+        loans, some of them overdue. Returns the copies loaned to each user."""
+        today = datetime.date.today()
+        open_count = min(count // 5, len(copy_ids) // 3)
+        open_copies = rng.sample(copy_ids, open_count)
+        loans = []
+        for i in range(count):
+            loan_date = today - datetime.timedelta(days=rng.randint(0, 730))
+            due_back_date = loan_date + datetime.timedelta(weeks=3)
+            if i < open_count:
+                copy_id, return_date = open_copies[i], None
+            else:
+                copy_id = rng.choice(copy_ids)
+                return_date = min(today, loan_date + datetime.timedelta(days=rng.randint(1, 30)))
+            loans.append(Loan(
+                bookcopy_id=copy_id, borrower_id=rng.choice(user_ids), loan_date=loan_date,
+                due_back_date=due_back_date, return_date=return_date,
+            ))
+        Loan.objects.bulk_create(loans, batch_size=BATCH_SIZE)
+        loaned = {}
+        for loan in loans:
+            loaned.setdefault(loan.borrower_id, set()).add(loan.bookcopy_id)
+        return loaned
+
+    def create_reviews(self, rng, count, loaned):
+        """Creates reviews of books their users have borrowed, at most one per user and book."""
+        book_of_copy = dict(BookCopy.objects.values_list('pk', 'book_id').iterator())
+        pairs = sorted({
+            (user_id, book_of_copy[copy_id])
+            for user_id, copy_ids in loaned.items() for copy_id in copy_ids
+        })
+        pairs = rng.sample(pairs, min(count, len(pairs)))
+        Review.objects.bulk_create(
+            [Review(user_id=user_id, book_id=book_id, rating=rng.randint(1, 10),
+                    comment=' '.join(rng.choices(WORDS, k=rng.randint(0, 15))).capitalize())
+             for user_id, book_id in pairs],
+            batch_size=BATCH_SIZE)
+        return len(pairs)
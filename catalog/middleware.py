@@ -0,0 +1,368 @@
+import asyncio
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from .timing import RequestTimer
+
+
+logger = logging.getLogger('catalog.queries')
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a view runs more database queries than its budget allows."""
+
+
+def query_budget(queries):
+    """Declares the most database queries a function-based view may run per request.
+
+    A budget is a constant: the queries of the view's slowest path, which must
+    not depend on how many rows it reads. Class-based views declare theirs with
+    a `query_budget` attribute."""
+    def decorator(view_func):
+        view_func.query_budget = queries
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func):
+    """Returns the query budget declared by a view, or None if it has none."""
+    view_class = getattr(view_func, 'view_class', None)
+    if view_class is not None:
+        return getattr(view_class, 'query_budget', None)
+    return getattr(view_func, 'query_budget', None)
+
+
+# The query recorders of the current request
+_current_recorders = contextvars.ContextVar('catalog_query_recorders', default=())
+
+
+class QueryRecorder:
+    """Counts and times the queries run while it is recording."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def add(self, sql, duration):
+        self.duration += duration
+        self.count += 1
+        self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        """Returns the SQL statements that were run more than once and how often."""
+        return {sql: count for sql, count in self.statements.items() if count > 1}
+
+
+class QueryStats:
+    """Query statistics collected for each URL name since the process started."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_url_name = {}
+
+    def record(self, url_name, recorder):
+        with self.lock:
+            stats = self.by_url_name.setdefault(url_name, {
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'db_time': 0.0,
+                'duplicate_queries': 0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            stats['db_time'] += recorder.duration
+            stats['duplicate_queries'] += sum(count - 1 for count in recorder.duplicates.values())
+
+    def snapshot(self):
+        with self.lock:
+            return {url_name: dict(stats) for url_name, stats in self.by_url_name.items()}
+
+    def reset(self):
+        with self.lock:
+            self.by_url_name.clear()
+
+
+query_stats = QueryStats()
+
+
+def record_queries(execute, sql, params, many, context):
+    """Execute wrapper installed on every connection, which passes each query
+    to the recorders of the current request.
+
+    The recorders are found through a context variable rather than wrappers
+    installed per request, because under ASGI a request's queries run on the
+    connection of whichever thread sync_to_async picks, which the context is
+    copied to."""
+    recorders = _current_recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        for recorder in recorders:
+            recorder.add(sql, duration)
+
+
+def install_query_recorder(connection, **kwargs):
+    """Installs record_queries on a connection, once. Connected to connection_created."""
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+@contextmanager
+def recording(recorder):
+    """Records the queries run in the current context (and the threads it is
+    copied to) with a QueryRecorder."""
+    token = _current_recorders.set(_current_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _current_recorders.reset(token)
+
+
+class HybridMiddleware:
+    """Base class for middleware that runs code around the rest of the
+    request, in both sync (WSGI) and async (ASGI) stacks.
+
+    Like Django's MiddlewareMixin, it is called as a coroutine when the
+    middleware after it is async, so that ASGI requests are not moved to a
+    thread. Subclasses implement wrap(), a context manager around the rest of
+    the request that yields a state object, and finish()."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, as MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with self.wrap(request) as state:
+            response = self.get_response(request)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        with self.wrap(request) as state:
+            response = await self.get_response(request)
+        return self.finish(request, response, state)
+
+    @contextmanager
+    def wrap(self, request):
+        yield None
+
+    def finish(self, request, response, state):
+        return response
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    """Records the queries each request runs and enforces per-view query budgets.
+
+    Requests over budget are logged, and raise QueryBudgetExceeded when the
+    QUERY_BUDGET_RAISE setting is on (it defaults to DEBUG)."""
+
+    def wrap(self, request):
+        return recording(QueryRecorder())
+
+    def finish(self, request, response, recorder):
+        match = request.resolver_match
+        url_name = match.view_name if match else None
+        query_stats.record(url_name, recorder)
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and recorder.count > budget:
+            self.report(request, url_name, budget, recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
+
+    def report(self, request, url_name, budget, recorder):
+        message = (
+            f"{url_name} ran {recorder.count} queries in {recorder.duration * 1000:.1f} ms, "
+            f"over its budget of {budget}"
+        )
+        duplicates = recorder.duplicates
+        if duplicates:
+            worst = max(duplicates, key=duplicates.get)
+            message += f"; {len(duplicates)} statements were repeated, most often ({duplicates[worst]} times): {worst}"
+        logger.warning(message, extra={'request': request})
+        if getattr(settings, 'QUERY_BUDGET_RAISE', settings.DEBUG):
+            raise QueryBudgetExceeded(message)
+
+
+class CartMiddleware(HybridMiddleware):
+    """Stores the cart of each request in its cookie if the view changed it.
+
+    Must come after AuthenticationMiddleware, as carts are signed for a user."""
+
+    def finish(self, request, response, state):
+        cart = getattr(request, '_cart', None)
+        if cart is not None:
+            cart.save(response)
+        return response
+
+
+DEFAULT_PROFILING = {
+    'SERVER_TIMING': True,
+    'DIRECTORY': 'profiles',
+    'SAMPLE_RATE': 0,
+    'THRESHOLD_MS': 0,
+    'MAX_FILES': 20,
+}
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """WhiteNoise's middleware, which is sync only in WhiteNoise 6.0, made async
+    capable.
+
+    A single sync only middleware makes Django run every ASGI request in a
+    thread, async views included. Static files are still served through a
+    thread, which only opens the file, and other requests go straight on."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+
+class ServerTimingMiddleware(HybridMiddleware):
+    """Reports the time each request spent on database queries, on rendering
+    templates and in total in a Server-Timing header, and profiles some
+    requests with cProfile.
+
+    Configured with the CATALOG_PROFILING setting. With a SAMPLE_RATE of N,
+    one request in N is profiled. With a THRESHOLD_MS, a request slower than
+    it gets the next request to the same URL name profiled. Profiles are saved
+    to DIRECTORY, in a folder for each URL name holding at most MAX_FILES
+    profiles, and only one request is profiled at a time, which bounds the
+    overhead of profiling in production. cProfile only sees the thread it runs
+    in, so under ASGI profiles cover the event loop rather than the work done
+    in sync_to_async threads, along with any other request served meanwhile.
+
+    Must come first, so that the time of every other middleware is counted."""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.options = {**DEFAULT_PROFILING, **getattr(settings, 'CATALOG_PROFILING', {})}
+        self.profile_lock = threading.Lock()
+        # URL names whose next request is profiled, because one was slow
+        self.flagged = set()
+        self.flagged_lock = threading.Lock()
+
+    @contextmanager
+    def wrap(self, request):
+        state = SimpleNamespace(recorder=QueryRecorder(), profiler=self.start_profiler(request))
+        try:
+            with RequestTimer() as state.timer, recording(state.recorder):
+                yield state
+                state.total_time = state.timer.total_time
+        finally:
+            if state.profiler is not None:
+                state.profiler.disable()
+                self.profile_lock.release()
+
+    def finish(self, request, response, state):
+        recorder, profiler, total_time = state.recorder, state.profiler, state.total_time
+        match = request.resolver_match
+        url_name = match.view_name if match else None
+        threshold = self.options['THRESHOLD_MS']
+        if threshold and total_time * 1000 > threshold and profiler is None:
+            with self.flagged_lock:
+                self.flagged.add(url_name)
+        if profiler is not None:
+            self.save_profile(profiler, url_name, total_time)
+
+        if self.options['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join([
+                f'db;desc="{recorder.count} queries";dur={recorder.duration * 1000:.1f}',
+                f'template;dur={state.timer.template_time * 1000:.1f}',
+                f'total;dur={total_time * 1000:.1f}',
+            ])
+        return response
+
+    def start_profiler(self, request):
+        """Returns a running profiler if the request should be profiled, or None."""
+        sample_rate = self.options['SAMPLE_RATE']
+        sampled = sample_rate and random.randrange(sample_rate) == 0
+        if not sampled and not self.is_flagged(request):
+            return None
+        if not self.profile_lock.acquire(blocking=False):
+            # Another request is being profiled
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running
+            self.profile_lock.release()
+            return None
+        return profiler
+
+    def is_flagged(self, request):
+        if not self.flagged:
+            return False
+        try:
+            url_name = resolve(request.path_info).view_name
+        except Resolver404:
+            url_name = None
+        with self.flagged_lock:
+            if url_name in self.flagged:
+                self.flagged.discard(url_name)
+                return True
+        return False
+
+    def save_profile(self, profiler, url_name, total_time):
+        """Saves a profile in the folder of its URL name, removing the oldest
+        profiles there beyond MAX_FILES. Profiles can be read with pstats."""
+        folder = os.path.join(self.options['DIRECTORY'], re.sub(r'[^\w.-]', '_', url_name or 'unresolved'))
+        try:
+            os.makedirs(folder, exist_ok=True)
+            filename = f'{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}-{total_time * 1000:.0f}ms.prof'
+            profiler.dump_stats(os.path.join(folder, filename))
+            profiles = sorted(
+                (entry for entry in os.scandir(folder) if entry.name.endswith('.prof')),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+            for entry in profiles[:max(0, len(profiles) - self.options['MAX_FILES'])]:
+                os.remove(entry.path)
+        except OSError:
+            logger.exception("Could not save the profile of %s", url_name)
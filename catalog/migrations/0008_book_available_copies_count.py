@@ -0,0 +1,34 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:47
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_available_copies(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookCopy = apps.get_model('catalog', 'BookCopy')
+    Loan = apps.get_model('catalog', 'Loan')
+    open_loans = Loan.objects.filter(bookcopy=OuterRef('pk'), return_date=None)
+    available = BookCopy.objects.filter(
+        book=OuterRef('pk'), on_maintenance=False
+    ).filter(~Exists(open_loans)).order_by().values('book').annotate(
+        count=Count('pk')
+    ).values('count')
+    Book.objects.update(available_copies_count=Coalesce(Subquery(available), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_alter_loan_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_available_copies, migrations.RunPython.noop),
+    ]
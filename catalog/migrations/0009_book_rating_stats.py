@@ -0,0 +1,59 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:49
+
+import catalog.models
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def aggregate_ratings(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    Review = apps.get_model('catalog', 'Review')
+    stats = {}
+    rows = Review.objects.order_by().values('book_id', 'rating').annotate(count=Count('pk'))
+    for row in rows:
+        histogram = stats.setdefault(row['book_id'], [0] * 10)
+        histogram[row['rating'] - 1] = row['count']
+    for book_id, histogram in stats.items():
+        count = sum(histogram)
+        total = sum(rating * n for rating, n in enumerate(histogram, start=1))
+        Book.objects.filter(pk=book_id).update(
+            rating_count=count,
+            rating_sum=total,
+            rating_average=total / count,
+            rating_histogram=histogram,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_book_available_copies_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_average',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_histogram',
+            field=models.JSONField(default=catalog.models.empty_rating_histogram, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-rating_average', 'id'], name='book_rating_idx'),
+        ),
+        migrations.RunPython(aggregate_ratings, migrations.RunPython.noop),
+    ]
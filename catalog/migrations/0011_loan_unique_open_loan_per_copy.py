@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='loan',
+            constraint=models.UniqueConstraint(condition=models.Q(('return_date', None)), fields=('bookcopy',), name='unique_open_loan_per_copy'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.4 on 2026-10-18 17:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0012_author_name_idx_jobcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OverdueNotice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(blank=True, max_length=254)),
+                ('sent', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date', None)), fields=['due_back_date', 'borrower'], name='open_loan_due_idx'),
+        ),
+        migrations.AddField(
+            model_name='overduenotice',
+            name='borrower',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='overdue_notices', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='overdue_notice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loans', to='catalog.overduenotice'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:00
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_reviews(apps, schema_editor):
+    """Keeps only the latest review of each book by each user, and recounts the
+    rating statistics of the books that had duplicates."""
+    Book = apps.get_model('catalog', 'Book')
+    Review = apps.get_model('catalog', 'Review')
+    duplicates = Review.objects.order_by().values('user_id', 'book_id').annotate(
+        count=Count('pk'), latest=Max('pk')).filter(count__gt=1)
+    book_ids = set()
+    for row in duplicates:
+        Review.objects.filter(user_id=row['user_id'], book_id=row['book_id']).exclude(pk=row['latest']).delete()
+        book_ids.add(row['book_id'])
+
+    for book_id in book_ids:
+        histogram = [0] * 10
+        ratings = Review.objects.filter(book_id=book_id).order_by().values('rating').annotate(count=Count('pk'))
+        for row in ratings:
+            histogram[row['rating'] - 1] = row['count']
+        count = sum(histogram)
+        total = sum(rating * n for rating, n in enumerate(histogram, start=1))
+        Book.objects.filter(pk=book_id).update(
+            rating_count=count,
+            rating_sum=total,
+            rating_average=total / count if count else 0,
+            rating_histogram=histogram,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_loan_overdue_notice'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookcopy',
+            index=models.Index(fields=['book', 'on_maintenance'], name='bookcopy_book_maint_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['borrower', 'bookcopy'], name='loan_borrower_copy_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_reviews, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='unique_review_per_user_book'),
+        ),
+    ]
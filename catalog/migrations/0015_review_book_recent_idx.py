@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', '-timestamp', '-id'], name='review_book_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0017_bookrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAuthorCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyBookCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('on_loan', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyBorrowerCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('on_loan', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['loan_date'], name='loan_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['return_date'], name='loan_return_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailyborrowercirculation',
+            name='borrower',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='dailybookcirculation',
+            name='book',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.book'),
+        ),
+        migrations.AddField(
+            model_name='dailyauthorcirculation',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.author'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyborrowercirculation',
+            constraint=models.UniqueConstraint(fields=('day', 'borrower'), name='unique_daily_borrower'),
+        ),
+        migrations.AddIndex(
+            model_name='dailybookcirculation',
+            index=models.Index(fields=['book', 'day'], name='daily_book_book_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailybookcirculation',
+            constraint=models.UniqueConstraint(fields=('day', 'book'), name='unique_daily_book'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyauthorcirculation',
+            constraint=models.UniqueConstraint(fields=('day', 'author'), name='unique_daily_author'),
+        ),
+    ]
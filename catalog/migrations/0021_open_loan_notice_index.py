@@ -0,0 +1,25 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0020_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='loan',
+            name='loan_return_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date', None)), fields=['overdue_notice', 'borrower', 'id'], name='open_loan_notice_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date__isnull', False)), fields=['return_date'], name='loan_return_date_idx'),
+        ),
+    ]
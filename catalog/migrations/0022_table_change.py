@@ -0,0 +1,29 @@
+# Generated by Django 4.0.4 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+def create_table_changes(apps, schema_editor):
+    TableChange = apps.get_model('catalog', 'TableChange')
+    TableChange.objects.bulk_create([
+        TableChange(table=table) for table in ('catalog.author', 'catalog.book', 'catalog.loan')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0021_open_loan_notice_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=100, unique=True)),
+                ('deletions', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_table_changes, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
 from datetime import datetime
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import BooleanField, Case, Count, Exists, ExpressionWrapper, F, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 
@@ -8,14 +11,48 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 User = get_user_model()
 
 
-class Author(models.Model):
+class TracksLoadedValues:
+    """Remembers the field values a model instance was loaded with.
+
+    Signal handlers use these to tell what changed on save without 
+    querying the database for the previous row."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def loaded_value(self, field_name):
+        """Returns the value a field had when the instance was loaded."""
+        return getattr(self, '_loaded_values', {}).get(field_name)
+
+    def save(self, *args, update_fields=None, **kwargs):
+        super().save(*args, update_fields=update_fields, **kwargs)
+        # The saved values are what the database now holds
+        fields = self._meta.concrete_fields
+        if update_fields is not None:
+            fields = [field for field in fields if field.name in update_fields]
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{field.attname: getattr(self, field.attname) for field in fields},
+        }
+
+
+class Author(TracksLoadedValues, models.Model):
     """Model representing an author."""
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     portrait = models.URLField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['pk']
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='author_name_idx'),
+            # When any author last changed, for conditional GETs of the author list
+            models.Index(fields=['updated_at'], name='author_updated_at_idx'),
+        ]
 
     def __str__(self):
         return f'{self.last_name}, {self.first_name}'
@@ -35,15 +72,104 @@ class Author(models.Model):
         }
 
 
+def available_copies():
+    """Returns an expression counting the available copies of a book."""
+    open_loans = Loan.objects.filter(bookcopy=OuterRef('pk'), return_date=None)
+    holds = Hold.objects.filter(bookcopy=OuterRef('pk'))
+    available = BookCopy.objects.filter(
+        book=OuterRef('pk'), on_maintenance=False
+    ).filter(~Exists(open_loans), ~Exists(holds)).order_by().values('book').annotate(
+        count=Count('pk')
+    ).values('count')
+    return Coalesce(Subquery(available), 0)
+
+
+class BookQuerySet(models.QuerySet):
+
+    def touch(self):
+        """Marks every book in the queryset as updated now."""
+        return self.update(updated_at=timezone.now())
+
+    def update_available_copies(self):
+        """Recounts the stored number of available copies for every book in 
+        the queryset, marking them as updated."""
+        return self.update(available_copies_count=available_copies(), updated_at=timezone.now())
+
+    def update_rating_stats(self):
+        """Recomputes the stored rating statistics of every book in the queryset 
+        from its reviews."""
+        histograms = {pk: empty_rating_histogram() for pk in self.values_list('pk', flat=True)}
+        ratings = Review.objects.filter(book_id__in=histograms).order_by().values(
+            'book_id', 'rating').annotate(count=Count('pk'))
+        for row in ratings:
+            histograms[row['book_id']][row['rating'] - 1] = row['count']
+        books = []
+        now = timezone.now()
+        for pk, histogram in histograms.items():
+            count = sum(histogram)
+            total = sum(rating * n for rating, n in enumerate(histogram, start=1))
+            books.append(Book(
+                pk=pk, rating_count=count, rating_sum=total,
+                rating_average=total / count if count else 0, rating_histogram=histogram, updated_at=now,
+            ))
+        return Book.objects.bulk_update(
+            books, ['rating_count', 'rating_sum', 'rating_average', 'rating_histogram', 'updated_at'],
+            batch_size=500)
+
+    def adjust_rating_stats(self, added=None, removed=None):
+        """Adds and/or removes a single rating from the stored rating statistics 
+        of every book in the queryset, marking them as updated.
+        
+        The book rows are locked so that concurrent reviews cannot lose updates."""
+        books = self.select_for_update().only('rating_count', 'rating_sum', 'rating_histogram')
+        for book in books:
+            histogram = list(book.rating_histogram) or empty_rating_histogram()
+            count, total = book.rating_count, book.rating_sum
+            if removed is not None:
+                histogram[removed - 1] -= 1
+                count, total = count - 1, total - removed
+            if added is not None:
+                histogram[added - 1] += 1
+                count, total = count + 1, total + added
+            Book.objects.filter(pk=book.pk).update(
+                rating_count=count,
+                rating_sum=total,
+                rating_average=total / count if count else 0,
+                rating_histogram=histogram,
+                updated_at=timezone.now(),
+            )
+
+
+def empty_rating_histogram():
+    """Returns the number of ratings for each score from 1 to 10, all set to zero."""
+    return [0] * 10
+
+
 class Book(models.Model):
     """Model representing a book."""
     title = models.CharField(max_length=200)
     authors = models.ManyToManyField(Author, related_name='books')
     summary = models.TextField(max_length=10000)
     cover = models.URLField(blank=True, null=True)
+    # Kept up to date by the signal handlers in catalog/signals.py
+    available_copies_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_histogram = models.JSONField(default=empty_rating_histogram, editable=False)
+    # Also moved forward when the book's copies, loans, reviews or authors
+    # change, so that it dates everything shown about the book
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         ordering = ['pk']
+        indexes = [
+            models.Index(fields=['-rating_average', 'id'], name='book_rating_idx'),
+            # When any book last changed, for conditional GETs of the book list
+            models.Index(fields=['updated_at'], name='book_updated_at_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.author_list()}"
@@ -60,16 +186,19 @@ class Book(models.Model):
     def available_copies(self):
         """Returns all available bookcopies 
         
-        i.e book copies thaat are not on loan and not on maintenance."""
+        i.e book copies thaat are not on loan, not on maintenance and not set aside for a hold."""
         return BookCopy.objects.filter(book_id=self.id, on_maintenance=False).exclude(
             id__in=Loan.objects.filter(return_date=None).values_list('bookcopy', flat=True)
-        )
+        ).exclude(holds__isnull=False)
+
+    def is_available(self):
+        """Returns True if at least one copy of the book can be borrowed."""
+        return self.available_copies_count > 0
 
     def average_rating(self):
         """Returns the average rating of a book."""
-        ratings = Review.objects.filter(book_id=self.id).values_list('rating', flat=True)
-        if ratings:
-            return round(sum(ratings) / len(ratings), 1)
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 1)
         else:
             return None
 
@@ -88,48 +217,465 @@ class Book(models.Model):
     
 
 
-class BookCopy(models.Model):
+class BookCopyQuerySet(models.QuerySet):
+
+    def with_on_loan(self):
+        """Annotates each copy with is_on_loan, True if it is currently on loan."""
+        return self.annotate(is_on_loan=Exists(
+            Loan.objects.filter(bookcopy=OuterRef('pk'), return_date=None)
+        ))
+
+
+class BookCopy(TracksLoadedValues, models.Model):
     """Model representing a copy of a book."""
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='copies')
     on_maintenance = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookCopyQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Counting a book's available copies
+            models.Index(fields=['book', 'on_maintenance'], name='bookcopy_book_maint_idx'),
+        ]
 
     def __str__(self):
         return self.book.title
 
+    def save(self, *args, **kwargs):
+        # Saving inside a transaction keeps the availability count in step
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def on_loan(self):
         """Returns True if a book copy is currently on loan and False otherwise."""
         return self.loans.filter(return_date=None).exists()
 
 
-class Loan(models.Model):
+class LoanQuerySet(models.QuerySet):
+
+    def open(self):
+        """Returns loans that have not been returned."""
+        return self.filter(return_date=None)
+
+    def overdue(self):
+        """Returns loans that are overdue, through the open loan due date index."""
+        return self.filter(return_date=None, due_back_date__lte=datetime.today().date())
+
+    def to_notify(self):
+        """Returns overdue loans that no notice has mentioned, by borrower,
+        through the open loan notice index."""
+        return self.overdue().filter(overdue_notice=None).order_by('borrower_id', 'pk')
+
+    def with_overdue(self):
+        """Annotates each loan with overdue, True if it is overdue.
+        
+        This matches Loan.is_overdue() but is computed by the database."""
+        return self.annotate(overdue=ExpressionWrapper(
+            Q(return_date=None, due_back_date__lte=datetime.today().date()),
+            output_field=BooleanField(),
+        ))
+
+
+class Loan(TracksLoadedValues, models.Model):
     """Model representing a loan of a book copy."""
     bookcopy = models.ForeignKey(BookCopy, on_delete=models.CASCADE, related_name='loans')
     borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='loans')
     loan_date = models.DateField()
     due_back_date = models.DateField()
     return_date = models.DateField(blank=True, null=True)
+    overdue_notice = models.ForeignKey(
+        'OverdueNotice', on_delete=models.SET_NULL, blank=True, null=True, related_name='loans')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = LoanQuerySet.as_manager()
 
     class Meta:
         ordering = ['due_back_date']
+        indexes = [
+            # Open loans by due date, for finding overdue loans without a scan
+            models.Index(
+                fields=['due_back_date', 'borrower'],
+                condition=models.Q(return_date=None),
+                name='open_loan_due_idx',
+            ),
+            # Open loans by notice, then in the borrower order that scan_overdue
+            # pages through the ones no notice mentions yet, so the scan needs no sort
+            models.Index(
+                fields=['overdue_notice', 'borrower', 'id'],
+                condition=models.Q(return_date=None),
+                name='open_loan_notice_idx',
+            ),
+            # Finding whether a borrower has loaned a book (can_review)
+            models.Index(fields=['borrower', 'bookcopy'], name='loan_borrower_copy_idx'),
+            # Loans made and returned on given days, for the circulation rollups.
+            # Open loans are left out of the return date index, so that it is no
+            # cheaper than the indexes above for the queries on open loans.
+            models.Index(fields=['loan_date'], name='loan_date_idx'),
+            models.Index(
+                fields=['return_date'],
+                condition=models.Q(return_date__isnull=False),
+                name='loan_return_date_idx',
+            ),
+            # When any loan last changed, for conditional GETs of the active loans
+            models.Index(fields=['updated_at'], name='loan_updated_at_idx'),
+        ]
+        constraints = [
+            # A copy can only be on one open loan at a time
+            models.UniqueConstraint(
+                fields=['bookcopy'],
+                condition=models.Q(return_date=None),
+                name='unique_open_loan_per_copy',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.bookcopy.book.title}; {self.loan_date}'
 
+    def save(self, *args, **kwargs):
+        # Saving inside a transaction keeps the availability count in step
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def is_overdue(self):
         """Returns True if a loan is overdue and False otherwise."""
         return (self.return_date is None) and (self.due_back_date <= datetime.today().date())
 
 
-class Review(models.Model):
+class HoldQuerySet(models.QuerySet):
+
+    def waiting(self):
+        """Returns holds still waiting for a copy, through the hold queue index."""
+        return self.filter(bookcopy=None)
+
+    def ready(self):
+        """Returns holds with a copy set aside for their user."""
+        return self.filter(bookcopy__isnull=False)
+
+
+class Hold(models.Model):
+    """Model representing a user's place in the queue for a book with no available copies.
+    
+    A copy that becomes free is set aside for the hold at the head of the 
+    queue (see catalog/circulation.py) until its user borrows it."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    created = models.DateTimeField(default=timezone.now)
+    bookcopy = models.ForeignKey(
+        BookCopy, on_delete=models.SET_NULL, blank=True, null=True, related_name='holds')
+    allocated = models.DateTimeField(blank=True, null=True)
+
+    objects = HoldQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['book', 'created', 'id']
+        indexes = [
+            # Each book's queue of waiting holds, in order
+            models.Index(
+                fields=['book', 'created', 'id'],
+                condition=models.Q(bookcopy=None),
+                name='hold_queue_idx',
+            ),
+        ]
+        constraints = [
+            # A user has at most one hold on each book
+            models.UniqueConstraint(fields=['user', 'book'], name='unique_hold_per_user_book'),
+            # A copy is set aside for at most one hold
+            models.UniqueConstraint(
+                fields=['bookcopy'],
+                condition=models.Q(bookcopy__isnull=False),
+                name='unique_hold_per_copy',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username}: {self.book.title}'
+
+    def is_ready(self):
+        """Returns True if a copy has been set aside for the hold."""
+        return self.bookcopy_id is not None
+
+    def holds_ahead(self):
+        """Returns the waiting holds ahead of this one in its book's queue.
+
+        The holds placed at the same time but after it are excluded rather than
+        the ones before it included with an OR, so that the database reads a
+        range of the hold queue index that ends at this hold."""
+        return Hold.objects.waiting().filter(book_id=self.book_id, created__lte=self.created).exclude(
+            created=self.created, pk__gte=self.pk)
+
+    def position(self):
+        """Returns the hold's place in its book's queue, starting at 1, or None
+        if a copy has been set aside for it.
+
+        This counts the holds ahead in the hold queue index, so it reads as many
+        index entries as the position, rather than a fixed number of rows. A 
+        stored queue number would instead have to be rewritten for every hold 
+        behind one that is allocated or cancelled."""
+        if self.is_ready():
+            return None
+        return self.holds_ahead().count() + 1
+
+
+class OverdueNotice(models.Model):
+    """Model representing a notice sent to a borrower about their overdue loans."""
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='overdue_notices')
+    email = models.EmailField(blank=True)
+    sent = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.borrower.username}; {self.sent}'
+
+
+class ReviewQuerySet(models.QuerySet):
+
+    def upsert(self, user_id, book_id, rating, comment):
+        """Creates or replaces a user's review of a book with a single 
+        INSERT ... ON CONFLICT statement, returning the rating it replaced, 
+        or None if the review is new.
+        
+        The statement sends no signals, so the book's rating statistics and 
+        updated_at are set here. The book row is locked with a write first, so that 
+        reviews of the same book are applied one at a time."""
+        connection = connections[self.db]
+        timestamp = timezone.now()
+        with transaction.atomic(using=self.db):
+            Book.objects.using(self.db).filter(pk=book_id).update(rating_count=F('rating_count'))
+            previous = self.filter(user_id=user_id, book_id=book_id).values_list('rating', flat=True).first()
+            if connection.vendor in ('sqlite', 'postgresql'):
+                self._insert_on_conflict(connection, user_id, book_id, rating, comment, timestamp)
+            elif previous is None:
+                self.bulk_create([Review(
+                    user_id=user_id, book_id=book_id, rating=rating, comment=comment, timestamp=timestamp)])
+            else:
+                self.filter(user_id=user_id, book_id=book_id).update(
+                    rating=rating, comment=comment, timestamp=timestamp, updated_at=timestamp)
+            Book.objects.using(self.db).filter(pk=book_id).adjust_rating_stats(added=rating, removed=previous)
+        return previous
+
+    def _insert_on_conflict(self, connection, user_id, book_id, rating, comment, timestamp):
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        user, book, rating_column, comment_column, timestamp_column, updated_column = (
+            quote(self.model._meta.get_field(name).column)
+            for name in ('user', 'book', 'rating', 'comment', 'timestamp', 'updated_at')
+        )
+        # An edited review takes the time of the edit, as a new review would
+        sql = (
+            f'INSERT INTO {table} ({user}, {book}, {rating_column}, {comment_column}, {timestamp_column}, '
+            f'{updated_column}) '
+            f'VALUES (%s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT ({user}, {book}) DO UPDATE SET '
+            f'{rating_column} = excluded.{rating_column}, '
+            f'{comment_column} = excluded.{comment_column}, '
+            f'{timestamp_column} = excluded.{timestamp_column}, '
+            f'{updated_column} = excluded.{updated_column}'
+        )
+        timestamp = connection.ops.adapt_datetimefield_value(timestamp)
+        params = [user_id, book_id, rating, comment, timestamp, timestamp]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class Review(TracksLoadedValues, models.Model):
     """Model representing a review made by a user on a book."""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews')
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reviews')
     comment = models.TextField(max_length=1000, blank=True, null=True)
     rating = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(10)])
     timestamp = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ReviewQuerySet.as_manager()
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # A book's most recent reviews
+            models.Index(fields=['book', '-timestamp', '-id'], name='review_book_recent_idx'),
+        ]
+        constraints = [
+            # A user has at most one review of each book
+            models.UniqueConstraint(fields=['user', 'book'], name='unique_review_per_user_book'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username}: {self.rating}; {self.comment}'
+
+    def serialize(self):
+        """Returns review information in a Python dictionary. 
+        
+        This is helpful for returning JSON responses."""
+        return {
+            "user": self.user.username,
+            "rating": self.rating,
+            "comment": self.comment,
+            "timestamp": self.timestamp,
+        }
+
+    def save(self, *args, **kwargs):
+        # Saving inside a transaction keeps the book's rating statistics in step
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+class BookRecommendation(models.Model):
+    """Model representing a book often borrowed by the borrowers of another book.
+    
+    Only the top few recommendations of each book are kept. They are computed 
+    offline by the build_recommendations command."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # Number of users who borrowed both books
+    borrowers = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['book', 'rank']
+        constraints = [
+            # Also the index a book's recommendations are read through, in order
+            models.UniqueConstraint(fields=['book', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} -> {self.recommended_id} ({self.borrowers})'
+
+
+class DailyCirculation(models.Model):
+    """Model representing the loans made and returned on one day, and the 
+    copies on loan at its end. Computed by the rollup_circulation command."""
+    day = models.DateField(unique=True)
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    on_loan = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+
+    def __str__(self):
+        return f'{self.day}: {self.checkouts} out, {self.returns} back'
+
+
+class DailyBookCirculation(models.Model):
+    """Model representing the loans of one book made and returned on one day, 
+    and its copies on loan at the end of the day.
+    
+    There is only a row for the days a book was loaned or returned, since its
+    number of copies on loan stays the same in between."""
+    day = models.DateField()
+    # Indexed by daily_book_book_day_idx
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+', db_index=False)
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    on_loan = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # A book's latest row before a day
+            models.Index(fields=['book', 'day'], name='daily_book_book_day_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'book'], name='unique_daily_book'),
+        ]
+
+
+class DailyAuthorCirculation(models.Model):
+    """Model representing the loans of an author's books made and returned on one day."""
+    day = models.DateField()
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='+')
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'author'], name='unique_daily_author'),
+        ]
+
+
+class DailyBorrowerCirculation(models.Model):
+    """Model representing the loans a user made and returned on one day."""
+    day = models.DateField()
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'borrower'], name='unique_daily_borrower'),
+        ]
+
+
+class JobCheckpoint(models.Model):
+    """Model recording how far a long-running job has got, so that it can resume."""
+    name = models.CharField(max_length=255, unique=True)
+    position = models.JSONField(default=dict)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.position}'
+
+
+class TableChangeQuerySet(models.QuerySet):
+
+    def record_deletion(self, model):
+        """Counts a deletion from a model's table, in the current transaction."""
+        label = model._meta.label_lower
+        if not self.filter(table=label).update(deletions=F('deletions') + 1):
+            self.get_or_create(table=label)
+            self.filter(table=label).update(deletions=F('deletions') + 1)
+
+    def with_last_modified(self, *tables):
+        """Returns the rows of some tables, each annotated with last_modified,
+        when any row of its table last changed, read from the end of the
+        table's updated_at index."""
+        return self.filter(table__in=[model._meta.label_lower for model in tables]).annotate(
+            last_modified=Case(*(
+                When(table=model._meta.label_lower, then=Subquery(
+                    model.objects.order_by('-updated_at').values('updated_at')[:1]))
+                for model in tables
+            ), output_field=models.DateTimeField())
+        )
+
+    def state(self, *tables):
+        """Returns when any row of some tables last changed and how many rows
+        have been deleted from them, with a single query.
+
+        Deleted rows leave no timestamp behind, so the number of deletions
+        stands in for counting the rows."""
+        last_modified = None
+        deletions = dict.fromkeys(model._meta.label_lower for model in tables)
+        for row in self.with_last_modified(*tables):
+            deletions[row.table] = row.deletions
+            if row.last_modified and (last_modified is None or row.last_modified > last_modified):
+                last_modified = row.last_modified
+        missing = [table for table, count in deletions.items() if count is None]
+        if missing:
+            # The rows are created by a migration, but a flushed database has lost them
+            self.bulk_create([TableChange(table=table) for table in missing], ignore_conflicts=True)
+            return self.state(*tables)
+        return last_modified, tuple(deletions.values())
+
+
+class TableChange(models.Model):
+    """Model recording changes to a table that its rows cannot show, which
+    is how many of them have been deleted."""
+    table = models.CharField(max_length=100, unique=True)
+    deletions = models.PositiveBigIntegerField(default=0)
+
+    objects = TableChangeQuerySet.as_manager()
 
     def __str__(self):
-        return f'{self.user.username}: {self.rating}; {self.comment}'
\ No newline at end of file
+        return f'{self.table}: {self.deletions} deletions'
@@ -0,0 +1,167 @@
+"""Keyset (cursor) pagination.
+
+Offset pagination counts every matching row and skips over all earlier rows,
+so deep pages get slower as the catalog grows. Keyset pagination instead asks
+for the rows that come after (or before) the last row shown, using the
+queryset's ordering, which the database can answer straight from an index.
+Pages are identified by opaque cursors rather than page numbers.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor cannot be decoded."""
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Encodes datetimes in full, tagged so that they are decoded as datetimes.
+
+    DjangoJSONEncoder cuts them down to milliseconds, which would make rows
+    whose timestamps differ only in their microseconds fall between pages."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return {'datetime': o.isoformat()}
+        return super().default(o)
+
+
+def decode_value(value):
+    if value.keys() == {'datetime'}:
+        return datetime.datetime.fromisoformat(value['datetime'])
+    return value
+
+
+def encode_cursor(values, backwards=False):
+    data = json.dumps({'v': values, 'b': backwards}, separators=(',', ':'), cls=CursorEncoder)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the ordering values and direction stored in a cursor."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(data, object_hook=decode_value)
+        return list(data['v']), bool(data['b'])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+
+
+class CursorPage:
+    """A page of results and the cursors of the pages around it."""
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Paginates a queryset by the values of its ordering fields.
+
+    The primary key is added to the ordering if it is missing, so that every
+    row has a distinct position."""
+
+    def __init__(self, queryset, per_page):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip('-') in ('pk', queryset.model._meta.pk.name) for field in ordering):
+            ordering.append('pk')
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        self.per_page = per_page
+
+    def position(self, obj):
+        return [getattr(obj, field) for field, descending in self.ordering]
+
+    def beyond(self, values, backwards):
+        """Returns a filter for the rows after a position, or before it if going backwards."""
+        condition = Q()
+        for i, (field, descending) in enumerate(self.ordering):
+            # Rows equal on every earlier field and further along on this one
+            lookup = 'lt' if descending != backwards else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for j, (earlier_field, _) in enumerate(self.ordering[:i]):
+                step &= Q(**{earlier_field: values[j]})
+            condition |= step
+        return condition
+
+    def page(self, cursor=None):
+        """Returns the page a cursor points to, or the first page without a cursor."""
+        queryset = self.queryset
+        backwards = False
+        if cursor:
+            values, backwards = decode_cursor(cursor)
+            if len(values) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            queryset = queryset.filter(self.beyond(values, backwards))
+        if backwards:
+            queryset = queryset.reverse()
+
+        # Fetch one extra row to tell whether there is another page
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = encode_cursor(self.position(rows[-1]))
+            if cursor and (has_more or not backwards):
+                previous_cursor = encode_cursor(self.position(rows[0]), backwards=True)
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+class CursorPaginationMixin:
+    """Lets a list view opt in to cursor pagination by setting cursor_pagination.
+
+    Pages are selected with the 'cursor' query parameter, and the context gets
+    next_page_url and previous_page_url, which keep the other query parameters."""
+    cursor_pagination = False
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.cursor_pagination:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404()
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context.get('page_obj')
+        if self.cursor_pagination and page is not None:
+            context['next_page_url'] = self.cursor_url(page.next_cursor)
+            context['previous_page_url'] = self.cursor_url(page.previous_cursor)
+        return context
+
+    def cursor_url(self, cursor):
+        if cursor is None:
+            return None
+        query = self.request.GET.copy()
+        query['cursor'] = cursor
+        return f'?{query.urlencode()}'
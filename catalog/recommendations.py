@@ -0,0 +1,148 @@
+"""Precomputed "borrowers also borrowed" recommendations.
+
+Books are recommended alongside the books most often borrowed by the same
+users. With U the sparse users × books matrix of who has borrowed what, the
+product UᵀU counts, for every two books, the users who borrowed both. Only the
+top few neighbours of each book are kept, in the BookRecommendation table,
+which the book detail page reads with a single indexed query.
+
+Loans are only ever added, so these counts only grow. An incremental refresh
+recomputes the neighbours of the books borrowed since the last run from the
+loans of their borrowers alone, and merges the new counts into the stored
+neighbours of the books they were borrowed with. This gives the same result
+as a full rebuild, except for deleted or edited loans, which only a full
+rebuild accounts for.
+"""
+import itertools
+
+import numpy as np
+from scipy import sparse
+
+from .models import Book, BookRecommendation, Loan
+
+
+# Number of neighbours kept for each book by default
+DEFAULT_NEIGHBOURS = 10
+# Number of rows read from or written to the database at a time
+BATCH_SIZE = 1000
+
+
+def read_pairs(loans):
+    """Returns the borrower and book ids of the distinct (borrower, book)
+    pairs of some loans, as two arrays."""
+    rows = loans.order_by().values_list('borrower_id', 'bookcopy__book_id').distinct()
+    pairs = np.fromiter(
+        itertools.chain.from_iterable(rows.iterator(chunk_size=BATCH_SIZE)), dtype=np.int64)
+    pairs = pairs.reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def co_borrowers(borrower_ids, book_ids):
+    """Returns the distinct book ids, in matrix order, and the sparse book × book
+    matrix of the number of users who borrowed both books."""
+    users, user_index = np.unique(borrower_ids, return_inverse=True)
+    books, book_index = np.unique(book_ids, return_inverse=True)
+    borrowed = sparse.csr_matrix(
+        (np.ones(len(user_index), dtype=np.int32), (user_index, book_index)),
+        shape=(len(users), len(books)))
+    counts = (borrowed.T @ borrowed).tocsr()
+    # A book is not its own neighbour
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    return books, counts
+
+
+def row_neighbours(books, counts, row):
+    """Returns the ids of a row's neighbours and their numbers of co-borrowers."""
+    start, end = counts.indptr[row], counts.indptr[row + 1]
+    return books[counts.indices[start:end]], counts.data[start:end]
+
+
+def top_neighbours(books, counts, rows, k):
+    """Returns the k neighbours with the most co-borrowers of the books of some
+    rows, as lists of (book id, co-borrowers) pairs. Ties go to the lowest id."""
+    neighbours = {}
+    for row in rows:
+        ids, borrowers = row_neighbours(books, counts, row)
+        order = np.lexsort((ids, -borrowers))[:k]
+        neighbours[int(books[row])] = list(zip(ids[order].tolist(), borrowers[order].tolist()))
+    return neighbours
+
+
+def rank(candidates, k):
+    """Returns the k (book id, co-borrowers) pairs of a dictionary with the most co-borrowers."""
+    return sorted(candidates.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def stored_neighbours(book_ids):
+    """Returns the stored neighbours of some books, in rank order."""
+    book_ids = list(book_ids)
+    stored = {book_id: [] for book_id in book_ids}
+    for start in range(0, len(book_ids), BATCH_SIZE):
+        rows = BookRecommendation.objects.filter(
+            book_id__in=book_ids[start:start + BATCH_SIZE]
+        ).order_by('book_id', 'rank').values_list('book_id', 'recommended_id', 'borrowers')
+        for book_id, recommended_id, borrowers in rows:
+            stored[book_id].append((recommended_id, borrowers))
+    return stored
+
+
+def build_all(last_loan_id, k):
+    """Returns the top k neighbours of every book, from the loans up to last_loan_id."""
+    borrower_ids, book_ids = read_pairs(Loan.objects.filter(pk__lte=last_loan_id))
+    books, counts = co_borrowers(borrower_ids, book_ids)
+    neighbours = top_neighbours(books, counts, range(len(books)), k)
+    # Books no longer borrowed with any other lose their recommendations
+    for book_id in BookRecommendation.objects.order_by().values_list('book_id', flat=True).distinct():
+        neighbours.setdefault(book_id, [])
+    return neighbours
+
+
+def build_since(first_loan_id, last_loan_id, k):
+    """Returns the top k neighbours of the books whose neighbours changed with
+    the loans from first_loan_id to last_loan_id."""
+    new_loans = Loan.objects.filter(pk__gte=first_loan_id, pk__lte=last_loan_id)
+    new_book_ids = set(new_loans.values_list('bookcopy__book_id', flat=True).distinct())
+    if not new_book_ids:
+        return {}
+    borrowers = Loan.objects.filter(
+        bookcopy__book_id__in=new_loans.values('bookcopy__book_id')
+    ).values('borrower_id')
+    borrower_ids, book_ids = read_pairs(Loan.objects.filter(borrower_id__in=borrowers, pk__lte=last_loan_id))
+    books, counts = co_borrowers(borrower_ids, book_ids)
+    rows = np.flatnonzero(np.isin(books, list(new_book_ids)))
+
+    # Every borrower of the new loans' books was read, so their rows are exact
+    neighbours = top_neighbours(books, counts, rows, k)
+    # The other books' counts with the new loans' books can only have grown,
+    # so their neighbours are among their stored ones and those books
+    updates = {}
+    for row in rows:
+        for other_id, borrowers in zip(*row_neighbours(books, counts, row)):
+            if other_id not in new_book_ids:
+                updates.setdefault(int(other_id), {})[int(books[row])] = int(borrowers)
+    for book_id, stored in stored_neighbours(updates).items():
+        neighbours[book_id] = rank({**dict(stored), **updates[book_id]}, k)
+    return neighbours
+
+
+def save_neighbours(neighbours):
+    """Stores the neighbours of some books, rewriting only the books whose
+    neighbours changed. Returns the ids of those books."""
+    changed = []
+    book_ids = list(neighbours)
+    for start in range(0, len(book_ids), BATCH_SIZE):
+        stored = stored_neighbours(book_ids[start:start + BATCH_SIZE])
+        batch = [book_id for book_id, rows in stored.items() if rows != neighbours[book_id]]
+        if not batch:
+            continue
+        BookRecommendation.objects.filter(book_id__in=batch).delete()
+        BookRecommendation.objects.bulk_create([
+            BookRecommendation(book_id=book_id, recommended_id=recommended_id, rank=position, borrowers=borrowers)
+            for book_id in batch
+            for position, (recommended_id, borrowers) in enumerate(neighbours[book_id], start=1)
+        ], batch_size=BATCH_SIZE)
+        # The recommendations are shown on the books' pages
+        Book.objects.filter(pk__in=batch).touch()
+        changed += batch
+    return changed
@@ -0,0 +1,169 @@
+"""Daily circulation rollups for staff reporting.
+
+Counting loans per day, book, author or borrower from the Loan table means
+reading its whole history. Instead, the rollup_circulation command adds up
+each day once it is over into the Daily*Circulation tables, and remembers the
+last day it rolled up in a JobCheckpoint. A run only reads the loans made or
+returned since then, through the loan and return date indexes, and the
+dashboard only reads the rollups of the days it shows, so neither slows down
+as years of loans accumulate.
+
+Loans entered later with an earlier loan or return date are only counted once
+their days are rolled up again, with rollup_circulation --since.
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.db.models import Count, OuterRef, Subquery, Sum
+
+from .models import (
+    Book, DailyAuthorCirculation, DailyBookCirculation, DailyBorrowerCirculation,
+    DailyCirculation, JobCheckpoint, Loan,
+)
+
+
+CHECKPOINT_NAME = 'rollup_circulation'
+# Number of rows shown in each of the dashboard's rankings
+RANKING_SIZE = 10
+
+
+def rolled_up_until():
+    """Returns the last day rolled up, or None if none has been."""
+    checkpoint = JobCheckpoint.objects.filter(name=CHECKPOINT_NAME).first()
+    day = checkpoint.position.get('day') if checkpoint else None
+    return datetime.date.fromisoformat(day) if day else None
+
+
+def on_loan_at_end(day):
+    """Returns the number of copies of each book on loan at the end of a day."""
+    loans = Loan.objects.filter(loan_date__lte=day).order_by()
+    on_loan = Counter()
+    # Two queries rather than one with OR, so that each can use an index
+    for queryset in (loans.filter(return_date=None), loans.filter(return_date__gt=day)):
+        for book_id, count in queryset.values_list('bookcopy__book_id').annotate(Count('pk')):
+            on_loan[book_id] += count
+    return on_loan
+
+
+def daily_counts(key, date_field, start, end):
+    """Returns the number of loans made or returned (depending on date_field)
+    on each day from start to end, by day and key."""
+    rows = Loan.objects.filter(**{f'{date_field}__range': (start, end)}).order_by().values_list(
+        date_field, key).annotate(Count('pk'))
+    return {(day, value): count for day, value, count in rows if value is not None}
+
+
+def count_rows(model, key_field, checkouts, returns):
+    """Returns rollup rows of the loans made and returned by day and key."""
+    return [
+        model(day=day, checkouts=checkouts.get((day, key), 0), returns=returns.get((day, key), 0),
+              **{key_field: key})
+        for day, key in sorted(checkouts.keys() | returns.keys())
+    ]
+
+
+def roll_up(start, end, on_loan):
+    """Rolls up the days from start to end, replacing any rollups they had.
+
+    on_loan holds the number of copies of each book on loan at the end of the
+    day before start, and is brought forward to the end of end."""
+    for model in (DailyCirculation, DailyBookCirculation, DailyAuthorCirculation, DailyBorrowerCirculation):
+        model.objects.filter(day__range=(start, end)).delete()
+
+    book_checkouts = daily_counts('bookcopy__book_id', 'loan_date', start, end)
+    book_returns = daily_counts('bookcopy__book_id', 'return_date', start, end)
+    books_by_day = defaultdict(set)
+    for day, book_id in book_checkouts.keys() | book_returns.keys():
+        books_by_day[day].add(book_id)
+
+    total_on_loan = sum(on_loan.values())
+    days, book_rows = [], []
+    day = start
+    while day <= end:
+        checkouts = returns = 0
+        for book_id in sorted(books_by_day[day]):
+            book_out, book_back = book_checkouts.get((day, book_id), 0), book_returns.get((day, book_id), 0)
+            on_loan[book_id] += book_out - book_back
+            book_rows.append(DailyBookCirculation(
+                day=day, book_id=book_id, checkouts=book_out, returns=book_back,
+                on_loan=max(on_loan[book_id], 0)))
+            checkouts, returns = checkouts + book_out, returns + book_back
+        total_on_loan += checkouts - returns
+        days.append(DailyCirculation(day=day, checkouts=checkouts, returns=returns, on_loan=max(total_on_loan, 0)))
+        day += datetime.timedelta(days=1)
+
+    DailyCirculation.objects.bulk_create(days)
+    DailyBookCirculation.objects.bulk_create(book_rows, batch_size=1000)
+    DailyAuthorCirculation.objects.bulk_create(count_rows(
+        DailyAuthorCirculation, 'author_id',
+        daily_counts('bookcopy__book__authors', 'loan_date', start, end),
+        daily_counts('bookcopy__book__authors', 'return_date', start, end),
+    ), batch_size=1000)
+    DailyBorrowerCirculation.objects.bulk_create(count_rows(
+        DailyBorrowerCirculation, 'borrower_id',
+        daily_counts('borrower_id', 'loan_date', start, end),
+        daily_counts('borrower_id', 'return_date', start, end),
+    ), batch_size=1000)
+    return len(days)
+
+
+def loan_days(start, end, on_loan_before, rows):
+    """Returns the sum over the days from start to end of the copies of a book
+    on loan at the end of each day, from the copies on loan before start and
+    the (day, on_loan) rows of the days it changed."""
+    total, current, since = 0, on_loan_before or 0, start
+    for day, on_loan in rows:
+        total += current * (day - since).days
+        current, since = on_loan, day
+    return total + current * ((end - since).days + 1)
+
+
+def busiest_books(start, end):
+    """Returns the books loaned most often from start to end, with the share
+    of their copies' days they spent on loan."""
+    ranking = list(
+        DailyBookCirculation.objects.filter(day__range=(start, end)).values('book_id', 'book__title')
+        .annotate(checkouts=Sum('checkouts')).order_by('-checkouts', 'book_id')[:RANKING_SIZE]
+    )
+    book_ids = [row['book_id'] for row in ranking]
+    books = Book.objects.filter(pk__in=book_ids).annotate(
+        copy_count=Count('copies'),
+        on_loan_before=Subquery(
+            DailyBookCirculation.objects.filter(book=OuterRef('pk'), day__lt=start)
+            .order_by('-day').values('on_loan')[:1]
+        ),
+    ).values_list('pk', 'copy_count', 'on_loan_before')
+    rows = defaultdict(list)
+    for book_id, day, on_loan in DailyBookCirculation.objects.filter(
+            book_id__in=book_ids, day__range=(start, end)).order_by('book_id', 'day').values_list(
+            'book_id', 'day', 'on_loan'):
+        rows[book_id].append((day, on_loan))
+
+    period = (end - start).days + 1
+    by_id = {row['book_id']: {**row, 'utilization': None} for row in ranking}
+    for book_id, copy_count, on_loan_before in books:
+        if copy_count:
+            days_on_loan = loan_days(start, end, on_loan_before, rows[book_id])
+            by_id[book_id]['utilization'] = days_on_loan / (copy_count * period)
+    return list(by_id.values())
+
+
+def dashboard(end, days):
+    """Returns the circulation over the given number of days up to end, for the staff dashboard."""
+    start = end - datetime.timedelta(days=days - 1)
+    daily = list(DailyCirculation.objects.filter(day__range=(start, end)).order_by('-day'))
+    return {
+        'start': start,
+        'end': end,
+        'daily': daily,
+        'checkouts': sum(day.checkouts for day in daily),
+        'returns': sum(day.returns for day in daily),
+        'peak_on_loan': max((day.on_loan for day in daily), default=0),
+        'busiest_books': busiest_books(start, end),
+        'busiest_authors': DailyAuthorCirculation.objects.filter(day__range=(start, end)).values(
+            'author_id', 'author__first_name', 'author__last_name',
+        ).annotate(checkouts=Sum('checkouts')).order_by('-checkouts', 'author_id')[:RANKING_SIZE],
+        'top_borrowers': DailyBorrowerCirculation.objects.filter(day__range=(start, end)).values(
+            'borrower_id', 'borrower__username',
+        ).annotate(checkouts=Sum('checkouts')).order_by('-checkouts', 'borrower_id')[:RANKING_SIZE],
+    }
@@ -0,0 +1,350 @@
+"""Search backends for books and authors.
+
+Each backend keeps its own index of the catalog, which is updated by the signal
+handlers in catalog/signals.py and rebuilt with `manage.py rebuild_search_index`.
+Searches return ordinary querysets ordered by relevance, so they can be
+paginated like any other queryset.
+
+The backend is chosen from the database vendor unless the
+CATALOG_SEARCH_BACKEND setting names a backend class.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Author, Book
+
+
+def get_search_tokens(query):
+    """Splits a search query into the words it contains."""
+    return re.findall(r'\w+', query.lower())
+
+
+class SearchBackend:
+    """Base class for search backends."""
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def search_books(self, query):
+        """Returns books matching a query, best matches first."""
+        raise NotImplementedError
+
+    def search_authors(self, query):
+        """Returns authors matching a query, best matches first."""
+        raise NotImplementedError
+
+    def create_index(self):
+        """Creates the tables and indexes used by the backend."""
+
+    def drop_index(self):
+        """Drops the tables and indexes used by the backend."""
+
+    def index_books(self, book_ids):
+        """Adds or refreshes books in the index."""
+
+    def remove_books(self, book_ids):
+        """Removes books from the index."""
+
+    def index_authors(self, author_ids):
+        """Adds or refreshes authors in the index."""
+
+    def remove_authors(self, author_ids):
+        """Removes authors from the index."""
+
+    def rebuild(self):
+        """Reindexes every book and author."""
+
+
+class SimpleSearchBackend(SearchBackend):
+    """Searches with icontains filters.
+
+    This needs no index but scans the whole table on every search."""
+
+    def search_books(self, query):
+        tokens = get_search_tokens(query)
+        if not tokens:
+            return Book.objects.none()
+        condition = Q()
+        for token in tokens:
+            condition &= (
+                Q(title__icontains=token) |
+                Q(authors__first_name__icontains=token) |
+                Q(authors__last_name__icontains=token)
+            )
+        return Book.objects.filter(
+            pk__in=Book.objects.filter(condition).values('pk')
+        ).order_by('pk')
+
+    def search_authors(self, query):
+        tokens = get_search_tokens(query)
+        if not tokens:
+            return Author.objects.none()
+        condition = Q()
+        for token in tokens:
+            condition &= Q(first_name__icontains=token) | Q(last_name__icontains=token)
+        return Author.objects.filter(condition).order_by('pk')
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """Searches FTS5 virtual tables, ranked with bm25."""
+
+    # Ranking weights for the title, summary and author columns
+    book_weights = (10.0, 1.0, 5.0)
+
+    def fts_query(self, query):
+        """Builds an FTS5 query matching every word of a query as a prefix."""
+        return ' '.join(f'"{token}"*' for token in get_search_tokens(query))
+
+    def search_books(self, query):
+        match = self.fts_query(query)
+        if not match:
+            return Book.objects.none()
+        weights = ', '.join(str(weight) for weight in self.book_weights)
+        # extra() is the only way to join a table the ORM has no model for. The
+        # index has to be joined rather than read in a RawSQL subquery: bm25()
+        # only works in the query that runs the MATCH, and a subquery ranking
+        # each book would run the full-text query again for every book found.
+        # QueryPlanTests checks that this reads the index rather than the books.
+        return Book.objects.extra(
+            tables=['catalog_book_fts'],
+            where=['catalog_book_fts.rowid = catalog_book.id', 'catalog_book_fts MATCH %s'],
+            params=[match],
+        ).annotate(
+            search_rank=RawSQL(f"bm25(catalog_book_fts, {weights})", [])
+        ).order_by('search_rank', 'pk')
+
+    def search_authors(self, query):
+        match = self.fts_query(query)
+        if not match:
+            return Author.objects.none()
+        # Joined with extra() for the same reasons as in search_books()
+        return Author.objects.extra(
+            tables=['catalog_author_fts'],
+            where=['catalog_author_fts.rowid = catalog_author.id', 'catalog_author_fts MATCH %s'],
+            params=[match],
+        ).annotate(
+            search_rank=RawSQL("bm25(catalog_author_fts)", [])
+        ).order_by('search_rank', 'pk')
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS catalog_book_fts "
+                "USING fts5(title, summary, authors, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS catalog_author_fts "
+                "USING fts5(first_name, last_name, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS catalog_book_fts")
+            cursor.execute("DROP TABLE IF EXISTS catalog_author_fts")
+
+    def _index_books(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO catalog_book_fts (rowid, title, summary, authors) "
+                "SELECT book.id, book.title, book.summary, "
+                "COALESCE((SELECT group_concat(author.first_name || ' ' || author.last_name, ' ') "
+                "FROM catalog_author author INNER JOIN catalog_book_authors book_authors "
+                "ON book_authors.author_id = author.id "
+                "WHERE book_authors.book_id = book.id), '') "
+                f"FROM catalog_book book WHERE {where}", params)
+
+    def _index_authors(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO catalog_author_fts (rowid, first_name, last_name) "
+                f"SELECT id, first_name, last_name FROM catalog_author WHERE {where}", params)
+
+    def index_books(self, book_ids):
+        book_ids = list(book_ids)
+        if book_ids:
+            self.remove_books(book_ids)
+            placeholders = ', '.join(['%s'] * len(book_ids))
+            self._index_books(f"book.id IN ({placeholders})", book_ids)
+
+    def remove_books(self, book_ids):
+        book_ids = list(book_ids)
+        if book_ids:
+            placeholders = ', '.join(['%s'] * len(book_ids))
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM catalog_book_fts WHERE rowid IN ({placeholders})", book_ids)
+
+    def index_authors(self, author_ids):
+        author_ids = list(author_ids)
+        if author_ids:
+            self.remove_authors(author_ids)
+            placeholders = ', '.join(['%s'] * len(author_ids))
+            self._index_authors(f"id IN ({placeholders})", author_ids)
+
+    def remove_authors(self, author_ids):
+        author_ids = list(author_ids)
+        if author_ids:
+            placeholders = ', '.join(['%s'] * len(author_ids))
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM catalog_author_fts WHERE rowid IN ({placeholders})", author_ids)
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DELETE FROM catalog_book_fts")
+            cursor.execute("DELETE FROM catalog_author_fts")
+        self._index_books("1", [])
+        self._index_authors("1", [])
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Searches tsvector documents with GIN indexes, falling back to trigram
+    similarity on names so that misspelled queries still find results."""
+
+    def ts_query(self, query):
+        """Builds a tsquery matching every word of a query as a prefix."""
+        return ' & '.join(f'{token}:*' for token in get_search_tokens(query))
+
+    def search_books(self, query):
+        ts_query = self.ts_query(query)
+        if not ts_query:
+            return Book.objects.none()
+        return Book.objects.filter(
+            pk__in=RawSQL(
+                "SELECT book_id FROM catalog_book_search "
+                "WHERE document @@ to_tsquery('simple', %s) OR names %% %s",
+                [ts_query, query])
+        ).annotate(
+            search_rank=RawSQL(
+                "SELECT ts_rank(document, to_tsquery('simple', %s)) + similarity(names, %s) "
+                "FROM catalog_book_search WHERE book_id = catalog_book.id",
+                [ts_query, query])
+        ).order_by('-search_rank', 'pk')
+
+    def search_authors(self, query):
+        ts_query = self.ts_query(query)
+        if not ts_query:
+            return Author.objects.none()
+        return Author.objects.filter(
+            pk__in=RawSQL(
+                "SELECT author_id FROM catalog_author_search "
+                "WHERE document @@ to_tsquery('simple', %s) OR names %% %s",
+                [ts_query, query])
+        ).annotate(
+            search_rank=RawSQL(
+                "SELECT ts_rank(document, to_tsquery('simple', %s)) + similarity(names, %s) "
+                "FROM catalog_author_search WHERE author_id = catalog_author.id",
+                [ts_query, query])
+        ).order_by('-search_rank', 'pk')
+
+    def create_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS catalog_book_search ("
+                "book_id bigint PRIMARY KEY REFERENCES catalog_book (id) ON DELETE CASCADE, "
+                "document tsvector NOT NULL, "
+                "names text NOT NULL)")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS catalog_book_search_document "
+                "ON catalog_book_search USING gin (document)")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS catalog_book_search_names "
+                "ON catalog_book_search USING gin (names gin_trgm_ops)")
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS catalog_author_search ("
+                "author_id bigint PRIMARY KEY REFERENCES catalog_author (id) ON DELETE CASCADE, "
+                "document tsvector NOT NULL, "
+                "names text NOT NULL)")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS catalog_author_search_document "
+                "ON catalog_author_search USING gin (document)")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS catalog_author_search_names "
+                "ON catalog_author_search USING gin (names gin_trgm_ops)")
+
+    def drop_index(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS catalog_book_search")
+            cursor.execute("DROP TABLE IF EXISTS catalog_author_search")
+
+    def _index_books(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO catalog_book_search (book_id, document, names) "
+                "SELECT book.id, "
+                "setweight(to_tsvector('simple', book.title), 'A') || "
+                "setweight(to_tsvector('simple', COALESCE(author_names.names, '')), 'B') || "
+                "setweight(to_tsvector('simple', book.summary), 'C'), "
+                "book.title || ' ' || COALESCE(author_names.names, '') "
+                "FROM catalog_book book LEFT JOIN ("
+                "SELECT book_authors.book_id, "
+                "string_agg(author.first_name || ' ' || author.last_name, ' ') AS names "
+                "FROM catalog_book_authors book_authors INNER JOIN catalog_author author "
+                "ON book_authors.author_id = author.id GROUP BY book_authors.book_id"
+                ") author_names ON author_names.book_id = book.id "
+                f"WHERE {where} "
+                "ON CONFLICT (book_id) DO UPDATE "
+                "SET document = EXCLUDED.document, names = EXCLUDED.names", params)
+
+    def _index_authors(self, where, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO catalog_author_search (author_id, document, names) "
+                "SELECT id, to_tsvector('simple', first_name || ' ' || last_name), "
+                "first_name || ' ' || last_name FROM catalog_author "
+                f"WHERE {where} "
+                "ON CONFLICT (author_id) DO UPDATE "
+                "SET document = EXCLUDED.document, names = EXCLUDED.names", params)
+
+    def index_books(self, book_ids):
+        book_ids = list(book_ids)
+        if book_ids:
+            self._index_books("book.id = ANY(%s)", [book_ids])
+
+    def remove_books(self, book_ids):
+        book_ids = list(book_ids)
+        if book_ids:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM catalog_book_search WHERE book_id = ANY(%s)", [book_ids])
+
+    def index_authors(self, author_ids):
+        author_ids = list(author_ids)
+        if author_ids:
+            self._index_authors("id = ANY(%s)", [author_ids])
+
+    def remove_authors(self, author_ids):
+        author_ids = list(author_ids)
+        if author_ids:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM catalog_author_search WHERE author_id = ANY(%s)", [author_ids])
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("TRUNCATE catalog_book_search, catalog_author_search")
+        self._index_books("TRUE", [])
+        self._index_authors("TRUE", [])
+
+
+backends_by_vendor = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    """Returns the search backend for a database connection."""
+    backend_path = getattr(settings, 'CATALOG_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)(using)
+    vendor = connections[using].vendor
+    return backends_by_vendor.get(vendor, SimpleSearchBackend)(using)
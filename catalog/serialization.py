@@ -0,0 +1,292 @@
+"""Cache-aside storage of serialized models.
+
+The JSON APIs serialize the same books and authors for request after request.
+Serialized payloads are cached under keys holding a version for the model and
+a version for the object, which the signal handlers in catalog/signals.py bump
+whenever the object, or anything it serializes (such as a book's authors),
+changes. Objects whose payload is missing are serialized together, after
+prefetching what their serialize() method reads.
+
+The store is chosen with the CATALOG_SERIALIZATION_CACHE setting, for example:
+
+    {'BACKEND': 'memory', 'MAX_ENTRIES': 10000, 'TIMEOUT': 3600}
+    {'BACKEND': 'file', 'LOCATION': '/var/tmp/catalog', 'VERSIONS': 'shared'}
+    {'BACKEND': 'django', 'LOCATION': 'shared', 'VERSIONS': 'shared'}
+
+The memory and file stores evict the least recently used payloads once they
+hold MAX_ENTRIES, and every store drops payloads TIMEOUT seconds after they
+were cached, so that a payload whose version bump was missed is not served
+forever. The django store uses a configured Django cache, which enforces its
+own limits.
+
+The versions are kept in the Django cache named by VERSIONS ('default' if
+not given). A store shared by several processes, as the file store and a
+django store on a shared cache are, needs its versions in a shared cache
+too: with versions in one process's memory, a change bumps them in that
+process only, and the others keep reading the old payloads. Such settings
+are refused with ImproperlyConfigured.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import prefetch_related_objects
+
+from .caching import bump_version, get_versions, is_process_local, make_key
+
+
+DEFAULT_SETTINGS = {'BACKEND': 'memory', 'MAX_ENTRIES': 10000, 'TIMEOUT': 3600, 'VERSIONS': 'default'}
+
+
+def expiry(timeout):
+    """Returns when a payload cached now expires, or None if it never does."""
+    return None if timeout is None else time.time() + timeout
+
+
+def is_expired(expires):
+    return expires is not None and expires <= time.time()
+
+
+class MemoryStore:
+    """Stores payloads in a dictionary in each process, evicting the least
+    recently used."""
+    shared = False
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        # Maps each key to its payload and expiry time
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key not in self.entries:
+                    continue
+                value, expires = self.entries[key]
+                if is_expired(expires):
+                    del self.entries[key]
+                else:
+                    self.entries.move_to_end(key)
+                    found[key] = value
+        return found
+
+    def set_many(self, values):
+        expires = expiry(self.timeout)
+        with self.lock:
+            self.entries.update((key, (value, expires)) for key, value in values.items())
+            for key in values:
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FileStore:
+    """Stores payloads as JSON files in a directory shared by every process.
+
+    Reading a file updates its modification time, so that the least recently
+    used files are the ones removed once there are too many. Each file holds
+    its expiry time along with the payload."""
+    shared = True
+
+    def __init__(self, location, max_entries, timeout):
+        self.location = location
+        self.max_entries = max_entries
+        self.timeout = timeout
+        os.makedirs(location, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.location, hashlib.md5(key.encode()).hexdigest() + '.json')
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            path = self.path(key)
+            try:
+                with open(path, encoding='utf-8') as file:
+                    entry = json.load(file)
+                if is_expired(entry['expires']):
+                    os.remove(path)
+                    continue
+                found[key] = entry['value']
+                os.utime(path)
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        return found
+
+    def set_many(self, values):
+        expires = expiry(self.timeout)
+        for key, value in values.items():
+            # Written to a temporary file first, so that readers never see half a file
+            fd, temporary = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({'expires': expires, 'value': value}, file)
+            os.replace(temporary, self.path(key))
+        self.cull()
+
+    def cull(self):
+        entries = [entry for entry in os.scandir(self.location) if entry.name.endswith('.json')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return sum(1 for entry in os.scandir(self.location) if entry.name.endswith('.json'))
+
+    def clear(self):
+        for entry in os.scandir(self.location):
+            if entry.name.endswith('.json'):
+                os.remove(entry.path)
+
+
+class DjangoCacheStore:
+    """Stores payloads in one of the Django caches."""
+
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.shared = not is_process_local(alias)
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set_many(self, values):
+        self.cache.set_many(values, timeout=self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+def create_store(options):
+    backend = options.get('BACKEND', 'memory')
+    max_entries = options.get('MAX_ENTRIES', DEFAULT_SETTINGS['MAX_ENTRIES'])
+    timeout = options.get('TIMEOUT', DEFAULT_SETTINGS['TIMEOUT'])
+    if backend == 'memory':
+        store = MemoryStore(max_entries, timeout)
+    elif backend == 'file':
+        store = FileStore(options['LOCATION'], max_entries, timeout)
+    elif backend == 'django':
+        store = DjangoCacheStore(options.get('LOCATION', 'default'), timeout)
+    else:
+        raise ValueError(f"Unknown serialization cache backend: {backend}")
+    versions = options.get('VERSIONS', DEFAULT_SETTINGS['VERSIONS'])
+    if store.shared and is_process_local(versions):
+        raise ImproperlyConfigured(
+            f"The {backend} serialization cache is shared by every process, so its versions must be "
+            f"kept in a shared cache too, but the '{versions}' cache is local to each process. "
+            f"Set VERSIONS in CATALOG_SERIALIZATION_CACHE to a shared cache alias."
+        )
+    return store
+
+
+def model_version_name(model):
+    return f'serialized:{model._meta.label_lower}'
+
+
+def object_version_name(model, pk):
+    return f'serialized:{model._meta.label_lower}:{pk}'
+
+
+class SerializationCache:
+    """Serializes objects through a store of cached payloads, counting hits
+    and misses per model."""
+
+    def __init__(self, store, versions='default'):
+        self.store = store
+        # Alias of the Django cache holding the versions
+        self.versions = versions
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def serialize(self, objects, prefetch=()):
+        """Returns the serialize() payloads of some objects of one model,
+        computing only those that are not cached."""
+        objects = list(objects)
+        if not objects:
+            return []
+        model = type(objects[0])
+        names = [object_version_name(model, obj.pk) for obj in objects]
+        versions = get_versions([model_version_name(model), *names], self.versions)
+        model_version = versions[model_version_name(model)]
+        keys = [
+            make_key('serialized', model._meta.label_lower, model_version, obj.pk, versions[name])
+            for obj, name in zip(objects, names)
+        ]
+
+        payloads = self.store.get_many(keys)
+        missing = [(obj, key) for obj, key in zip(objects, keys) if key not in payloads]
+        if missing:
+            if prefetch:
+                prefetch_related_objects([obj for obj, _ in missing], *prefetch)
+            fresh = {key: obj.serialize() for obj, key in missing}
+            self.store.set_many(fresh)
+            payloads.update(fresh)
+
+        with self.lock:
+            self.hits[model._meta.label_lower] += len(objects) - len(missing)
+            self.misses[model._meta.label_lower] += len(missing)
+        return [payloads[key] for key in keys]
+
+    def stats(self):
+        """Returns the hits and misses of each model since the process started."""
+        with self.lock:
+            stats = {
+                label: {'hits': self.hits[label], 'misses': self.misses[label]}
+                for label in sorted(self.hits | self.misses)
+            }
+        try:
+            entries = len(self.store)
+        except TypeError:
+            entries = None
+        return {'backend': type(self.store).__name__, 'entries': entries, 'models': stats}
+
+
+_cache = None
+_cache_options = None
+_cache_lock = threading.Lock()
+
+
+def get_serialization_cache():
+    """Returns the serialization cache described by the CATALOG_SERIALIZATION_CACHE setting."""
+    global _cache, _cache_options
+    options = getattr(settings, 'CATALOG_SERIALIZATION_CACHE', DEFAULT_SETTINGS)
+    with _cache_lock:
+        if _cache is None or options != _cache_options:
+            _cache = SerializationCache(
+                create_store(options), options.get('VERSIONS', DEFAULT_SETTINGS['VERSIONS']))
+            _cache_options = options
+        return _cache
+
+
+def serialize_objects(objects, prefetch=()):
+    """Returns the serialize() payloads of some objects of one model, from the cache where possible."""
+    return get_serialization_cache().serialize(objects, prefetch)
+
+
+def invalidate_serialized(model, pks):
+    """Makes the cached payloads of some objects stale once the current transaction commits."""
+    versions = get_serialization_cache().versions
+    for pk in set(pks) - {None}:
+        bump_version(object_version_name(model, pk), versions)
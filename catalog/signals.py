@@ -0,0 +1,169 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .circulation import allocate_copies
+from .models import Author, Book, BookCopy, Hold, Loan, Review, TableChange
+from .search import get_search_backend
+from .serialization import invalidate_serialized
+
+
+@receiver(post_save, sender=BookCopy)
+def bookcopy_saved(sender, instance, created, **kwargs):
+    """Updates the availability count of a book when one of its copies changes."""
+    previous_book_id = instance.loaded_value('book_id')
+    if created or previous_book_id != instance.book_id:
+        book_ids = {instance.book_id, previous_book_id} - {None}
+    elif instance.loaded_value('on_maintenance') != instance.on_maintenance:
+        book_ids = {instance.book_id}
+    else:
+        return
+    if not created and (instance.on_maintenance or previous_book_id != instance.book_id):
+        # The hold the copy was set aside for goes back to the head of its queue
+        Hold.objects.filter(bookcopy=instance).update(bookcopy=None, allocated=None)
+    allocate_copies(book_ids)
+    Book.objects.filter(pk__in=book_ids).update_available_copies()
+
+
+@receiver(post_delete, sender=BookCopy)
+def bookcopy_deleted(sender, instance, **kwargs):
+    # A hold the copy was set aside for is back at the head of the queue
+    allocate_copies([instance.book_id])
+    Book.objects.filter(pk=instance.book_id).update_available_copies()
+
+
+@receiver(post_save, sender=Loan)
+def loan_saved(sender, instance, created, **kwargs):
+    """Updates the availability count of a book when a loan is made or returned."""
+    previous_bookcopy_id = instance.loaded_value('bookcopy_id')
+    if created or previous_bookcopy_id != instance.bookcopy_id:
+        bookcopy_ids = {instance.bookcopy_id, previous_bookcopy_id} - {None}
+    elif instance.loaded_value('return_date') != instance.return_date:
+        bookcopy_ids = {instance.bookcopy_id}
+    else:
+        return
+    if instance.return_date is None:
+        # A copy set aside for a hold was loaned anyway, so the hold fulfilled by
+        # it is done and any other goes back to the head of its queue
+        Hold.objects.filter(bookcopy_id=instance.bookcopy_id, user_id=instance.borrower_id).delete()
+        Hold.objects.filter(bookcopy_id=instance.bookcopy_id).update(bookcopy=None, allocated=None)
+    book_ids = set(BookCopy.objects.filter(pk__in=bookcopy_ids).values_list('book_id', flat=True))
+    allocate_copies(book_ids)
+    Book.objects.filter(pk__in=book_ids).update_available_copies()
+
+
+@receiver(post_delete, sender=Loan)
+def loan_deleted(sender, instance, using, **kwargs):
+    TableChange.objects.using(using).record_deletion(Loan)
+    if instance.return_date is None:
+        book_ids = set(BookCopy.objects.filter(pk=instance.bookcopy_id).values_list('book_id', flat=True))
+        allocate_copies(book_ids)
+        Book.objects.filter(pk__in=book_ids).update_available_copies()
+
+
+@receiver(post_save, sender=Hold)
+def hold_saved(sender, instance, created, **kwargs):
+    """Sets a free copy aside for a new hold, and updates the book's page,
+    which shows the queue."""
+    if created:
+        allocate_copies([instance.book_id])
+    Book.objects.filter(pk=instance.book_id).update_available_copies()
+
+
+@receiver(post_delete, sender=Hold)
+def hold_deleted(sender, instance, **kwargs):
+    """Passes the copy set aside for a cancelled hold on to the next one in the queue."""
+    if instance.bookcopy_id is not None:
+        allocate_copies([instance.book_id])
+    Book.objects.filter(pk=instance.book_id).update_available_copies()
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    """Updates the rating statistics of a book when a review is posted or edited."""
+    if created:
+        Book.objects.filter(pk=instance.book_id).adjust_rating_stats(added=instance.rating)
+        return
+    previous_book_id = instance.loaded_value('book_id')
+    previous_rating = instance.loaded_value('rating')
+    if previous_book_id != instance.book_id:
+        Book.objects.filter(pk=previous_book_id).adjust_rating_stats(removed=previous_rating)
+        Book.objects.filter(pk=instance.book_id).adjust_rating_stats(added=instance.rating)
+    elif previous_rating != instance.rating:
+        Book.objects.filter(pk=instance.book_id).adjust_rating_stats(
+            added=instance.rating, removed=previous_rating)
+    else:
+        # Only the comment changed, which the book's page shows too
+        Book.objects.filter(pk=instance.book_id).touch()
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    rating = instance.loaded_value('rating') or instance.rating
+    Book.objects.filter(pk=instance.book_id).adjust_rating_stats(removed=rating)
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, using, **kwargs):
+    """Keeps the search index in step with a book's title and summary."""
+    get_search_backend(using).index_books([instance.pk])
+    invalidate_serialized(Book, [instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, using, **kwargs):
+    get_search_backend(using).remove_books([instance.pk])
+    TableChange.objects.using(using).record_deletion(Book)
+    invalidate_serialized(Book, [instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def book_authors_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """Reindexes books whose authors were added or removed."""
+    if action == 'pre_clear' and reverse:
+        # Remember the books, their links are gone once the signal is sent again
+        instance._cleared_book_ids = list(instance.books.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            book_ids = [instance.pk]
+        elif action == 'post_clear':
+            book_ids = getattr(instance, '_cleared_book_ids', [])
+        else:
+            book_ids = pk_set
+        get_search_backend(using).index_books(book_ids)
+        Book.objects.filter(pk__in=book_ids).touch()
+        # Serialized books list their authors' names
+        invalidate_serialized(Book, book_ids)
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, using, **kwargs):
+    """Keeps the search index in step with an author's name."""
+    backend = get_search_backend(using)
+    backend.index_authors([instance.pk])
+    name_changed = (
+        instance.loaded_value('first_name') != instance.first_name or
+        instance.loaded_value('last_name') != instance.last_name
+    )
+    if not created and name_changed:
+        book_ids = list(instance.books.values_list('pk', flat=True))
+        backend.index_books(book_ids)
+        Book.objects.filter(pk__in=book_ids).touch()
+        invalidate_serialized(Book, book_ids)
+    invalidate_serialized(Author, [instance.pk])
+
+
+@receiver(pre_delete, sender=Author)
+def author_deleting(sender, instance, **kwargs):
+    instance._deleted_book_ids = list(instance.books.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, using, **kwargs):
+    backend = get_search_backend(using)
+    backend.remove_authors([instance.pk])
+    TableChange.objects.using(using).record_deletion(Author)
+    book_ids = getattr(instance, '_deleted_book_ids', [])
+    backend.index_books(book_ids)
+    Book.objects.filter(pk__in=book_ids).touch()
+    invalidate_serialized(Book, book_ids)
+    invalidate_serialized(Author, [instance.pk])
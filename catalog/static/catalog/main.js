@@ -1,4 +1,6 @@
 const numberOfSuggestions = 5;
+// Milliseconds to wait after the last keystroke before requesting suggestions
+const suggestionDelay = 150;
 
 // Get the CSFR token
 function getCookie(name) {
@@ -21,10 +23,10 @@ const csrftoken = getCookie('csrftoken');
 document.addEventListener('DOMContentLoaded', () => {
 
     document.querySelectorAll('.author-search-input').forEach(element => {
-        element.onkeyup = searchAuthor;
+        element.onkeyup = debounce(searchAuthor, suggestionDelay);
     });
     document.querySelectorAll('.book-search-input').forEach(element => {
-        element.onkeyup = searchBook;
+        element.onkeyup = debounce(searchBook, suggestionDelay);
     });
     document.querySelectorAll('.toggle-cart-button').forEach(element => {
         element.onclick = toggleCart;
@@ -35,6 +37,11 @@ document.addEventListener('DOMContentLoaded', () => {
         reviewButton.onclick = reviewBook;
     }
 
+    let loanBatchForm = document.querySelector('#loan-batch-form');
+    if (loanBatchForm !== null) {
+        loanBatchForm.onsubmit = submitLoanBatch;
+    }
+
     document.addEventListener('click', () => {
 
         // Clear suggestions when not active    
@@ -58,6 +65,15 @@ document.addEventListener('DOMContentLoaded', () => {
     })
 })
 
+// Delay calls to a function until it has not been called for some time
+function debounce(func, delay) {
+    let timeout = null;
+    return function (...args) {
+        clearTimeout(timeout);
+        timeout = setTimeout(() => func.apply(this, args), delay);
+    };
+}
+
 function searchAuthor() {
     // Get information
     const query = document.querySelector('.author-search-input').value;
@@ -68,14 +84,15 @@ function searchAuthor() {
         return;
     }
     // Request authors matching the query
-    fetch(`/catalog/api/search/author?` + new URLSearchParams({
-        'query': query
+    fetch(`/catalog/api/autocomplete/author?` + new URLSearchParams({
+        'query': query,
+        'limit': numberOfSuggestions
     }))
     .then(response => response.json())
     .then(results => {
         // Update the autocomplete list
         autocomplete.replaceChildren(
-            ...results.slice(0, numberOfSuggestions).map(item => {
+            ...results.map(item => {
                 let li = document.createElement('li');
                 let a = document.createElement('a');
                 li.className = 'suggestion-item'
@@ -99,14 +116,15 @@ function searchBook() {
         return;
     }
     // Request books matching the query
-    fetch(`/catalog/api/search/book?` + new URLSearchParams({
-        'query': query
+    fetch(`/catalog/api/autocomplete/book?` + new URLSearchParams({
+        'query': query,
+        'limit': numberOfSuggestions
     }))
     .then(response => response.json())
     .then(results => {
         // Update the autocomplete list
         autocomplete.replaceChildren(
-            ...results.slice(0, numberOfSuggestions).map(item => {
+            ...results.map(item => {
                 let li = document.createElement('li');
                 let a = document.createElement('a');
                 li.className = 'suggestion-item'
@@ -191,4 +209,55 @@ function reviewBook() {
     })
 
     return false;
-}
\ No newline at end of file
+}
+
+function submitLoanBatch() {
+    // Read the scanned ids, one per line
+    const ids = this.querySelector('#id_ids');
+    const body = {
+        action: this.querySelector('#id_action').value,
+        date: this.querySelector('#id_date').value || null,
+    };
+    body[this.querySelector('#id_kind').value] = ids.value.split(/[\s,]+/).filter(id => id !== '');
+
+    // Send all of them at once
+    fetch('/catalog/api/loans', {
+        method: 'POST',
+        mode: 'same-origin',
+        headers: {'X-CSRFToken': csrftoken},
+        body: JSON.stringify(body),
+    })
+    .then(response => {
+        if (response.status !== 200) {
+            throw `Some error occurred! Status: ${response.status}`;
+        }
+        return response.json();
+    })
+    .then(response => {
+        // Show the result of each id and clear them for the next batch
+        const results = document.querySelector('#loan-batch-results');
+        results.replaceChildren(...response['results'].map(item => {
+            const row = document.createElement('tr');
+            let notes = '';
+            if (item['set_aside_for']) {
+                notes = `Set aside for ${item['set_aside_for']}`;
+            } else if (item['status'] === 'renewed') {
+                notes = `Due back ${item['due_back_date']}`;
+            } else if (item['status'] === 'held') {
+                notes = 'Not renewed, other users are waiting for this book';
+            } else if (item['status'] === 'invalid date') {
+                notes = 'Not changed, the date does not suit this loan';
+            }
+            [`${item['type']} ${item['id']}`, item['loan'] ?? '', item['status'], notes].forEach(text => {
+                const cell = document.createElement('td');
+                cell.textContent = text;
+                row.append(cell);
+            });
+            return row;
+        }));
+        ids.value = '';
+    })
+    .catch(error => console.log(error));
+
+    return false;
+}
@@ -1,3 +1,1045 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from smtplib import SMTPException
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.core.handlers.asgi import ASGIHandler
+from django.core.mail import send_mail
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import urls as catalog_urls
+from . import views
+from .cart import CART_COOKIE, sign_cart
+from .forms import LoanForm
+from .circulation import checkout_books, lock_free_copies, renew_loans, return_loans
+from .middleware import QueryBudgetExceeded
+from .pagination import CursorPaginator, InvalidCursor
+from .models import (
+    Author, Book, BookCopy, BookRecommendation, DailyBookCirculation, DailyCirculation, Hold, JobCheckpoint,
+    Loan, OverdueNotice, Review, TableChange, available_copies,
+)
+from .rollups import CHECKPOINT_NAME as ROLLUP_CHECKPOINT, busiest_books, roll_up
+from .search import get_search_backend
+from .serialization import FileStore, MemoryStore, SerializationCache, create_store, get_serialization_cache
+
+
+User = get_user_model()
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """Checks that concurrent checkouts never loan the same copy twice."""
+
+    threads = 12
+
+    def setUp(self):
+        self.books = [Book.objects.create(title=f"Book {i}", summary="") for i in range(3)]
+        for book in self.books:
+            BookCopy.objects.bulk_create([BookCopy(book=book) for _ in range(4)])
+        Book.objects.all().update_available_copies()
+        self.users = [User.objects.create_user(username=f"user{i}") for i in range(self.threads)]
+
+    def test_concurrent_checkouts_never_share_a_copy(self):
+        today = datetime.date.today()
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def checkout(user):
+            try:
+                barrier.wait()
+                checkout_books(user, self.books, today, today + datetime.timedelta(weeks=3))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=checkout, args=(user,)) for user in self.users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        open_loans = Loan.objects.filter(return_date=None)
+        copy_ids = list(open_loans.values_list('bookcopy_id', flat=True))
+        self.assertEqual(len(copy_ids), len(set(copy_ids)))
+        # Every copy was loaned exactly once
+        self.assertEqual(len(copy_ids), BookCopy.objects.count())
+        for book in Book.objects.all():
+            self.assertEqual(book.available_copies_count, 0)
+
+    @skipUnless(connection.features.has_select_for_update_skip_locked, "needs SELECT ... SKIP LOCKED, e.g. Postgres")
+    def test_a_checkout_in_progress_only_locks_the_copy_it_claims(self):
+        today = datetime.date.today()
+        claimed, release = threading.Event(), threading.Event()
+
+        def hold_a_copy():
+            try:
+                with transaction.atomic():
+                    lock_free_copies([self.books[0].pk])
+                    claimed.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=hold_a_copy)
+        worker.start()
+        try:
+            claimed.wait(10)
+            result = checkout_books(self.users[0], [self.books[0]], today, today)
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(result.unavailable, [])
+
+    def test_unavailable_books_are_reported(self):
+        today = datetime.date.today()
+        BookCopy.objects.filter(book=self.books[0]).update(on_maintenance=True)
+        result = checkout_books(self.users[0], self.books, today, today)
+        self.assertEqual(result.unavailable, [self.books[0]])
+        self.assertEqual(result.books, self.books[1:])
+        self.assertEqual(len(result.loans), 2)
+
+
+class HoldAllocationTests(TransactionTestCase):
+    """Checks that copies returned concurrently each go to exactly one waiting
+    hold, in queue order."""
+
+    threads = 8
+
+    def setUp(self):
+        today = datetime.date.today()
+        self.book = Book.objects.create(title="Book", summary="")
+        BookCopy.objects.bulk_create([BookCopy(book=self.book) for _ in range(4)])
+        Book.objects.all().update_available_copies()
+        lenders = [User.objects.create_user(username=f"lender{i}") for i in range(4)]
+        self.loans = [checkout_books(lender, [self.book], today, today).loans[0] for lender in lenders]
+        self.users = [User.objects.create_user(username=f"user{i}") for i in range(10)]
+        start = timezone.now()
+        # Placed in reverse order of users, so that the queue is not in id order
+        self.holds = [
+            Hold.objects.create(user=user, book=self.book, created=start - datetime.timedelta(minutes=i))
+            for i, user in enumerate(self.users)
+        ][::-1]
+
+    def test_concurrent_returns_give_each_copy_to_one_hold(self):
+        today = datetime.date.today()
+        barrier = threading.Barrier(self.threads)
+        errors, returned = [], []
+
+        def return_all():
+            try:
+                barrier.wait()
+                # Every worker returns every loan, only one of them closes each
+                returned.extend(return_loans([loan.pk for loan in self.loans], today).loans)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=return_all) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(loan.pk for loan in returned), sorted(loan.pk for loan in self.loans))
+        ready = Hold.objects.ready().order_by('created')
+        copy_ids = list(ready.values_list('bookcopy_id', flat=True))
+        self.assertEqual(sorted(copy_ids), sorted(BookCopy.objects.values_list('pk', flat=True)))
+        # The copies went to the head of the queue
+        self.assertEqual(list(ready), self.holds[:4])
+        self.assertEqual([hold.position() for hold in Hold.objects.waiting()], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(Book.objects.get().available_copies_count, 0)
+
+    def test_set_aside_copies_are_only_loaned_to_their_hold(self):
+        today = datetime.date.today()
+        return_loans([self.loans[0].pk], today)
+        first = Hold.objects.get(pk=self.holds[0].pk)
+        self.assertTrue(first.is_ready())
+        self.assertEqual(checkout_books(self.users[0], [self.book], today, today).unavailable, [self.book])
+        loan = checkout_books(first.user, [self.book], today, today).loans[0]
+        self.assertEqual(loan.bookcopy_id, first.bookcopy_id)
+        self.assertFalse(Hold.objects.filter(pk=first.pk).exists())
+
+    def test_set_aside_copies_loaned_to_someone_else_release_their_hold(self):
+        today = datetime.date.today()
+        return_loans([self.loans[0].pk], today)
+        first = Hold.objects.get(pk=self.holds[0].pk)
+        Loan.objects.create(bookcopy_id=first.bookcopy_id, borrower=self.users[0], loan_date=today, due_back_date=today)
+        # The hold is back at the head of the queue, and its user is not given the loaned copy
+        first.refresh_from_db()
+        self.assertFalse(first.is_ready())
+        self.assertEqual(first.position(), 1)
+        self.assertEqual(checkout_books(first.user, [self.book], today, today).unavailable, [self.book])
+        self.assertNotIn(first.bookcopy_id, LoanForm().fields['bookcopy'].queryset.values_list('pk', flat=True))
+
+        # Even a hold left on a loaned copy by a bulk update does not make checkouts fail
+        return_loans([self.loans[1].pk], today)
+        first.refresh_from_db()
+        self.assertTrue(first.is_ready())
+        Loan.objects.bulk_create([Loan(
+            bookcopy_id=first.bookcopy_id, borrower=self.users[0], loan_date=today, due_back_date=today)])
+        self.assertEqual(checkout_books(first.user, [self.book], today, today).unavailable, [self.book])
+
+    def test_positions_move_up_when_a_hold_ahead_is_allocated_or_cancelled(self):
+        today = datetime.date.today()
+        last = self.holds[-1]
+        self.assertEqual(last.position(), 10)
+
+        return_loans([self.loans[0].pk], today)
+        self.assertIsNone(Hold.objects.get(pk=self.holds[0].pk).position())
+        self.assertEqual(self.holds[1].position(), 1)
+        self.assertEqual(last.position(), 9)
+
+        self.holds[3].delete()
+        self.assertEqual(self.holds[2].position(), 2)
+        self.assertEqual(self.holds[4].position(), 3)
+        self.assertEqual(last.position(), 8)
+
+    def test_loans_of_held_books_are_not_renewed(self):
+        due = datetime.date.today() + datetime.timedelta(weeks=3)
+        result = renew_loans([loan.pk for loan in self.loans] + [0], due)
+        self.assertEqual(result.loans, [])
+        self.assertEqual(result.held, [loan.pk for loan in self.loans])
+        self.assertEqual(result.not_open, [0])
+        Hold.objects.all().delete()
+        self.assertEqual(len(renew_loans([loan.pk for loan in self.loans], due).loans), 4)
+        self.assertEqual(Loan.objects.filter(due_back_date=due).count(), 4)
+
+
+@override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    QUERY_BUDGET_RAISE=True,
+)
+class QueryBudgetTests(TestCase):
+    """Requests every catalog route against seeded data, failing if any view
+    runs more queries than its budget."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='password')
+        librarians = Group.objects.create(name='Librarian')
+        librarians.permissions.set(Permission.objects.filter(content_type__app_label='catalog'))
+        cls.librarian.groups.add(librarians)
+
+        authors, cls.books = cls.seed('')
+        JobCheckpoint.objects.create(name=ROLLUP_CHECKPOINT, position={'day': datetime.date.today().isoformat()})
+
+        cls.book = cls.books[0]
+        cls.author = authors[0]
+        cls.bookcopy = cls.book.copies.first()
+        cls.loan = Loan.objects.filter(borrower=cls.librarian).first()
+
+    @classmethod
+    def seed(cls, prefix):
+        """Creates authors, books with copies, loans and reviews, some of them the
+        librarian's, returning the authors and books."""
+        today = datetime.date.today()
+        authors = [Author.objects.create(first_name=f"First{i}", last_name=f"{prefix}Last{i}") for i in range(5)]
+        books = []
+        for i in range(15):
+            book = Book.objects.create(title=f"{prefix}Book {i}", summary="A summary")
+            book.authors.set(authors[i % 3:i % 3 + 2])
+            books.append(book)
+            BookCopy.objects.bulk_create([BookCopy(book=book) for _ in range(3)])
+        Book.objects.filter(pk__in=[book.pk for book in books]).update_available_copies()
+
+        readers = [User.objects.create_user(username=f"{prefix}reader{i}") for i in range(5)]
+        for reader in readers[:2] + [cls.librarian]:
+            checkout_books(reader, books[:6], today, today - datetime.timedelta(days=1))
+        for book in books[:6]:
+            for reader in readers:
+                Review.objects.create(user=reader, book=book, rating=7, comment="Good")
+
+        # Roll up today's loans, as the nightly job would tomorrow
+        roll_up(today, today, Counter())
+        return authors, books
+
+    def setUp(self):
+        cache.clear()
+        get_serialization_cache().store.clear()
+        self.client.force_login(self.librarian)
+        self.fill_cart()
+
+    def fill_cart(self):
+        self.client.cookies[CART_COOKIE] = sign_cart(self.librarian.pk, [book.pk for book in self.books[6:10]])
+
+    def route_requests(self):
+        """Returns the method, path and data of a request for every named catalog route."""
+        pk = {
+            'book-detail': self.book.pk,
+            'author-detail': self.author.pk,
+            'review': self.book.pk,
+            'book-update': self.book.pk,
+            'book-delete': self.book.pk,
+            'author-update': self.author.pk,
+            'author-delete': self.author.pk,
+            'book-copies': self.book.pk,
+            'bookcopy-create': self.book.pk,
+            'bookcopy-update': self.bookcopy.pk,
+            'bookcopy-delete': self.bookcopy.pk,
+            'loan-update': self.loan.pk,
+            'loan-delete': self.loan.pk,
+            'toggle-cart': self.book.pk,
+            'export': 'loans',
+            'api-book-reviews': self.book.pk,
+            'hold': self.book.pk,
+        }
+        query = {
+            'author-search': {'query': 'last'},
+            'book-search': {'query': 'book'},
+            'api-author-search': {'query': 'last'},
+            'api-book-search': {'query': 'book'},
+            'api-author-autocomplete': {'query': 'la'},
+            'api-book-autocomplete': {'query': 'bo'},
+            'export': {'status': 'active', 'gzip': 'on'},
+            'api-books': {'ids': ','.join(str(book.pk) for book in self.books), 'fields': 'title,authors'},
+            'api-authors': {'ids': f'{self.author.pk},0'},
+            'circulation-dashboard': {'days': '7'},
+        }
+        post = {
+            'review': {'comment': "Great", 'rating': 9},
+            'api-cart': {'add': [book.pk for book in self.books[:12]], 'remove': [self.books[6].pk]},
+            'hold': {},
+            'api-loans': {
+                'action': 'return',
+                'copies': list(Loan.objects.filter(borrower=self.librarian).values_list('bookcopy_id', flat=True)),
+                'loans': [self.loan.pk, 0],
+            },
+        }
+        for pattern in catalog_urls.urlpatterns:
+            name = pattern.name
+            args = (pk[name],) if name in pk else ()
+            path = reverse(f'catalog:{name}', args=args)
+            if name in post:
+                yield name, 'post', path, json.dumps(post[name])
+            else:
+                yield name, 'get', path, query.get(name)
+
+    def request(self, method, path, data):
+        if method == 'post':
+            return self.client.post(path, data, content_type='application/json')
+        return self.client.get(path, data)
+
+    def test_every_route_is_within_its_query_budget(self):
+        for name, method, path, data in self.route_requests():
+            with self.subTest(route=name):
+                self.assertLess(self.request(method, path, data).status_code, 400)
+
+    def query_counts(self):
+        """Returns the number of queries each route runs, from empty caches,
+        undoing what each request changes."""
+        counts = {}
+        for name, method, path, data in self.route_requests():
+            cache.clear()
+            get_serialization_cache().store.clear()
+            self.fill_cart()
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    self.request(method, path, data)
+                transaction.set_rollback(True)
+            counts[name] = len(queries)
+        return counts
+
+    def test_query_counts_do_not_grow_with_the_data(self):
+        self.maxDiff = None
+        # Budgets are the queries a view runs whatever the size of the catalog,
+        # so twice the books, loans and reviews must take the same queries
+        before = self.query_counts()
+        self.seed('more')
+        self.assertEqual(self.query_counts(), before)
+
+    def test_over_budget_requests_raise(self):
+        with mock.patch.object(views.AllBooks, 'query_budget', 1):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('catalog:all-books'))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConditionalGetTests(TestCase):
+    """Checks that list pages answer 304 until a row they show changes or is deleted."""
+
+    def test_book_list_notices_changes_and_deletions(self):
+        books = [Book.objects.create(title=f"Book {i}", summary="") for i in range(3)]
+        url = reverse('catalog:all-books')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Deleting a book that is not the latest changed leaves the latest timestamp as it was.
+        # The deletion is counted in the database, so a process with a cache of its own notices it too
+        books[0].delete()
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            books[1].title = "Renamed"
+            books[1].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class BatchApiTests(TestCase):
+    """Checks that the batch APIs reject what they cannot look up with a 400,
+    and report the loans a date does not suit."""
+
+    def test_out_of_range_ids_are_invalid(self):
+        for ids in ['99999999999999999999', '-1', '1,x']:
+            with self.subTest(ids=ids):
+                response = self.client.get(reverse('catalog:api-books'), {'ids': ids})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['message'], 'invalid ids')
+
+    def post_loans(self, **batch):
+        return self.client.post(reverse('catalog:api-loans'), json.dumps(batch), content_type='application/json')
+
+    def test_loan_dates_are_checked_per_loan(self):
+        today = datetime.date.today()
+        librarian = User.objects.create_user(username='librarian')
+        librarian.user_permissions.add(Permission.objects.get(codename='change_loan'))
+        self.client.force_login(librarian)
+        book = Book.objects.create(title="Book", summary="")
+        copies = BookCopy.objects.bulk_create([BookCopy(book=book) for _ in range(2)])
+        old, new = Loan.objects.bulk_create([
+            Loan(bookcopy=copies[0], borrower=librarian, loan_date=today - datetime.timedelta(days=10),
+                 due_back_date=today + datetime.timedelta(days=10)),
+            Loan(bookcopy=copies[1], borrower=librarian, loan_date=today, due_back_date=today),
+        ])
+
+        self.assertEqual(self.post_loans(action='return', loans=[2 ** 64]).status_code, 400)
+        results = self.post_loans(action='renew', loans=[old.pk, new.pk],
+                                  date=(today + datetime.timedelta(days=5)).isoformat()).json()['results']
+        self.assertEqual([item['status'] for item in results], ['invalid date', 'renewed'])
+        results = self.post_loans(action='renew', loans=[old.pk], date=today.isoformat()).json()['results']
+        self.assertEqual(results[0]['status'], 'invalid date')
+        results = self.post_loans(action='return', loans=[old.pk, new.pk],
+                                  date=(today - datetime.timedelta(days=1)).isoformat()).json()['results']
+        self.assertEqual([item['status'] for item in results], ['returned', 'invalid date'])
+        results = self.post_loans(action='return', loans=[new.pk],
+                                  date=(today + datetime.timedelta(days=1)).isoformat()).json()['results']
+        self.assertEqual(results[0]['status'], 'invalid date')
+        self.assertEqual(Loan.objects.get(pk=new.pk).due_back_date, today + datetime.timedelta(days=5))
+        self.assertIsNone(Loan.objects.get(pk=new.pk).return_date)
+
+
+class AutocompleteApiTests(TestCase):
+    """Checks that the autocomplete APIs bound their results, serve repeated
+    queries from the cache until the catalog changes, and revalidate with ETags."""
+
+    def setUp(self):
+        cache.clear()
+        self.books = [Book.objects.create(title=f"Dune {i}", summary="") for i in range(12)]
+        self.url = reverse('catalog:api-book-autocomplete')
+
+    def test_limit_is_bounded(self):
+        for limit, count in [(None, 5), (3, 3), (0, 1), (-4, 1), (50, 10)]:
+            with self.subTest(limit=limit):
+                params = {'query': 'dune'} if limit is None else {'query': 'dune', 'limit': limit}
+                self.assertEqual(len(self.client.get(self.url, params).json()), count)
+        response = self.client.get(self.url, {'query': 'dune', 'limit': 'all'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'invalid limit')
+
+    def test_repeated_queries_are_cached_until_a_book_changes(self):
+        params = {'query': 'DUNE ', 'limit': 10}
+        with CaptureQueriesContext(connection) as missed:
+            first = self.client.get(self.url, params).json()
+        # Normalized to the same key, answered without searching
+        with CaptureQueriesContext(connection) as hit:
+            self.assertEqual(self.client.get(self.url, {'query': 'dune', 'limit': 10}).json(), first)
+        self.assertLess(len(hit), len(missed))
+
+        self.books[0].title = "Emma"
+        self.books[0].save()
+        titles = [book['title'] for book in self.client.get(self.url, params).json()]
+        self.assertNotIn("Dune 0", titles)
+        self.assertEqual(len(titles), 10)
+
+    def test_unchanged_results_answer_304(self):
+        response = self.client.get(self.url, {'query': 'dune'})
+        self.assertIn('max-age=60', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(self.url, {'query': 'dune'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # Another query has other results, so its body is sent
+        response = self.client.get(self.url, {'query': 'dune', 'limit': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CursorPaginationTests(TestCase):
+    """Checks that following cursors either way reaches every row exactly once."""
+
+    def test_reviews_with_equal_timestamps_are_all_paged(self):
+        book = Book.objects.create(title="Book", summary="")
+        for i in range(5):
+            Review.objects.create(user=User.objects.create_user(username=f"reader{i}"), book=book, rating=5)
+        Review.objects.update(timestamp=timezone.now().replace(microsecond=123456))
+
+        url = reverse('catalog:api-book-reviews', args=[book.pk])
+        seen, cursor = [], ''
+        while cursor is not None:
+            page = self.client.get(url, {'cursor': cursor, 'limit': 2}).json()
+            seen += [review['user'] for review in page['results']]
+            cursor = page['next']
+        self.assertEqual(sorted(seen), [f"reader{i}" for i in range(5)])
+
+
+    def test_paging_forwards_and_backwards_with_ties(self):
+        ratings = [3, 5, 5, 1, 5, 3, 0]
+        Book.objects.bulk_create([Book(title=f"Book {i}", summary="", rating_average=rating)
+                                  for i, rating in enumerate(ratings)])
+        # Descending on a column with ties, so the primary key breaks them
+        queryset = Book.objects.order_by('-rating_average')
+        expected = list(queryset.order_by('-rating_average', 'pk'))
+        paginator = CursorPaginator(queryset, 3)
+
+        first = paginator.page()
+        self.assertEqual(list(first), expected[:3])
+        self.assertFalse(first.has_previous())
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(list(second), expected[3:6])
+        last = paginator.page(second.next_cursor)
+        self.assertEqual(list(last), expected[6:])
+        self.assertFalse(last.has_next())
+
+        # Going back from the short last page gives whole pages, up to the first
+        back = paginator.page(last.previous_cursor)
+        self.assertEqual(list(back), expected[3:6])
+        self.assertEqual(list(paginator.page(back.next_cursor)), expected[6:])
+        front = paginator.page(back.previous_cursor)
+        self.assertEqual(list(front), expected[:3])
+        self.assertFalse(front.has_previous())
+        self.assertEqual(list(paginator.page(front.next_cursor)), expected[3:6])
+
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not a cursor')
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BookConditionalGetTests(TestCase):
+    """Checks that a book's page answers 304 until something it shows changes."""
+
+    def test_book_page_notices_review_comment_edits(self):
+        book = Book.objects.create(title="Book", summary="")
+        review = Review.objects.create(user=User.objects.create_user(username='reader'), book=book, rating=5)
+        url = reverse('catalog:book-detail', args=[book.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        review.comment = "Changed my mind"
+        with self.captureOnCommitCallbacks(execute=True):
+            review.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Changed my mind")
+
+
+class AsyncStackTests(TestCase):
+    """Checks that ASGI requests stay on the event loop through the middleware,
+    and that their queries are still counted."""
+
+    @override_settings(DEBUG=True)
+    def test_no_middleware_is_adapted_to_sync(self):
+        # Django only logs adapted middleware in DEBUG
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    async def test_async_views_report_their_queries(self):
+        await sync_to_async(Book.objects.create)(title="Book", summary="A summary")
+        response = await self.async_client.get(reverse('catalog:api-book-search'), {'query': 'book'})
+        self.assertEqual(response.status_code, 200)
+        match = re.search(r'db;desc="(\d+) queries"', response['Server-Timing'])
+        self.assertGreater(int(match.group(1)), 0)
+
+
+class SerializationCacheTests(TestCase):
+    """Checks that serialized payloads expire, and that stores shared by several
+    processes keep their versions in a shared cache."""
+
+    def test_shared_stores_refuse_process_local_versions(self):
+        with tempfile.TemporaryDirectory() as location:
+            with self.assertRaises(ImproperlyConfigured):
+                create_store({'BACKEND': 'file', 'LOCATION': location})
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                   'LOCATION': tempfile.mkdtemp()},
+    })
+    def test_changes_reach_other_processes_through_shared_versions(self):
+        with tempfile.TemporaryDirectory() as location:
+            options = {'BACKEND': 'file', 'LOCATION': location, 'VERSIONS': 'shared'}
+            book = Book.objects.create(title="Old", summary="")
+            # Two caches over the same directory stand for two processes
+            first, second = (SerializationCache(create_store(options), 'shared') for _ in range(2))
+            self.assertEqual(first.serialize([book])[0]['title'], "Old")
+            with override_settings(CATALOG_SERIALIZATION_CACHE=options), self.captureOnCommitCallbacks(execute=True):
+                book.title = "New"
+                book.save()
+            self.assertEqual(second.serialize([Book.objects.get()])[0]['title'], "New")
+
+    def test_payloads_expire(self):
+        book = Book.objects.create(title="Book", summary="")
+        with tempfile.TemporaryDirectory() as location:
+            for store in (MemoryStore(10, 60), FileStore(location, 10, 60)):
+                with self.subTest(store=type(store).__name__):
+                    store.set_many({'key': book.serialize()})
+                    self.assertIn('key', store.get_many(['key']))
+                    with mock.patch('catalog.serialization.time.time', return_value=time.time() + 61):
+                        self.assertEqual(store.get_many(['key']), {})
+
+
+class AvailabilityTests(TestCase):
+    """Checks that the available copy counts stored on books match their copies and loans."""
+
+    def assertCountsMatch(self, *books):
+        for book in books:
+            expected = Book.objects.annotate(available=available_copies()).get(pk=book.pk).available
+            book.refresh_from_db()
+            self.assertEqual(book.available_copies_count, expected, book)
+
+    def test_counts_follow_repeated_changes_to_the_same_instances(self):
+        today = datetime.date.today()
+        user = User.objects.create_user(username='reader')
+        first, second = [Book.objects.create(title=f"Book {i}", summary="") for i in range(2)]
+        copy = BookCopy.objects.create(book=first)
+        BookCopy.objects.create(book=second)
+        # Each save compares with the values of the previous one, not the first load
+        for on_maintenance in (True, False, True, False):
+            copy.on_maintenance = on_maintenance
+            copy.save()
+            self.assertCountsMatch(first)
+        copy.book = second
+        copy.save()
+        copy.book = first
+        copy.save()
+        self.assertCountsMatch(first, second)
+
+        loan = Loan.objects.create(bookcopy=copy, borrower=user, loan_date=today, due_back_date=today)
+        self.assertCountsMatch(first)
+        loan.return_date = today
+        loan.save()
+        self.assertCountsMatch(first)
+        loan.return_date = None
+        loan.save()
+        self.assertCountsMatch(first)
+        loan.delete()
+        self.assertCountsMatch(first, second)
+
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_recounting_refreshes_the_book_page(self):
+        book = Book.objects.create(title="Book", summary="")
+        BookCopy.objects.bulk_create([BookCopy(book=book) for _ in range(2)])
+        # Counts left wrong by a bulk write, which sends no signals
+        Book.objects.update(available_copies_count=7, updated_at=timezone.now() - datetime.timedelta(days=1))
+        url = book.get_absolute_url()
+        response = self.client.get(url)
+        self.assertContains(response, "<strong>Copies Available</strong>: 7")
+
+        call_command('recount_available_copies', stdout=io.StringIO())
+        # The recount marks the books as updated, so the ETag and the cached fragment both change
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "<strong>Copies Available</strong>: 2")
+
+class ReviewTests(TestCase):
+    """Checks that the rating statistics stored on books match their reviews."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f"reader{i}") for i in range(3)]
+        cls.books = [Book.objects.create(title=f"Book {i}", summary="") for i in range(2)]
+
+    def assertStatsMatchReviews(self, book):
+        book.refresh_from_db()
+        ratings = list(Review.objects.filter(book=book).values_list('rating', flat=True))
+        self.assertEqual(book.rating_count, len(ratings))
+        self.assertEqual(book.rating_sum, sum(ratings))
+        self.assertEqual(book.rating_histogram, [ratings.count(score) for score in range(1, 11)])
+        self.assertAlmostEqual(book.rating_average, sum(ratings) / len(ratings) if ratings else 0)
+
+    def test_upsert_inserts_then_replaces_a_review(self):
+        book = self.books[0]
+        self.assertIsNone(Review.objects.upsert(self.users[0].pk, book.pk, 4, "Fine"))
+        self.assertIsNone(Review.objects.upsert(self.users[1].pk, book.pk, 9, "Great"))
+        first = Review.objects.get(user=self.users[0], book=book)
+        self.assertEqual(Review.objects.upsert(self.users[0].pk, book.pk, 8, "Better on a second read"), 4)
+
+        review = Review.objects.get(user=self.users[0], book=book)
+        self.assertEqual((review.pk, review.rating, review.comment), (first.pk, 8, "Better on a second read"))
+        self.assertGreater(review.timestamp, first.timestamp)
+        self.assertEqual(Review.objects.filter(book=book).count(), 2)
+        self.assertStatsMatchReviews(book)
+
+    def test_stats_follow_reviews_created_edited_moved_and_deleted(self):
+        first, second = self.books
+        review = Review.objects.create(user=self.users[0], book=first, rating=5)
+        Review.objects.create(user=self.users[1], book=first, rating=7)
+        # Edited twice through the same instance, so the second edit removes the first's rating
+        for rating in (9, 2):
+            review.rating = rating
+            review.save()
+            self.assertStatsMatchReviews(first)
+        review = Review.objects.get(pk=review.pk)
+        review.book, review.rating = second, 10
+        review.save()
+        self.assertStatsMatchReviews(first)
+        self.assertStatsMatchReviews(second)
+        review.delete()
+        self.assertStatsMatchReviews(second)
+        Review.objects.filter(book=first).delete()
+        self.assertStatsMatchReviews(first)
+
+    def test_upsert_without_on_conflict(self):
+        book = self.books[1]
+        with mock.patch.object(connection, 'vendor', 'other'):
+            self.assertIsNone(Review.objects.upsert(self.users[0].pk, book.pk, 3, "Slow"))
+            self.assertEqual(Review.objects.upsert(self.users[0].pk, book.pk, 6, "Grew on me"), 3)
+        self.assertEqual(Review.objects.get(user=self.users[0], book=book).comment, "Grew on me")
+        self.assertStatsMatchReviews(book)
+
+
+class SearchTests(TestCase):
+    """Checks that the search backend ranks matches and keeps its index in step with the catalog."""
+
+    def search_books(self, query):
+        return list(get_search_backend().search_books(query).values_list('title', flat=True))
+
+    def test_title_matches_rank_first(self):
+        Book.objects.create(title="Notes on deserts", summary="A reader's guide to Dune and its sequels")
+        Book.objects.create(title="Dune", summary="A desert planet")
+        Book.objects.create(title="Emma", summary="A novel")
+        self.assertEqual(self.search_books("dune"), ["Dune", "Notes on deserts"])
+        self.assertEqual(self.search_books("des"), ["Notes on deserts", "Dune"])
+        self.assertEqual(self.search_books("dune desert"), ["Dune", "Notes on deserts"])
+        self.assertEqual(self.search_books("nothing"), [])
+
+    def test_index_follows_authors_and_deletions(self):
+        author = Author.objects.create(first_name="Frank", last_name="Herbert")
+        book = Book.objects.create(title="Dune", summary="")
+        book.authors.add(author)
+        self.assertEqual(self.search_books("herbert"), ["Dune"])
+        author.last_name = "Herberts"
+        author.save()
+        self.assertEqual(self.search_books("herberts"), ["Dune"])
+        self.assertEqual(list(get_search_backend().search_authors("herb").values_list('last_name', flat=True)),
+                         ["Herberts"])
+        book.authors.remove(author)
+        self.assertEqual(self.search_books("herberts"), [])
+        book.delete()
+        self.assertEqual(self.search_books("dune"), [])
+
+
+class ImportCatalogTests(TestCase):
+    """Checks that imported books are linked to one author row per name, get
+    their copies and derived data, and that a failed import can be resumed."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/catalog.jsonl'
+
+    def import_rows(self, rows, **options):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.writelines(json.dumps(row) + '\n' for row in rows)
+        call_command('import_catalog', self.path, stdout=io.StringIO(), **options)
+
+    def authors(self, title):
+        return sorted(Book.objects.get(title=title).authors.values_list('first_name', 'last_name'))
+
+    def test_authors_are_shared_within_and_across_batches(self):
+        existing = Author.objects.create(first_name="Frank", last_name="Herbert")
+        self.import_rows([
+            {'title': "Dune", 'authors': ["Herbert, Frank"], 'copies': 2},
+            {'title': "Good Omens", 'authors': ["Pratchett, Terry", "Gaiman, Neil"], 'copies': 1},
+            {'title': "Mort", 'authors': ["Pratchett, Terry", "Pratchett, Terry"], 'copies': 0},
+            # Dictionaries and strings give the same name
+            {'title': "Coraline", 'authors': [{'first_name': "Neil", 'last_name': "Gaiman"}], 'copies': 3},
+            {'title': "Children of Dune", 'authors': ["Herbert, Frank"]},
+        ], batch_size=2)
+
+        self.assertEqual(Author.objects.count(), 3)
+        self.assertEqual(list(Book.objects.get(title="Dune").authors.all()), [existing])
+        self.assertEqual(self.authors("Good Omens"), [("Neil", "Gaiman"), ("Terry", "Pratchett")])
+        self.assertEqual(self.authors("Mort"), [("Terry", "Pratchett")])
+        self.assertEqual(self.authors("Coraline"), [("Neil", "Gaiman")])
+        self.assertEqual(list(Book.objects.get(title="Children of Dune").authors.all()), [existing])
+
+        # bulk_create() sends no signals, so the command keeps the derived data itself
+        counts = dict(Book.objects.annotate(copies_count=Count('copies')).values_list('title', 'copies_count'))
+        self.assertEqual(counts, {"Dune": 2, "Good Omens": 1, "Mort": 0, "Coraline": 3, "Children of Dune": 0})
+        self.assertEqual(
+            dict(Book.objects.values_list('title', 'available_copies_count')),
+            {"Dune": 2, "Good Omens": 1, "Mort": 0, "Coraline": 3, "Children of Dune": 0})
+        search = get_search_backend()
+        self.assertEqual(list(search.search_books("gaiman").order_by('title').values_list('title', flat=True)),
+                         ["Coraline", "Good Omens"])
+        self.assertEqual(list(search.search_authors("pratch").values_list('last_name', flat=True)), ["Pratchett"])
+
+    def test_resume_skips_the_rows_of_finished_batches(self):
+        rows = [{'title': f"Book {i}", 'authors': [f"Writer, {i % 2}"], 'copies': 1} for i in range(5)]
+        broken = [*rows[:3], {'title': "Book 3", 'copies': "many"}, rows[4]]
+        with self.assertRaises(CommandError):
+            self.import_rows(broken, batch_size=2)
+        # The first batch was committed with its checkpoint, the failed one left nothing behind
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ["Book 0", "Book 1"])
+        self.assertEqual(JobCheckpoint.objects.get().position, {'rows': 2})
+
+        # The fixed file carries on from the checkpoint
+        self.import_rows(rows, batch_size=2, resume=True)
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), [f"Book {i}" for i in range(5)])
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(BookCopy.objects.count(), 5)
+        self.assertEqual(JobCheckpoint.objects.get().position, {'rows': 5})
+
+
+class ScanOverdueTests(TestCase):
+    """Checks that each borrower gets one notice about their overdue loans,
+    however the loans fall into batches, and only once."""
+
+    def setUp(self):
+        overdue = datetime.date.today() - datetime.timedelta(days=3)
+        self.borrowers = [User.objects.create_user(username=f'reader{i}', email=f'reader{i}@example.com')
+                          for i in range(3)]
+        book = Book.objects.create(title="Book", summary="")
+        copies = BookCopy.objects.bulk_create([BookCopy(book=book) for _ in range(7)])
+        # Three loans for the first borrower, so that batches of two split them
+        owners = [0, 0, 0, 1, 1, 2, 2]
+        Loan.objects.bulk_create([
+            Loan(bookcopy=copy, borrower=self.borrowers[owner], loan_date=overdue, due_back_date=overdue)
+            for copy, owner in zip(copies, owners)
+        ])
+
+    def scan(self, **options):
+        call_command('scan_overdue', batch_size=2, stdout=io.StringIO(), stderr=io.StringIO(), **options)
+
+    def test_one_notice_per_borrower_and_none_on_a_rerun(self):
+        self.scan()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         [borrower.email for borrower in self.borrowers])
+        # The first borrower's loans were read in two batches but listed in one notice
+        first = next(message for message in mail.outbox if message.to == ['reader0@example.com'])
+        self.assertEqual(first.body.count("- Book (due back"), 3)
+        notices = OverdueNotice.objects.all()
+        self.assertEqual(sorted(notice.borrower_id for notice in notices),
+                         [borrower.pk for borrower in self.borrowers])
+        self.assertFalse(Loan.objects.filter(overdue_notice=None).exists())
+        self.assertEqual(Loan.objects.filter(overdue_notice__borrower=self.borrowers[0]).count(), 3)
+
+        self.scan()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(OverdueNotice.objects.count(), 3)
+
+    def test_dry_run_writes_nothing(self):
+        self.scan(dry_run=True)
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(OverdueNotice.objects.exists())
+        self.assertFalse(Loan.objects.exclude(overdue_notice=None).exists())
+
+    def test_failed_sends_are_reported_and_retried(self):
+        def send(message, *args, **kwargs):
+            if 'reader1@example.com' in args[2]:
+                raise SMTPException("mailbox unavailable")
+            return send_mail(message, *args, **kwargs)
+
+        with mock.patch('catalog.management.commands.scan_overdue.send_mail', side_effect=send):
+            with self.assertRaisesMessage(CommandError, "Could not send 1 overdue notices"):
+                self.scan()
+        self.assertEqual([message.to[0] for message in mail.outbox], ['reader0@example.com', 'reader2@example.com'])
+        self.assertEqual(list(Loan.objects.filter(overdue_notice=None).values_list('borrower_id', flat=True)),
+                         [self.borrowers[1].pk] * 2)
+
+        self.scan()
+        self.assertEqual(mail.outbox[-1].to, ['reader1@example.com'])
+        self.assertFalse(Loan.objects.filter(overdue_notice=None).exists())
+
+
+class RollupTests(TestCase):
+    """Checks the circulation rollups against counts taken from the loans themselves."""
+
+    def test_on_loan_and_utilization_match_the_loans(self):
+        today = datetime.date.today()
+        first_day = today - datetime.timedelta(days=40)
+        rng = random.Random(0)
+        user = User.objects.create_user(username='reader')
+        books = [Book.objects.create(title=f"Book {i}", summary="") for i in range(4)]
+        loans = []
+        for book in books:
+            for copy in BookCopy.objects.bulk_create([BookCopy(book=book) for _ in range(rng.randint(1, 3))]):
+                day = first_day + datetime.timedelta(days=rng.randint(0, 5))
+                while day < today:
+                    returned = day + datetime.timedelta(days=rng.randint(0, 6))
+                    loans.append(Loan(bookcopy=copy, borrower=user, loan_date=day, due_back_date=returned,
+                                      return_date=returned if returned < today else None))
+                    day = returned + datetime.timedelta(days=rng.randint(1, 4))
+        Loan.objects.bulk_create(loans)
+
+        # Rolled up in chunks that do not line up with the loans, so on_loan is carried forward
+        call_command('rollup_circulation', chunk_days=7, stdout=io.StringIO())
+
+        def on_loan(day, book=None):
+            return sum(1 for loan in loans if loan.loan_date <= day
+                       and (loan.return_date is None or loan.return_date > day)
+                       and (book is None or loan.bookcopy.book_id == book.pk))
+
+        day = first_day
+        while day < today:
+            self.assertEqual(DailyCirculation.objects.get(day=day).on_loan, on_loan(day), day)
+            for book in books:
+                row = DailyBookCirculation.objects.filter(book=book, day__lte=day).order_by('-day').first()
+                self.assertEqual(row.on_loan if row else 0, on_loan(day, book), (day, book))
+            day += datetime.timedelta(days=1)
+
+        # A window starting part of the way through, so the copies on loan before it count
+        end = today - datetime.timedelta(days=1)
+        start = end - datetime.timedelta(days=20)
+        for row in busiest_books(start, end):
+            book = Book.objects.get(pk=row['book_id'])
+            days_on_loan = sum(on_loan(start + datetime.timedelta(days=i), book) for i in range(21))
+            self.assertAlmostEqual(row['utilization'], days_on_loan / (book.copies.count() * 21))
+
+
+class RecommendationTests(TestCase):
+    """Checks that refreshing the recommendations incrementally gives the same
+    rows as rebuilding them."""
+
+    def test_incremental_refresh_matches_a_full_rebuild(self):
+        today = datetime.date.today()
+        rng = random.Random(0)
+        users = [User.objects.create_user(username=f"reader{i}") for i in range(12)]
+        copies = [BookCopy.objects.create(book=Book.objects.create(title=f"Book {i}", summary="")) for i in range(15)]
+
+        def borrow(count):
+            Loan.objects.bulk_create([
+                Loan(bookcopy=rng.choice(copies), borrower=rng.choice(users),
+                     loan_date=today, due_back_date=today, return_date=today)
+                for _ in range(count)
+            ])
+
+        def recommendations():
+            return list(BookRecommendation.objects.order_by('book_id', 'rank').values_list(
+                'book_id', 'rank', 'recommended_id', 'borrowers'))
+
+        borrow(40)
+        # Few neighbours, so that new loans push stored ones out and ties are broken
+        call_command('build_recommendations', neighbours=3, stdout=io.StringIO())
+        for count in (1, 5, 30):
+            with self.subTest(new_loans=count):
+                borrow(count)
+                call_command('build_recommendations', neighbours=3, stdout=io.StringIO())
+                refreshed = recommendations()
+                call_command('build_recommendations', neighbours=3, full=True, stdout=io.StringIO())
+                self.assertEqual(refreshed, recommendations())
+
+
+class QueryPlanTests(TestCase):
+    """Runs EXPLAIN for the catalog's hot queries, failing if any of them reads
+    a whole table instead of using an index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        author = Author.objects.create(first_name="First", last_name="Last")
+        cls.books = []
+        for i in range(20):
+            book = Book.objects.create(title=f"Book {i}", summary="A summary")
+            book.authors.add(author)
+            BookCopy.objects.bulk_create([BookCopy(book=book) for _ in range(3)])
+            cls.books.append(book)
+        cls.users = [User.objects.create_user(username=f"reader{i}") for i in range(5)]
+        for user in cls.users:
+            checkout_books(user, cls.books[:5], today, today)
+            for book in cls.books[:5]:
+                Review.objects.create(user=user, book=book, rating=5)
+        Loan.objects.filter(borrower=cls.users[0]).update(return_date=today)
+
+    def hot_queries(self):
+        """Returns the hot queries by name."""
+        user, book = self.users[1], self.books[0]
+        return {
+            'available copies': Book.objects.filter(pk__in=[book.pk]).annotate(available=available_copies()),
+            'can review': Loan.objects.filter(borrower__id=user.pk, bookcopy__book__id=book.pk),
+            'user review': Review.objects.filter(user__id=user.pk, book__id=book.pk),
+            'borrowed loans': Loan.objects.open().filter(borrower_id=user.pk).select_related('bookcopy__book'),
+            'active loans': Loan.objects.open().order_by('due_back_date', 'pk'),
+            'overdue loans': Loan.objects.overdue().filter(overdue_notice=None),
+            'overdue loans to notify': self.overdue_scan_page(),
+            'book copies': BookCopy.objects.filter(book=book).with_on_loan(),
+            'loans made on a day': Loan.objects.filter(loan_date=datetime.date.today()),
+            'loans returned on a day': Loan.objects.filter(return_date=datetime.date.today()),
+            'last book change': Book.objects.order_by('-updated_at').values_list('updated_at')[:1],
+            'last loan change': Loan.objects.order_by('-updated_at').values_list('updated_at')[:1],
+            'book and author changes': TableChange.objects.with_last_modified(Book, Author),
+            'hold queue head': Hold.objects.waiting().filter(book_id=book.pk).order_by('created', 'pk')[:3],
+            'hold position': self.holds_ahead(),
+            'ranked book search': get_search_backend().search_books('book last'),
+            'ranked author search': get_search_backend().search_authors('la'),
+        }
+
+    def holds_ahead(self):
+        """Returns the holds ahead of one placed now, as counted for its position."""
+        return Hold(book=self.books[0], created=timezone.now(), pk=1).holds_ahead()
+
+    def overdue_scan_page(self):
+        """Returns a page after the first of the loans scan_overdue reads."""
+        paginator = CursorPaginator(Loan.objects.to_notify().select_related('borrower', 'bookcopy__book'), 10)
+        return paginator.queryset.filter(paginator.beyond([self.users[1].pk, 0], False))[:11]
+
+    def full_scans(self, queryset):
+        """Returns the lines of a query plan that read a whole table."""
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Tables this small are cheaper to scan, so only allow it if there is no index
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            return [line for line in queryset.explain().splitlines() if 'Seq Scan' in line]
+        scans = []
+        for line in queryset.explain().splitlines():
+            match = re.search(r'\bSCAN (\S+)(.*)', line)
+            # Full-text tables answer a MATCH (M in the plan) from their own index
+            if re.search(r'VIRTUAL TABLE INDEX \d+:M', line):
+                continue
+            if match and match.group(1) != 'CONSTANT' and 'USING' not in match.group(2):
+                scans.append(line)
+        return scans
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest("Query plans are only checked on SQLite and Postgres")
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(query=name):
+                self.assertEqual(self.full_scans(queryset), [], queryset.explain())
+
+    def test_hold_position_reads_the_queue_up_to_the_hold(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest("Query plans are only checked on SQLite and Postgres")
+        plan = self.holds_ahead().explain()
+        self.assertIn('hold_queue_idx', plan)
+        self.assertRegex(plan, r'created ?<')
+
+    def test_overdue_scan_pages_in_index_order(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest("Query plans are only checked on SQLite and Postgres")
+        plan = self.overdue_scan_page().explain()
+        self.assertIn('open_loan_notice_idx', plan)
+        self.assertNotRegex(plan, r'TEMP B-TREE|Sort')
@@ -0,0 +1,61 @@
+"""Timing of the work done for each request.
+
+ServerTimingMiddleware (see catalog/middleware.py) starts a RequestTimer for
+every request. The template backend below adds the time spent rendering
+templates to it, which covers both TemplateResponses and views calling
+render(), including any model methods the templates call.
+"""
+import contextvars
+import time
+
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+
+_current_timer = contextvars.ContextVar('catalog_request_timer', default=None)
+
+
+class RequestTimer:
+    """The time a request has spent in total and rendering templates."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.template_time = 0.0
+        self.token = None
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.start
+
+    def __enter__(self):
+        self.token = _current_timer.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_timer.reset(self.token)
+
+
+class Template(django_backend.Template):
+
+    def render(self, context=None, request=None):
+        timer = _current_timer.get()
+        if timer is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timer.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing how long templates take to render."""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
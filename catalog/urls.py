@@ -17,6 +17,7 @@ urlpatterns = [
     path('borrowed', views.borrowed, name='borrowed'),
     
     path('review/<int:pk>', views.review, name='review'),
+    path('book/<int:pk>/hold', views.hold, name='hold'),
 
     path('book/create/', views.BookCreateView.as_view(), name='book-create'),
     path('book/<int:pk>/update/', views.BookUpdateView.as_view(), name='book-update'),
@@ -35,8 +36,19 @@ urlpatterns = [
     path('loan/<int:pk>/delete', views.LoanDeleteView.as_view(), name='loan-delete'),
 
     path('loans/active', views.ActiveLoanListView.as_view(), name='active-loans'),
+    path('loans/dashboard', views.CirculationDashboardView.as_view(), name='circulation-dashboard'),
+    path('loans/desk', views.CirculationDeskView.as_view(), name='circulation-desk'),
+    path('export/<str:name>', views.export, name='export'),
 
     path('cart/toggle/<int:pk>', views.toggle_cart, name='toggle-cart'),
+    path('api/cart', views.cart_api, name='api-cart'),
+    path('api/books', views.book_batch_api, name='api-books'),
+    path('api/authors', views.author_batch_api, name='api-authors'),
+    path('api/loans', views.loan_batch_api, name='api-loans'),
+    path('api/book/<int:pk>/reviews', views.book_reviews_api, name='api-book-reviews'),
+    path('api/stats/serialization', views.serialization_stats_api, name='api-serialization-stats'),
     path('api/search/author', views.author_search_api, name='api-author-search'),
     path('api/search/book', views.book_search_api, name='api-book-search'),
+    path('api/autocomplete/author', views.author_autocomplete_api, name='api-author-autocomplete'),
+    path('api/autocomplete/book', views.book_autocomplete_api, name='api-book-autocomplete'),
 ]
\ No newline at end of file
@@ -1,21 +1,71 @@
 import datetime
+import hashlib
 import json
-
-from django.http import Http404, HttpResponseRedirect, JsonResponse
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.views import generic
-from django.db.models import Q
 from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model, get_user
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 
-from .models import Book, Author, BookCopy, Loan, Review
-from .forms import CheckoutForm, LoanForm, ReviewForm, BookSearchForm, AuthorSearchForm, BookForm, AuthorForm, BookCopyForm
+from .models import Book, Author, BookCopy, BookRecommendation, Hold, Loan, Review, TableChange, empty_rating_histogram
+from .caching import make_key
+from .cart import CART_MAX_BOOKS, get_cart
+from .circulation import checkout_books, open_loans_of_copies, renew_loans, return_loans
+from .conditional import conditional, latest
+from .middleware import query_budget
+from .pagination import CursorPaginationMixin, CursorPaginator, InvalidCursor
+from .rollups import dashboard, rolled_up_until
+from .search import get_search_backend, get_search_tokens
+from .serialization import get_serialization_cache, serialize_objects
+from .exports import EXPORTS, stream_export
+from .forms import CheckoutForm, ExportForm, LoanBatchForm, LoanForm, ReviewForm, BookSearchForm, AuthorSearchForm, BookForm, AuthorForm, BookCopyForm
 
 
 User = get_user_model()
 
+# Number of results returned per page by the JSON APIs by default and at most
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+# Fields the batch APIs return for books and authors, all of them by default
+BOOK_API_FIELDS = ('title', 'authors', 'summary', 'cover', 'url')
+AUTHOR_API_FIELDS = ('full_name', 'first_name', 'last_name', 'url')
+# Largest id a primary key column can hold, larger ids overflow the database driver
+MAX_ID = 2 ** 63 - 1
+# Number of copy and loan ids returned or renewed at most per request
+LOAN_BATCH_MAX = 500
+# Number of recommendations shown on a book's page
+RECOMMENDATIONS_SHOWN = 5
+# Number of suggestions returned by the autocomplete APIs by default and at most
+AUTOCOMPLETE_LIMIT = 5
+AUTOCOMPLETE_MAX_LIMIT = 10
+# Number of seconds autocomplete results are cached on the server and in browsers
+AUTOCOMPLETE_TIMEOUT = 60
+
+
+def async_login_required(view_func):
+    """Like login_required, for async views.
+    
+    The user is loaded from the session through the ORM's sync interface."""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
 
 def can_review(user_id, book_id):
     """Returns True if a user can review a book and False otherwise.
@@ -26,33 +76,103 @@ def can_review(user_id, book_id):
         bookcopy__book__id=book_id).exists()
 
 
+def book_lookup(request, pk):
+    """Returns when a book, or anything shown with it, last changed."""
+    last_modified = Book.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return None if last_modified is None else (last_modified, None)
+
+
+def author_lookup(request, pk):
+    """Returns when an author or one of their books last changed, and how many books they have."""
+    state = Author.objects.filter(pk=pk).aggregate(
+        author_modified=Max('updated_at'), books_modified=Max('books__updated_at'), count=Count('books'))
+    if state['author_modified'] is None:
+        return None
+    return latest(state['author_modified'], state['books_modified']), state['count']
+
+
+def latest_change(queryset):
+    """Returns a lookup for when the rows of a small queryset last changed,
+    which also counts them so that deleted rows are noticed."""
+    def lookup(request, *args, **kwargs):
+        state = queryset.aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        return state['last_modified'], state['count']
+    return lookup
+
+
+def table_lookup(*models):
+    """Returns a lookup for when any row of some tables last changed, which
+    also counts the rows deleted from them."""
+    def lookup(request, *args, **kwargs):
+        return TableChange.objects.state(*models)
+    return lookup
+
+
+def active_loans_lookup(request):
+    # Returned loans leave the list, so changes to any loan count, and loans
+    # become overdue without changing, so the date is part of the state
+    last_modified, deleted = table_lookup(Loan)(request)
+    return last_modified, (deleted, datetime.date.today().isoformat())
+
+
+# Search results change exactly when a book or an author changes
+search_lookup = table_lookup(Book, Author)
+
+
+@query_budget(2)
 def index(request):
     return HttpResponseRedirect(reverse('catalog:all-books'))
 
 
-class BookListView(generic.ListView):
+class BookListView(CursorPaginationMixin, generic.ListView):
+    query_budget = 8
     model = Book
     template_name = "catalog/book_list.html"
     paginate_by = 20
+    # Orderings selectable with the 'sort' query parameter
+    sort_orderings = {
+        'rating': ['-rating_average', 'id'],
+    }
 
+    def get_ordering(self):
+        return self.sort_orderings.get(self.request.GET.get('sort'), self.ordering)
 
+
+@method_decorator(conditional(book_lookup), name='get')
 class BookDetailView(generic.DetailView):
+    query_budget = 13
     model = Book
     template_name = "catalog/book_detail.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        try:
-            context["user_review"] = Review.objects.get(
-                user__id=self.request.user.id, 
-                book__id=self.kwargs['pk'])
-        except Review.DoesNotExist:
-            context["user_review"] = None
-        context["can_review"] = can_review(self.request.user.id, self.kwargs['pk'])
+        # Shared parts of the page are cached until the book changes
+        context["fragment_version"] = self.object.updated_at.isoformat()
+        context["reviews"] = self.object.reviews.select_related('user')
+        context["recommendations"] = BookRecommendation.objects.filter(
+            book_id=self.object.pk
+        ).select_related('recommended').only('recommended__title').order_by('rank')[:RECOMMENDATIONS_SHOWN]
+        # Parts specific to the user are computed on every request
+        context["user_review"] = None
+        context["can_review"] = False
+        context["hold"] = None
+        context["hold_position"] = None
+        if self.request.user.is_authenticated:
+            context["hold"] = Hold.objects.filter(user_id=self.request.user.id, book_id=self.kwargs['pk']).first()
+            if context["hold"]:
+                context["hold_position"] = context["hold"].position()
+            try:
+                context["user_review"] = Review.objects.get(
+                    user__id=self.request.user.id, 
+                    book__id=self.kwargs['pk'])
+            except Review.DoesNotExist:
+                pass
+            context["can_review"] = can_review(self.request.user.id, self.kwargs['pk'])
         return context
 
 
 class AuthorListView(generic.ListView):
+    query_budget = 7
     model = Author
     template_name = "catalog/author_list.html"
 
@@ -62,7 +182,10 @@ class AuthorListView(generic.ListView):
         return context
 
 
+@method_decorator(conditional(author_lookup), name='get')
 class AuthorDetailView(BookListView):
+    query_budget = 9
+    cursor_pagination = True
     template_name = "catalog/author_detail.html"
 
     def get_context_data(self, **kwargs):
@@ -75,7 +198,10 @@ class AuthorDetailView(BookListView):
         return Book.objects.filter(authors__id=self.kwargs['pk'])
 
 
+@method_decorator(conditional(table_lookup(Book)), name='get')
 class AllBooks(BookListView, generic.ListView):
+    query_budget = 8
+    cursor_pagination = True
     template_name = "catalog/all_books.html"
 
     def get_context_data(self, **kwargs):
@@ -85,7 +211,9 @@ class AllBooks(BookListView, generic.ListView):
         return context
 
 
+@method_decorator(conditional(table_lookup(Author)), name='get')
 class AllAuthors(AuthorListView, generic.ListView):
+    query_budget = 7
     template_name = "catalog/all_authors.html"
 
     def get_context_data(self, **kwargs):
@@ -95,12 +223,17 @@ class AllAuthors(AuthorListView, generic.ListView):
         return context
 
 
+@method_decorator(conditional(book_lookup), name='get')
 class BookCopyListView(generic.ListView):
+    query_budget = 10
     model = BookCopy
     template_name = "catalog/bookcopy_list.html"
+    paginate_by = 50
 
     def get_queryset(self):
-        return BookCopy.objects.filter(book__id=self.kwargs['pk'])
+        return BookCopy.objects.filter(book__id=self.kwargs['pk']).select_related(
+            'book'
+        ).prefetch_related('book__authors').with_on_loan().order_by('pk')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -110,6 +243,8 @@ class BookCopyListView(generic.ListView):
 
 class BookSearchView(BookListView):
     """Displays search results for a book."""
+    query_budget = 8
+    cursor_pagination = True
 
     def get_form_query(self):
         form = BookSearchForm(self.request.GET)
@@ -119,7 +254,7 @@ class BookSearchView(BookListView):
         return query
     
     def get_queryset(self):  
-        return Book.objects.filter(title__icontains=self.get_form_query())
+        return get_search_backend().search_books(self.get_form_query())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -129,6 +264,7 @@ class BookSearchView(BookListView):
 
 class AuthorSearchView(AuthorListView):
     """Displays search results for an author."""
+    query_budget = 7
 
     def get_form_query(self):
         form = BookSearchForm(self.request.GET)
@@ -138,10 +274,7 @@ class AuthorSearchView(AuthorListView):
         return query
 
     def get_queryset(self):  
-        return Author.objects.filter(
-            Q(first_name__icontains=self.get_form_query()) |
-            Q(last_name__icontains=self.get_form_query())
-        )
+        return get_search_backend().search_authors(self.get_form_query())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -151,11 +284,11 @@ class AuthorSearchView(AuthorListView):
 
 class CartView(LoginRequiredMixin, BookListView):
     """Displays all books in a user's cart."""
+    query_budget = 8
     template_name = 'catalog/cart.html'
 
     def get_queryset(self):
-        cart = self.request.session.get('cart', list())
-        return Book.objects.filter(pk__in=cart)
+        return Book.objects.filter(pk__in=list(get_cart(self.request)))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -163,40 +296,66 @@ class CartView(LoginRequiredMixin, BookListView):
         return context
 
 
-@login_required
-def toggle_cart(request, pk):   
+@async_login_required
+@query_budget(8)
+async def toggle_cart(request, pk):   
     """Adds or removes a book from the cart.""" 
-    cart = request.session.get('cart', list())
-    # Make sure a book with that pk exists
-    try:
-        Book.objects.get(pk=pk)
-    except Book.DoesNotExist:
-        raise Http404()
+    cart = get_cart(request)
     # Add or remove the book from the cart
-    if pk not in cart:
-        cart.append(pk)
+    if pk in cart:
+        cart.remove([pk])
+        message = f"Removed book {pk} from cart"
+    # Make sure a book with that pk exists
+    elif await sync_to_async(cart.add)([pk]):
         message = f"Added book {pk} to cart"
+    elif len(cart) >= CART_MAX_BOOKS:
+        return JsonResponse({'message': 'cart is full'}, status=400)
     else:
-        cart.remove(pk)
-        message = f"Removed book {pk} from cart"
-    # Update the cart and return response
-    request.session['cart'] = cart
+        raise Http404()
     return JsonResponse({
         "message": message
     }, status=201)
 
 
+@async_login_required
+@query_budget(3)
+async def cart_api(request):
+    """Returns the books in the cart, after adding and removing books given as 
+    JSON like {"add": [1, 2], "remove": [3]} on a POST.
+    
+    All the books added are checked with one query, and the cart is only 
+    stored again if it changed."""
+    cart = get_cart(request)
+    added = removed = []
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+            add = [int(pk) for pk in data.get('add', [])]
+            remove = [int(pk) for pk in data.get('remove', [])]
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({'message': 'invalid cart update'}, status=400)
+        removed = cart.remove(remove)
+        added = await sync_to_async(cart.add)(add)
+    return JsonResponse({
+        "cart": list(cart),
+        "added": added,
+        "removed": removed,
+    })
+
+
 @login_required
+@query_budget(8)
 def checkout(request):
     """Creates loans for all books on a user's cart."""
 
     # Cart must not be empty
-    if not len(request.session.get('cart', list())):
+    cart = get_cart(request)
+    if not len(cart):
         raise Http404()
 
     # Collect data
     loan_form = CheckoutForm(request.POST or None)
-    books = Book.objects.filter(id__in=request.session['cart'])
+    books = Book.objects.filter(id__in=list(cart))
     loan_date = datetime.date.today()
     due_back_date = datetime.date.today() + datetime.timedelta(weeks=3)
     context = {
@@ -212,34 +371,40 @@ def checkout(request):
         # Display error messages if the form is invalid
         if not loan_form.is_valid():
             return render(request, "catalog/checkout.html", context)
-        # Create a loan object for each book
-        for book in books:
-            Loan(
-                bookcopy = book.available_copies()[0],
-                borrower = request.user,
-                loan_date = loan_date,
-                due_back_date = due_back_date,
-            ).save()
-        # Clear the cart
-        request.session['cart'] = list()
+        # Loan a free copy of each book
+        result = checkout_books(request.user, books, loan_date, due_back_date)
+        # Leave only the books that could not be loaned in the cart
+        cart.replace([book.pk for book in result.unavailable])
         # Return a success message
         return render(request, "catalog/checkout_success.html", {
-            "books": books,
+            "books": result.books,
+            "unavailable_books": result.unavailable,
             "due_back_date": due_back_date,
             "loan_date": loan_date,
         })
 
 
 @login_required
+@query_budget(7)
 def borrowed(request):
     """Display all of the user's active loans."""
     return render(request, "catalog/borrowed.html", {
-        "loans": Loan.objects.filter(borrower_id=request.user.id, return_date=None)
+        "loans": Loan.objects.open().filter(
+            borrower_id=request.user.id
+        ).select_related('bookcopy__book').with_overdue()
     })
 
 
-@login_required
-def review(request, pk):
+def replace_review(user, book, review):
+    """Saves a user's review of a book in place of any earlier one."""
+    if not can_review(user.id, book.id):
+        raise Http404()
+    Review.objects.upsert(user.id, book.id, review.cleaned_data['rating'], review.cleaned_data['comment'])
+
+
+@async_login_required
+@query_budget(12)
+async def review(request, pk):
     """Posts or updates a review."""
     if request.method == "POST":
 
@@ -249,29 +414,37 @@ def review(request, pk):
             'comment': data['comment'],
             'rating': int(data['rating'])
         })
-        book = get_object_or_404(Book, pk=pk)
+        book = await sync_to_async(get_object_or_404)(Book, pk=pk)
 
         # Make sure the review is valid.
         if not review.is_valid():
             return JsonResponse({'message': 'invalid review'}, status=400)
-        if not can_review(request.user.id, book.id):
-            raise Http404()
 
-        # Delete any previous reviews by the user
+        # Save the new review, replacing any previous review by the user
+        await sync_to_async(replace_review)(request.user, book, review)
+        return JsonResponse({'message': 'review saved'}, status=201)
+
+
+@login_required
+@query_budget(12)
+def hold(request, pk):
+    """Places a hold on a book, or cancels the user's hold on it."""
+    book = get_object_or_404(Book, pk=pk)
+    if request.method == "POST":
         try:
-            Review.objects.get(user_id=request.user.id, book_id=book.id).delete()
-        except Review.DoesNotExist:
+            with transaction.atomic():
+                cancelled, _ = Hold.objects.filter(user=request.user, book=book).delete()
+                if not cancelled:
+                    # A free copy, if any, is set aside for the hold right away
+                    Hold.objects.create(user=request.user, book=book)
+        except IntegrityError:
+            # The same hold was placed by another request
             pass
-
-        # Save the new review
-        review = review.save(commit=False)
-        review.user = request.user
-        review.book = book
-        review.save()
-        return JsonResponse({'message': 'review saved'}, status=201)
+    return HttpResponseRedirect(book.get_absolute_url())
 
 
 class BookCreateView(PermissionRequiredMixin, generic.CreateView):
+    query_budget = 7
     permission_required = 'catalog.add_book'
     model = Book
     form_class = BookForm
@@ -287,6 +460,7 @@ class BookCreateView(PermissionRequiredMixin, generic.CreateView):
 
 
 class BookUpdateView(PermissionRequiredMixin, generic.UpdateView):
+    query_budget = 9
     permission_required = 'catalog.change_book'
     model = Book
     form_class = BookForm
@@ -299,12 +473,14 @@ class BookUpdateView(PermissionRequiredMixin, generic.UpdateView):
 
 
 class BookDeleteView(PermissionRequiredMixin, generic.DeleteView):
+    query_budget = 8
     permission_required = 'catalog.delete_book'
     model = Book
     success_url = reverse_lazy('catalog:all-books')
 
 
 class AuthorCreateView(PermissionRequiredMixin, generic.CreateView):
+    query_budget = 6
     permission_required = 'catalog.add_author'
     model = Author
     form_class = AuthorForm
@@ -320,6 +496,7 @@ class AuthorCreateView(PermissionRequiredMixin, generic.CreateView):
 
 
 class AuthorUpdateView(PermissionRequiredMixin, generic.UpdateView):
+    query_budget = 7
     permission_required = 'catalog.change_author'
     model = Author
     form_class = AuthorForm
@@ -332,12 +509,14 @@ class AuthorUpdateView(PermissionRequiredMixin, generic.UpdateView):
 
 
 class AuthorDeleteView(PermissionRequiredMixin, generic.DeleteView):
+    query_budget = 7
     permission_required = 'catalog.delete_author'
     model = Author
     success_url = reverse_lazy('catalog:all-authors')
 
 
 class BookCopyCreateView(PermissionRequiredMixin, generic.CreateView):
+    query_budget = 9
     permission_required = 'catalog.add_bookcopy'
     model = BookCopy
     form_class = BookCopyForm
@@ -356,6 +535,7 @@ class BookCopyCreateView(PermissionRequiredMixin, generic.CreateView):
 
 
 class BookCopyUpdateView(PermissionRequiredMixin, generic.UpdateView):
+    query_budget = 9
     permission_required = 'catalog.change_bookcopy'
     model = BookCopy
     form_class = BookCopyForm
@@ -371,6 +551,7 @@ class BookCopyUpdateView(PermissionRequiredMixin, generic.UpdateView):
 
 
 class BookCopyDeleteView(PermissionRequiredMixin, generic.DeleteView):
+    query_budget = 8
     permission_required = 'catalog.delete_bookcopy'
     model = BookCopy
 
@@ -378,16 +559,73 @@ class BookCopyDeleteView(PermissionRequiredMixin, generic.DeleteView):
         return reverse('catalog:book-copies', args=(self.object.book.pk,))
 
 
+@method_decorator(conditional(active_loans_lookup), name='get')
 class ActiveLoanListView(PermissionRequiredMixin, generic.ListView):
+    query_budget = 8
     permission_required = 'catalog.view_loan'
     model = Loan
-    template_name = "loan_list.html"
+    template_name = "catalog/loan_list.html"
+    paginate_by = 50
 
     def get_queryset(self):
-        return Loan.objects.filter(return_date=None)
+        return Loan.objects.open().select_related(
+            'bookcopy__book', 'borrower'
+        ).with_overdue().order_by('due_back_date', 'pk')
+
+
+class CirculationDashboardView(PermissionRequiredMixin, generic.TemplateView):
+    """Displays circulation over a recent period, read from the daily rollups."""
+    query_budget = 12
+    permission_required = 'catalog.view_loan'
+    template_name = "catalog/circulation_dashboard.html"
+    # Numbers of days that can be shown with the 'days' query parameter
+    periods = [7, 30, 90, 365]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        days = self.request.GET.get('days', '')
+        days = int(days) if days.isdigit() and int(days) in self.periods else 30
+        end = rolled_up_until()
+        context['periods'] = self.periods
+        context['days'] = days
+        context['rolled_up_until'] = end
+        if end is not None:
+            context.update(dashboard(end, days))
+        return context
+
+
+# No query budget: the rows are read in chunks while the response streams,
+# after the middleware has counted the view's queries, and their number grows
+# with the size of the export.
+@login_required
+def export(request, name):
+    """Streams an export of loans, books or reviews as CSV or JSON Lines.
+    
+    Rows are streamed as they are read so that large tables do not have to
+    fit in memory."""
+    spec = EXPORTS.get(name)
+    if spec is None:
+        raise Http404()
+    if not request.user.has_perm(spec.permission):
+        raise PermissionDenied()
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'message': 'invalid filters', 'errors': form.errors}, status=400)
+
+    file_format = form.cleaned_data['format']
+    compress = form.cleaned_data['gzip']
+    filename = f"{name}.{file_format}{'.gz' if compress else ''}"
+    content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(
+        stream_export(spec, form.cleaned_data, file_format, compress),
+        content_type='application/gzip' if compress else content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
 class LoanUpdateView(PermissionRequiredMixin, generic.UpdateView):
+    query_budget = 9
     permission_required = 'catalog.change_loan'
     model = Loan
     form_class = LoanForm
@@ -401,6 +639,7 @@ class LoanUpdateView(PermissionRequiredMixin, generic.UpdateView):
 
 
 class LoanDeleteView(PermissionRequiredMixin, generic.DeleteView):
+    query_budget = 9
     permission_required = 'catalog.delete_loan'
     model = Loan
 
@@ -408,24 +647,270 @@ class LoanDeleteView(PermissionRequiredMixin, generic.DeleteView):
         return reverse('catalog:active-loans')
 
 
-def author_search_api(request):
+class CirculationDeskView(PermissionRequiredMixin, generic.TemplateView):
+    """Displays a form for returning or renewing a batch of scanned copies or
+    loans, which are sent to loan_batch_api."""
+    query_budget = 5
+    permission_required = 'catalog.change_loan'
+    template_name = "catalog/circulation_desk.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = LoanBatchForm(initial={'action': 'return', 'kind': 'copies'})
+        context['batch_max'] = LOAN_BATCH_MAX
+        return context
+
+
+# Setting freed copies aside takes a few more queries for each book with waiting
+# holds (see allocate_copies), so the budget is for a batch freeing one such book
+@login_required
+@query_budget(17)
+def loan_batch_api(request):
+    """Returns or renews the open loans of a batch of copies or loans, given as
+    JSON like {"action": "return", "copies": [1, 2], "loans": [3]} on a POST,
+    with an optional "date" (YYYY-MM-DD).
+
+    The loans are closed or extended with set-based queries in one transaction,
+    so a batch takes the same few queries however many ids it has. The result
+    of each id is returned in the order they were sent, including the loans
+    left alone because the date does not suit them."""
+    if not request.user.has_perm('catalog.change_loan'):
+        raise PermissionDenied()
+    if request.method != "POST":
+        return JsonResponse({'message': 'batches must be posted'}, status=405)
+    try:
+        data = json.loads(request.body)
+        copy_ids = list(dict.fromkeys(parse_id(pk) for pk in data.get('copies', [])))
+        loan_ids = list(dict.fromkeys(parse_id(pk) for pk in data.get('loans', [])))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'message': 'invalid ids'}, status=400)
+    if len(copy_ids) + len(loan_ids) > LOAN_BATCH_MAX:
+        return JsonResponse({'message': f'at most {LOAN_BATCH_MAX} ids can be sent at once'}, status=400)
+    form = LoanBatchForm({'action': data.get('action'), 'date': data.get('date')})
+    if not form.is_valid():
+        return JsonResponse({'message': 'invalid batch', 'errors': form.errors}, status=400)
+
+    today = datetime.date.today()
+    copy_loans = open_loans_of_copies(copy_ids)
+    ids = list(dict.fromkeys([*copy_loans.values(), *loan_ids]))
+    statuses = {}
+    set_aside = {}
+    if form.cleaned_data['action'] == 'return':
+        result = return_loans(ids, form.cleaned_data['date'] or today)
+        statuses.update((loan.pk, 'returned') for loan in result.loans)
+        statuses.update((loan_id, 'invalid date') for loan_id in result.invalid_date)
+        if result.holds:
+            # Tell the desk which returned copies go to the hold shelf, and for whom
+            usernames = dict(User.objects.filter(
+                pk__in=[hold.user_id for hold in result.holds]).values_list('pk', 'username'))
+            set_aside = {hold.bookcopy_id: usernames[hold.user_id] for hold in result.holds}
+    else:
+        result = renew_loans(ids, form.cleaned_data['date'] or today + datetime.timedelta(weeks=3))
+        statuses.update((loan.pk, 'renewed') for loan in result.loans)
+        statuses.update((loan_id, 'held') for loan_id in result.held)
+        statuses.update((loan_id, 'invalid date') for loan_id in result.invalid_date)
+    loans = {loan.pk: loan for loan in result.loans}
+
+    results = []
+    items = [('copy', pk, copy_loans.get(pk)) for pk in copy_ids] + [('loan', pk, pk) for pk in loan_ids]
+    for kind, pk, loan_id in items:
+        item = {'type': kind, 'id': pk, 'loan': loan_id, 'status': statuses.get(loan_id, 'not on loan')}
+        if loan_id in loans:
+            item['copy'] = loans[loan_id].bookcopy_id
+            item['due_back_date'] = loans[loan_id].due_back_date
+            item['set_aside_for'] = set_aside.get(item['copy'])
+        results.append(item)
+    return JsonResponse({'action': form.cleaned_data['action'], 'results': results})
+
+
+def cursor_page_response(request, queryset, serialize, **extra):
+    """Returns one page of a queryset as JSON, along with the cursors of the 
+    next and previous pages and any extra items.
+    
+    An empty or missing 'cursor' query parameter selects the first page."""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', API_PAGE_SIZE)), API_MAX_PAGE_SIZE))
+        page = CursorPaginator(queryset, limit).page(request.GET.get('cursor'))
+    except (ValueError, InvalidCursor):
+        return JsonResponse({'message': 'invalid cursor or limit'}, status=400)
+    return JsonResponse({
+        **extra,
+        "results": serialize(page),
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+    })
+
+
+def search_response(request, search, serialize):
+    """Returns everything matching a search query as JSON, or a page of it if 
+    a cursor is given."""
+    results = search(request.GET['query'])
+    if 'cursor' in request.GET:
+        return cursor_page_response(request, results, serialize)
+    return JsonResponse(serialize(results), safe=False)
+
+
+def serialize_authors(authors):
+    return serialize_objects(authors)
+
+
+def serialize_books(books):
+    return serialize_objects(books, prefetch=['authors'])
+
+
+@query_budget(3)
+@conditional(search_lookup)
+async def author_search_api(request):
     """Asynchronously returns all authors matching a search query."""
-    query = request.GET['query']
-    # Get all authors matching the query
-    authors = Author.objects.filter(
-        Q(first_name__icontains=query) |
-        Q(last_name__icontains=query)
-    )
-    # Return JSON response
-    response = [author.serialize() for author in authors]
-    return JsonResponse(response, safe=False)
+    return await sync_to_async(search_response)(
+        request, get_search_backend().search_authors, serialize_authors)
 
 
-def book_search_api(request):
+@query_budget(4)
+@conditional(search_lookup)
+async def book_search_api(request):
     """Asynchronously returns all books matching a search query."""
-    query = request.GET['query']
-    # Get all books matching the query
-    books = Book.objects.filter(title__icontains=query)
-    # Return JSON response
-    response = [book.serialize() for book in books]
-    return JsonResponse(response, safe=False)
\ No newline at end of file
+    return await sync_to_async(search_response)(
+        request, get_search_backend().search_books, serialize_books)
+
+
+@query_budget(4)
+@conditional(book_lookup)
+def book_reviews_api(request, pk):
+    """Returns a book's rating histogram and a page of its most recent reviews.
+    
+    The histogram is read from the statistics stored on the book, so the
+    reviews are never counted."""
+    book = get_object_or_404(Book.objects.only(
+        'rating_count', 'rating_sum', 'rating_histogram'), pk=pk)
+    reviews = Review.objects.filter(book_id=pk).select_related('user').order_by('-timestamp', '-id')
+    return cursor_page_response(
+        request, reviews, lambda page: [review.serialize() for review in page],
+        rating_count=book.rating_count,
+        rating_average=book.average_rating(),
+        histogram=dict(zip(range(1, 11), book.rating_histogram or empty_rating_histogram())),
+    )
+
+
+def parse_id(value):
+    """Returns an id sent by a client as an integer, raising ValueError if it
+    is not one or is out of the range of primary keys."""
+    pk = int(value)
+    if not 0 <= pk <= MAX_ID:
+        raise ValueError(f"id out of range: {pk}")
+    return pk
+
+
+def get_batch_ids(request):
+    """Returns the distinct comma-separated ids of the 'ids' query parameter,
+    or None if they are invalid."""
+    try:
+        return list(dict.fromkeys(parse_id(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()))
+    except ValueError:
+        return None
+
+
+def batch_lookup(model):
+    """Returns a lookup for when the records requested from a batch API last changed."""
+    def lookup(request):
+        ids = get_batch_ids(request)
+        if ids is None or len(ids) > API_MAX_PAGE_SIZE:
+            return None
+        return latest_change(model.objects.filter(pk__in=ids))(request)
+    return lookup
+
+
+def batch_response(request, queryset, serialize, fields):
+    """Returns the records with the comma-separated ids of the 'ids' query
+    parameter as JSON, in that order, along with the ids that were not found.
+    
+    Only the fields listed in the 'fields' query parameter are returned, if
+    it is given. This only trims the response: the records are still loaded
+    and serialized whole, since the serialization cache keeps whole payloads
+    that any later selection of fields can be read from."""
+    ids = get_batch_ids(request)
+    if ids is None:
+        return JsonResponse({'message': 'invalid ids'}, status=400)
+    if len(ids) > API_MAX_PAGE_SIZE:
+        return JsonResponse({'message': f'at most {API_MAX_PAGE_SIZE} ids can be requested'}, status=400)
+    selected = [field for field in request.GET.get('fields', '').split(',') if field] or fields
+    if not set(selected) <= set(fields):
+        return JsonResponse({'message': f'fields must be some of {", ".join(fields)}'}, status=400)
+
+    objects = {obj.pk: obj for obj in queryset.filter(pk__in=ids)} if ids else {}
+    found = [objects[pk] for pk in ids if pk in objects]
+    return JsonResponse({
+        "results": [
+            {"id": obj.pk, **{field: payload[field] for field in selected}}
+            for obj, payload in zip(found, serialize(found))
+        ],
+        "missing": [pk for pk in ids if pk not in objects],
+    })
+
+
+@query_budget(4)
+@conditional(batch_lookup(Book))
+def book_batch_api(request):
+    """Returns the books with some ids, e.g. ?ids=1,2,3&fields=title,authors"""
+    return batch_response(request, Book.objects.all(), serialize_books, BOOK_API_FIELDS)
+
+
+@query_budget(4)
+@conditional(batch_lookup(Author))
+def author_batch_api(request):
+    """Returns the authors with some ids, e.g. ?ids=1,2,3&fields=full_name"""
+    return batch_response(request, Author.objects.all(), serialize_authors, AUTHOR_API_FIELDS)
+
+
+@staff_member_required
+@query_budget(2)
+def serialization_stats_api(request):
+    """Returns the hits and misses of the serialization cache in this process."""
+    return JsonResponse(get_serialization_cache().stats())
+
+
+def autocomplete_response(request, kind, search, serialize):
+    """Returns a small list of suggestions for a search-as-you-type query.
+
+    Results are cached per normalized query for a short time, and carry an 
+    ETag so that browsers can revalidate them without a new body."""
+    query = ' '.join(get_search_tokens(request.GET.get('query', '')))
+    try:
+        limit = int(request.GET.get('limit', AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        return JsonResponse({'message': 'invalid limit'}, status=400)
+    limit = max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+
+    # Look for results cached since the books and authors last changed
+    key = make_key('autocomplete', kind, *search_lookup(request), limit, query)
+    body = cache.get(key)
+    if body is None:
+        results = [serialize(item) for item in search(query)[:limit]] if query else []
+        body = json.dumps(results, separators=(',', ':'))
+        cache.set(key, body, AUTOCOMPLETE_TIMEOUT)
+
+    etag = f'"{hashlib.md5(body.encode()).hexdigest()}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=AUTOCOMPLETE_TIMEOUT)
+    return response
+
+
+@query_budget(3)
+def author_autocomplete_api(request):
+    """Returns the first few authors matching a search query, for search-as-you-type boxes."""
+    return autocomplete_response(
+        request, 'author', get_search_backend().search_authors,
+        lambda author: {"full_name": str(author), "url": author.get_absolute_url()}
+    )
+
+
+@query_budget(3)
+def book_autocomplete_api(request):
+    """Returns the first few books matching a search query, for search-as-you-type boxes."""
+    return autocomplete_response(
+        request, 'book', get_search_backend().search_books,
+        lambda book: {"title": book.title, "url": book.get_absolute_url()}
+    )
\ No newline at end of file
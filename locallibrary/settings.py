@@ -44,12 +44,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'catalog.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'catalog.middleware.WhiteNoiseMiddleware',
+    'catalog.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'catalog.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -58,7 +61,8 @@ ROOT_URLCONF = 'locallibrary.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing template rendering for the Server-Timing header
+        'BACKEND': 'catalog.timing.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -67,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.context_processors.cart',
             ],
         },
     },
@@ -86,6 +91,45 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The local-memory cache evicts the least recently used entries once full.
+# Use a shared cache (e.g. Redis or Memcached) when running several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'locallibrary',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Serialized books and authors returned by the JSON APIs (see catalog/serialization.py).
+# BACKEND is 'memory', 'file' (with a LOCATION directory) or 'django' (with a cache alias as LOCATION).
+# Payloads expire after TIMEOUT seconds. The 'file' backend, or 'django' on a shared cache, needs
+# VERSIONS set to the alias of a cache shared by every process, such as Redis or memcached.
+
+CATALOG_SERIALIZATION_CACHE = {
+    'BACKEND': 'memory',
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 3600,
+}
+
+# Server-Timing headers and profiling (see ServerTimingMiddleware in catalog/middleware.py).
+# SAMPLE_RATE profiles one request in N, and THRESHOLD_MS profiles the next request to a
+# view after one slower than it; both are off when 0.
+
+CATALOG_PROFILING = {
+    'SERVER_TIMING': True,
+    'DIRECTORY': os.environ.get('CATALOG_PROFILE_DIR', str(BASE_DIR / 'profiles')),
+    'SAMPLE_RATE': int(os.environ.get('CATALOG_PROFILE_SAMPLE_RATE', 0)),
+    'THRESHOLD_MS': int(os.environ.get('CATALOG_PROFILE_THRESHOLD_MS', 0)),
+    'MAX_FILES': 20,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -127,6 +171,10 @@ LOGOUT_REDIRECT_URL = '/'
 
 AUTH_USER_MODEL = 'accounts.User'
 
+# Emails (such as overdue notices) are printed to the console during development
+if DEBUG:
+    EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
 # Heroku: Update database configuration from $DATABASE_URL.
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)